@@ -0,0 +1,159 @@
+#!/usr/bin/python
+'''
+Analyze every .py file of a directory tree in a pool of worker
+processes and merge the results.
+
+    python batch.py [-j JOBS] [-o OUT.json] [--cache DIR]
+                    [--history POLICY,...] [--query CLASS,...] path ...
+
+Every worker runs checkFile on one file at a time and sends back a
+plain, picklable projection of its history and method invocation
+info. The parent merges them in the sorted order of the file names,
+so the output doesn't depend on the number of workers or on which
+worker finished first.
+'''
+import json
+import logging
+import multiprocessing
+import optparse
+import os
+import sys
+
+import pysonar
+
+
+def findFiles(paths):
+    ret = []
+    for path in paths:
+        if os.path.isdir(path):
+            for (dirpath, dirnames, filenames) in os.walk(path):
+                ret.extend(os.path.join(dirpath, name)
+                           for name in filenames if name.endswith('.py'))
+        else:
+            ret.append(path)
+    return sorted(set(ret))
+
+
+# the nodes of the file itself, imported modules have their own results
+def projectHistory(history, filename):
+    ret = []
+    for (node, ts) in history.iteritems():
+        if getattr(node, 'filename', None) != filename:
+            continue
+        ret.append([getattr(node, 'lineno', 0), getattr(node, 'col_offset', 0),
+                    repr(node), sorted(map(repr, ts))])
+    ret.sort()
+    return ret
+
+
+def projectInvocations(info):
+    ret = {}
+    for (name, records) in info.iteritems():
+        ret[name] = [[map(pysonar.projectTypes, ctorargs),
+                      map(pysonar.projectTypes, callargs)]
+                     for (ctorargs, callargs, _) in records]
+    return ret
+
+
+def initWorker(cacheDir, history, query):
+    if cacheDir:
+        pysonar.setCacheDir(cacheDir)
+    pysonar.setHistoryPolicy(*history)
+    pysonar.setQuery(query)
+
+
+def analyzeFile(filename):
+    '@types: str -> dict'
+    # modules are found next to the analyzed file. Forget the ones
+    # of the last file, so the result doesn't depend on what this
+    # worker did before; the module cache is what is shared
+    pysonar.PYTHONPATH[:] = [os.path.dirname(filename)]
+    pysonar.imported_modules.clear()
+    pysonar.moduleDeps.clear()
+    ret = {'file': filename, 'error': None,
+           'history': [], 'invocations': {}}
+    try:
+        pysonar.checkFile(filename)
+        ret['history'] = projectHistory(pysonar.history, filename)
+        ret['invocations'] = projectInvocations(
+            pysonar.getMethodInvocationInfo())
+    except Exception, e:
+        ret['error'] = '%s: %s' % (e.__class__.__name__, e)
+    return ret
+
+
+def merge(results):
+    '@types: list[dict] -> dict'
+    files = {}
+    invocations = {}
+    errors = {}
+    for result in sorted(results, key=lambda r: r['file']):
+        files[result['file']] = result['history']
+        if result['error'] is not None:
+            errors[result['file']] = result['error']
+        for (name, records) in sorted(result['invocations'].iteritems()):
+            for (ctorargs, callargs) in records:
+                invocations.setdefault(name, []).append(
+                    {'file': result['file'], 'ctorargs': ctorargs,
+                     'callargs': callargs})
+    return {'files': files, 'invocations': invocations, 'errors': errors}
+
+
+def analyze(paths, jobs=None, cacheDir=None, history=('all',), query=None):
+    '@types: list[str], int, str, list[str], list[str] -> dict'
+    files = findFiles(paths)
+    if jobs == 1:
+        # the workers' globals are the caller's here, put them back
+        saved = (pysonar.historyMask, pysonar.CACHE_DIR, pysonar.QUERY,
+                 pysonar.PYTHONPATH[:], dict(pysonar.imported_modules),
+                 dict(pysonar.moduleDeps))
+        initWorker(cacheDir, history, query)
+        try:
+            return merge(map(analyzeFile, files))
+        finally:
+            (pysonar.historyMask, pysonar.CACHE_DIR, oldQuery,
+             pysonar.PYTHONPATH[:], modules, deps) = saved
+            pysonar.imported_modules.clear()
+            pysonar.imported_modules.update(modules)
+            pysonar.moduleDeps.clear()
+            pysonar.moduleDeps.update(deps)
+            pysonar.setQuery(oldQuery)
+    pool = multiprocessing.Pool(jobs, initWorker, (cacheDir, history, query))
+    try:
+        results = list(pool.imap(analyzeFile, files, chunksize=1))
+    finally:
+        pool.close()
+        pool.join()
+    return merge(results)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='%prog [options] path ...')
+    parser.add_option('-j', '--jobs', type='int', default=None,
+                      help='number of worker processes (default: all cores)')
+    parser.add_option('-o', '--output', default=None,
+                      help='write the merged results to this file')
+    parser.add_option('--cache', default=os.environ.get('PYSONAR_CACHE'),
+                      help='directory of the module cache')
+    parser.add_option('--history', default='all',
+                      help='what to keep of the history: all, names, '
+                      'module-names, funcs, errors or off (default: all)')
+    parser.add_option('--query', default=None,
+                      help='only the invocations of these classes, '
+                      'skips code which can\'t reach them')
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error('no input paths')
+    logging.basicConfig(level=logging.WARN)
+
+    result = analyze(args, options.jobs, options.cache,
+                     options.history.split(','),
+                     options.query and options.query.split(','))
+    if options.output:
+        out = open(options.output, 'w')
+    else:
+        out = sys.stdout
+    json.dump(result, out, indent=1, sort_keys=True)
+    out.write('\n')
+    for (filename, error) in sorted(result['errors'].iteritems()):
+        sys.stderr.write('%s: %s\n' % (filename, error))
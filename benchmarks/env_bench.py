@@ -0,0 +1,56 @@
+#!/usr/bin/python
+'''
+Compare association lists (lists.py) with hash tries (hamt.py)
+as environments: building by ext, lookup of every name and
+mergeEnv of two branches that share a common prefix.
+
+    python benchmarks/env_bench.py [size ...]
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lists import nil, ext, lookup
+from hamt import HashTrie
+import pysonar
+
+
+def build(n, empty):
+    env = empty
+    for i in xrange(n):
+        env = ext('name%d' % i, [i], env)
+    return env
+
+
+def lookupAll(n, env):
+    for i in xrange(n):
+        lookup('name%d' % i, env)
+
+
+def mergeBranches(env):
+    env1 = ext('name0', ['then'], env)
+    env2 = ext('name0', ['else'], env)
+    pysonar.mergeEnv(env1, env2)
+
+
+def timeIt(fn, repeat=3, number=1):
+    return min(timeit.repeat(fn, repeat=repeat, number=number))
+
+
+def run(sizes):
+    print '%8s %-8s %12s %12s %12s' % ('size', 'env', 'ext', 'lookup', 'merge')
+    for n in sizes:
+        for (label, empty) in [('lists', nil), ('hamt', HashTrie())]:
+            env = build(n, empty)
+            t_ext = timeIt(lambda: build(n, empty))
+            t_lookup = timeIt(lambda: lookupAll(n, env))
+            t_merge = timeIt(lambda: mergeBranches(env))
+            print '%8d %-8s %12.6f %12.6f %12.6f' % (n, label, t_ext,
+                                                    t_lookup, t_merge)
+
+
+if __name__ == '__main__':
+    sizes = map(int, sys.argv[1:]) or [10, 100, 1000, 3000]
+    run(sizes)
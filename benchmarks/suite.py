@@ -0,0 +1,232 @@
+#!/usr/bin/python
+'''
+Time checkFile on every file of tests/ and on synthetic programs of
+growing size, and compare the results with a baseline.
+
+    python benchmarks/suite.py [--save FILE] [--compare FILE]
+                               [--repeat N] [--quick] [--engine NAME]
+
+Every case runs in a fresh process, so imported modules and caches
+don't carry over and the peak resident memory (ru_maxrss) is the
+case's own. The time is the best of --repeat runs.
+
+For the synthetic generators, the growth exponent between the
+smallest and the largest size (log(t2 / t1) / log(n2 / n1)) is
+reported as well: 1 is linear,
+2 quadratic. A case is a regression if it got slower than the
+baseline by more than --tolerance, or if its exponent grew by more
+than 0.5.
+'''
+import glob
+import json
+import math
+import multiprocessing
+import optparse
+import os
+import resource
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.setrecursionlimit(10000)
+
+import pysonar
+
+
+#-------------------------------------------------------------
+# synthetic programs
+#-------------------------------------------------------------
+def dictLiteral(n):
+    items = ["    'key%d': 'value%d'," % (i, i) for i in xrange(n)]
+    return 'D = {\n' + '\n'.join(items) + '\n}\n'
+
+
+def constructorCalls(n):
+    lines = ['class Holder:',
+             '    def __init__(self, name):',
+             '        self.name = name',
+             '',
+             '    def set(self, key, value):',
+             '        self.key = value',
+             '']
+    for i in xrange(n):
+        lines.append("h%d = Holder('name%d')" % (i, i))
+        lines.append("h%d.set('key', %d)" % (i, i))
+    return '\n'.join(lines) + '\n'
+
+
+def callChain(n):
+    lines = []
+    for i in xrange(n - 1):
+        lines.append('def f%d(x):' % i)
+        lines.append('    return f%d(x)' % (i + 1))
+    lines.append('def f%d(x):' % (n - 1))
+    lines.append('    return x')
+    lines.append("r = f0('end')")
+    return '\n'.join(lines) + '\n'
+
+
+def classHierarchy(n):
+    lines = ['class Base:',
+             '    def __init__(self, x):',
+             '        self.x = x',
+             '',
+             '    def get(self):',
+             '        return self.x',
+             '']
+    for i in xrange(n):
+        lines.append('class C%d(Base):' % i)
+        lines.append('    def m%d(self):' % i)
+        lines.append('        return self.get()')
+        lines.append('o%d = C%d(%d)' % (i, i, i))
+        lines.append('r%d = o%d.m%d()' % (i, i, i))
+    return '\n'.join(lines) + '\n'
+
+
+def straightLine(n):
+    lines = ['x0 = 0']
+    for i in xrange(1, n):
+        lines.append('x%d = x%d' % (i, i - 1))
+    return '\n'.join(lines) + '\n'
+
+
+GENERATORS = [('dict', dictLiteral, [250, 500, 1000]),
+              ('ctor', constructorCalls, [75, 150, 300]),
+              ('chain', callChain, [50, 100, 200]),
+              ('hierarchy', classHierarchy, [50, 100, 200]),
+              ('straight', straightLine, [1000, 2000, 4000])]
+
+
+def getCases(quick):
+    '@types: bool -> list[tuple[str, str, str, int]]'
+    cases = []
+    for filename in sorted(glob.glob(os.path.join(ROOT, 'tests', '*.py'))):
+        name = 'tests/' + os.path.basename(filename)
+        cases.append((name, 'file', filename, None))
+    for (name, _, sizes) in GENERATORS:
+        if quick:
+            sizes = sizes[:2]
+        for n in sizes:
+            cases.append(('%s/%d' % (name, n), 'gen', name, n))
+    return cases
+
+
+#-------------------------------------------------------------
+# running
+#-------------------------------------------------------------
+def runCase(case, repeat, engine):
+    '@types: tuple, int, str -> dict'
+    (name, kind, arg, n) = case
+    pysonar.setEngine(engine)
+    if kind == 'file':
+        pysonar.addToPythonPath(os.path.dirname(arg))
+        source = open(arg).read()
+        filename = arg
+    else:
+        source = dict((g[0], g[1]) for g in GENERATORS)[arg](n)
+        filename = '<%s>' % name
+    best = None
+    error = None
+    for _ in xrange(repeat):
+        start = time.time()
+        try:
+            pysonar.checkExp(pysonar.createAST(source, filename))
+        except Exception, e:
+            error = '%s: %s' % (e.__class__.__name__, e)
+            break
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return {'time': best, 'error': error,
+            'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'history': len(pysonar.history)}
+
+
+def run(cases, repeat, engine):
+    results = {}
+    for case in cases:
+        pool = multiprocessing.Pool(1)      # a fresh process per case
+        try:
+            result = pool.apply(runCase, (case, repeat, engine))
+        finally:
+            pool.close()
+            pool.join()
+        results[case[0]] = result
+        sys.stderr.write('%-32s %s\n' % (case[0], formatResult(result)))
+    return {'engine': engine, 'cases': results,
+            'exponents': exponents(results)}
+
+
+def formatResult(result):
+    if result['error'] is not None:
+        return result['error']
+    return '%9.4fs %8d KB' % (result['time'], result['maxrss'])
+
+
+# growth exponent between the smallest and the largest size of each
+# generator, the widest span is the least noisy
+def exponents(results):
+    ret = {}
+    for (name, _, sizes) in GENERATORS:
+        done = [n for n in sizes if results.get('%s/%d' % (name, n))
+                and results['%s/%d' % (name, n)]['time']]
+        if len(done) < 2:
+            continue
+        (n1, n2) = (done[0], done[-1])
+        t1 = results['%s/%d' % (name, n1)]['time']
+        t2 = results['%s/%d' % (name, n2)]['time']
+        ret['%s/%d-%d' % (name, n1, n2)] = (math.log(t2 / t1)
+                                           / math.log(float(n2) / n1))
+    return ret
+
+
+SLACK = 0.05
+
+
+def compare(current, baseline, tolerance):
+    '@types: dict, dict, float -> list[str]'
+    problems = []
+    for (name, old) in sorted(baseline['cases'].iteritems()):
+        new = current['cases'].get(name)
+        if new is None or old['time'] is None:
+            continue
+        if new['time'] is None:
+            problems.append('%s: %s' % (name, new['error']))
+        # differences below SLACK seconds are noise
+        elif new['time'] > old['time'] * (1 + tolerance) + SLACK:
+            problems.append('%s: %.4fs, was %.4fs'
+                            % (name, new['time'], old['time']))
+    for (name, old) in sorted(baseline['exponents'].iteritems()):
+        new = current['exponents'].get(name)
+        if new is not None and new > old + 0.5:
+            problems.append('%s: grows like n^%.2f, was n^%.2f'
+                            % (name, new, old))
+    return problems
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--save', help='write the results to this file')
+    parser.add_option('--compare', help='compare with this baseline file')
+    parser.add_option('--repeat', type='int', default=3)
+    parser.add_option('--tolerance', type='float', default=0.5,
+                      help='allowed slowdown, 0.5 is 50%')
+    parser.add_option('--quick', action='store_true',
+                      help='only the two smallest sizes of each generator')
+    parser.add_option('--engine', default='recursive')
+    (options, args) = parser.parse_args()
+
+    current = run(getCases(options.quick), options.repeat, options.engine)
+    for (name, e) in sorted(current['exponents'].iteritems()):
+        sys.stderr.write('%-32s n^%.2f\n' % (name, e))
+    if options.save:
+        f = open(options.save, 'w')
+        json.dump(current, f, indent=1, sort_keys=True)
+        f.close()
+    if options.compare:
+        problems = compare(current, json.load(open(options.compare)),
+                           options.tolerance)
+        for problem in problems:
+            sys.stderr.write('REGRESSION %s\n' % problem)
+        sys.exit(1 if problems else 0)
@@ -0,0 +1,109 @@
+# cfg.py - control-flow graphs of statement sequences for pysonar
+from ast import If, While, For, With, TryExcept, TryFinally, ExceptHandler,\
+    Return
+
+
+#-------------------------------------------------------------
+# node kinds
+#-------------------------------------------------------------
+STMT = 0        # statement which doesn't change control flow
+RETURN = 1      # succ is where the (unreachable) rest starts
+FORK = 2        # compound statement, starts its arms
+JOIN = 3        # end of a compound statement, merges its arms
+EXIT = 4        # end of a sequence
+
+
+class CFGNode(object):
+    __slots__ = ('index', 'kind', 'stmt', 'succ', 'exit', 'arms', 'join',
+                 'rest', 'owner')
+
+    def __init__(self, index, kind, stmt):
+        self.index = index
+        self.kind = kind
+        self.stmt = stmt
+        self.succ = None        # index of the next node
+        self.exit = None        # index of the EXIT of the enclosing sequence
+        self.arms = None        # FORK: list of (entry index, statements)
+        self.join = None        # FORK: index of the matching JOIN
+        self.rest = None        # RETURN, JOIN: statements after this one
+        self.owner = None       # EXIT: (join index, arm) or None for the top
+
+    def __repr__(self):
+        return "<%d %s %s>" % (self.index,
+                               ['stmt', 'return', 'fork', 'join',
+                                'exit'][self.kind],
+                               self.stmt)
+
+
+def getArms(e):
+    if isinstance(e, (If, While, For)):
+        return [e.body, e.orelse]
+    elif isinstance(e, TryExcept):
+        return [e.body, e.orelse, e.handlers]
+    elif isinstance(e, TryFinally):
+        return [e.body, e.finalbody]
+    elif isinstance(e, (With, ExceptHandler)):
+        return [e.body]
+    else:
+        return None
+
+
+class CFG:
+    '''
+    Graph of a statement sequence and all sequences nested in it.
+    Nodes are numbered in source order and every edge goes to a larger
+    index; loops are not unrolled, their bodies are analyzed once.
+    '''
+    def __init__(self, body):
+        '@types: list[ast.stmt]'
+        self.nodes = []
+        (self.entry, self.exit) = self.sequence(body)
+
+    def node(self, kind, stmt=None):
+        n = CFGNode(len(self.nodes), kind, stmt)
+        self.nodes.append(n)
+        return n
+
+    def sequence(self, stmts):
+        '@types: list[ast.stmt] -> int, CFGNode'
+        heads = []                  # first node of every statement
+        tails = []                  # node continuing to the next statement
+        for i in xrange(len(stmts)):
+            e = stmts[i]
+            arms = getArms(e)
+            if isinstance(e, Return):
+                n = self.node(RETURN, e)
+                n.rest = stmts[i + 1:]
+                heads.append(n)
+                tails.append(n)
+            elif arms is not None:
+                fork = self.node(FORK, e)
+                fork.arms = []
+                exits = []
+                for body in arms:
+                    (entry, exit) = self.sequence(body)
+                    fork.arms.append((entry, body))
+                    exits.append(exit)
+                join = self.node(JOIN, e)
+                join.rest = stmts[i + 1:]
+                fork.join = join.index
+                for k in xrange(len(exits)):
+                    exits[k].owner = (join.index, k)
+                heads.append(fork)
+                tails.append(join)
+            else:
+                n = self.node(STMT, e)
+                heads.append(n)
+                tails.append(n)
+
+        exit = self.node(EXIT)
+        for i in xrange(len(tails)):
+            if i + 1 < len(heads):
+                tails[i].succ = heads[i + 1].index
+            else:
+                tails[i].succ = exit.index
+            tails[i].exit = exit.index
+        if heads:
+            return (heads[0].index, exit)
+        else:
+            return (exit.index, exit)
@@ -0,0 +1,258 @@
+# hamt.py - persistent hash tries for pysonar environments
+
+
+#-------------------------------------------------------------
+# a hash array mapped trie (HAMT)
+#
+# Every operation returns a new trie and shares all untouched
+# nodes with the old one, so extending an environment in one
+# branch never disturbs the environment of another branch.
+# Lookup walks at most HASHBITS / BITS levels.
+#-------------------------------------------------------------
+from lists import SimplePair
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+HASHBITS = 64
+HASHMASK = (1 << HASHBITS) - 1
+
+
+def popcount(x):
+    return bin(x).count('1')
+
+
+def hashOf(key):
+    return hash(key) & HASHMASK
+
+
+class Leaf(object):
+    __slots__ = ('hash', 'key', 'value', 'seq')
+
+    def __init__(self, h, key, value, seq):
+        self.hash = h
+        self.key = key
+        self.value = value
+        self.seq = seq
+
+
+class Collision(object):
+    '''leaves whose keys have exactly the same hash'''
+    __slots__ = ('hash', 'leaves')
+
+    def __init__(self, h, leaves):
+        self.hash = h
+        self.leaves = leaves
+
+
+class Node(object):
+    __slots__ = ('bitmap', 'items', 'size')
+
+    def __init__(self, bitmap, items, size):
+        self.bitmap = bitmap
+        self.items = items
+        self.size = size            # number of leaves below
+
+
+def size(node):
+    if node is None:
+        return 0
+    elif isinstance(node, Leaf):
+        return 1
+    elif isinstance(node, Collision):
+        return len(node.leaves)
+    return node.size
+
+
+def fragment(h, shift):
+    return 1 << ((h >> shift) & MASK)
+
+
+def index(bitmap, bit):
+    return popcount(bitmap & (bit - 1))
+
+
+def leaves(node):
+    if node is None:
+        return
+    if isinstance(node, Leaf):
+        yield node
+    elif isinstance(node, Collision):
+        for leaf in node.leaves:
+            yield leaf
+    else:
+        for item in node.items:
+            for leaf in leaves(item):
+                yield leaf
+
+
+# nodes visited by find(), a deterministic measure of lookup work
+steps = 0
+
+
+def find(node, h, key, shift):
+    global steps
+    while node is not None:
+        steps += 1
+        if isinstance(node, Node):
+            bit = fragment(h, shift)
+            if not node.bitmap & bit:
+                return None
+            node = node.items[index(node.bitmap, bit)]
+            shift += BITS
+        elif isinstance(node, Leaf):
+            if node.hash == h and node.key == key:
+                return node
+            return None
+        else:
+            if node.hash != h:
+                return None
+            for leaf in node.leaves:
+                if leaf.key == key:
+                    return leaf
+            return None
+    return None
+
+
+# put two entries with different hashes into one fresh node
+def pair(n1, n2, shift):
+    bit1 = fragment(n1.hash, shift)
+    bit2 = fragment(n2.hash, shift)
+    n = size(n1) + size(n2)
+    if bit1 == bit2:
+        return Node(bit1, (pair(n1, n2, shift + BITS),), n)
+    elif bit1 < bit2:
+        return Node(bit1 | bit2, (n1, n2), n)
+    else:
+        return Node(bit1 | bit2, (n2, n1), n)
+
+
+# returns (new node, whether the key is new)
+def insert(node, leaf, shift):
+    if node is None:
+        return (leaf, True)
+
+    if isinstance(node, Leaf):
+        if node.hash != leaf.hash:
+            return (pair(node, leaf, shift), True)
+        elif node.key == leaf.key:
+            return (leaf, False)
+        else:
+            return (Collision(leaf.hash, (node, leaf)), True)
+
+    if isinstance(node, Collision):
+        if node.hash != leaf.hash:
+            return (pair(node, leaf, shift), True)
+        items = list(node.leaves)
+        for i in xrange(len(items)):
+            if items[i].key == leaf.key:
+                items[i] = leaf
+                return (Collision(node.hash, tuple(items)), False)
+        items.append(leaf)
+        return (Collision(node.hash, tuple(items)), True)
+
+    bit = fragment(leaf.hash, shift)
+    i = index(node.bitmap, bit)
+    if not node.bitmap & bit:
+        items = node.items[:i] + (leaf,) + node.items[i:]
+        return (Node(node.bitmap | bit, items, node.size + 1), True)
+    (child, added) = insert(node.items[i], leaf, shift + BITS)
+    items = node.items[:i] + (child,) + node.items[i + 1:]
+    return (Node(node.bitmap, items, node.size + added), added)
+
+
+# keep only the keys present in both nodes, combining their values
+# with f. Returns (new node, number of keys)
+def intersect(n1, n2, shift, f):
+    if n1 is None or n2 is None:
+        return (None, 0)
+    if n1 is n2:
+        return (n1, size(n1))
+
+    if isinstance(n1, Node) and isinstance(n2, Node):
+        bitmap = 0
+        items = []
+        count = 0
+        common = n1.bitmap & n2.bitmap
+        for k in xrange(WIDTH):
+            bit = 1 << k
+            if common & bit:
+                c1 = n1.items[index(n1.bitmap, bit)]
+                c2 = n2.items[index(n2.bitmap, bit)]
+                (child, n) = intersect(c1, c2, shift + BITS, f)
+                if child is not None:
+                    bitmap |= bit
+                    items.append(child)
+                    count += n
+        if count == 0:
+            return (None, 0)
+        return (Node(bitmap, tuple(items), count), count)
+
+    ret = None
+    count = 0
+    for leaf1 in leaves(n1):
+        leaf2 = find(n2, leaf1.hash, leaf1.key, shift)
+        if leaf2 is not None:
+            if leaf1 is leaf2:
+                leaf = leaf1
+            else:
+                leaf = Leaf(leaf1.hash, leaf1.key,
+                            f(leaf1.value, leaf2.value), leaf1.seq)
+            (ret, _) = insert(ret, leaf, shift)
+            count += 1
+    return (ret, count)
+
+
+class HashTrie(object):
+    '''
+    Persistent map from names to values with the same shadowing
+    behaviour as an association list: the last binding of a key wins.
+    '''
+    __slots__ = ('root', 'count', 'seq')
+
+    def __init__(self, root=None, count=0, seq=0):
+        self.root = root
+        self.count = count
+        self.seq = seq
+
+    def assoc(self, key, value):
+        '@types: object, object -> HashTrie'
+        leaf = Leaf(hashOf(key), key, value, self.seq + 1)
+        (root, added) = insert(self.root, leaf, 0)
+        return HashTrie(root, self.count + added, self.seq + 1)
+
+    def get(self, key):
+        leaf = find(self.root, hashOf(key), key, 0)
+        if leaf is None:
+            return None
+        return leaf.value
+
+    def __contains__(self, key):
+        return find(self.root, hashOf(key), key, 0) is not None
+
+    def merge(self, other, f):
+        '''
+        Keep only the keys bound in both tries, binding each to
+        f(value in self, value in other). Subtries shared by both
+        sides are reused without visiting them.
+        @types: HashTrie, (object, object -> object) -> HashTrie
+        '''
+        (root, count) = intersect(self.root, other.root, 0, f)
+        return HashTrie(root, count, max(self.seq, other.seq))
+
+    def __len__(self):
+        return self.count
+
+    # iterate like an association list: newest binding first
+    def __iter__(self):
+        ls = sorted(leaves(self.root), key=lambda leaf: -leaf.seq)
+        return iter([SimplePair(leaf.key, leaf.value) for leaf in ls])
+
+    def __repr__(self):
+        ret = []
+        for leaf in leaves(self.root):
+            if len(ret) == 100:
+                ret.append('...')
+                break
+            ret.append("(" + repr(leaf.key) + " . " + repr(leaf.value) + ")")
+        return "(" + " ".join(ret) + ")"
@@ -23,13 +23,17 @@ class ListIterator:
         return ret
 
 
-class Nil:
+class Nil(object):
     def __repr__(self):
         return "()"
 
     def __iter__(self):
         return ListIterator(self)
 
+    # unpickle as the same singleton, lists end where p == nil
+    def __reduce__(self):
+        return 'nil'
+
 nil = Nil()
 
 
@@ -167,8 +171,14 @@ def append(*lists):
     return foldl(append1, nil, slist(lists))
 
 
+# pairs looked at by assq(), a deterministic measure of lookup work
+steps = 0
+
+
 def assq(x, s):
+    global steps
     for p in s:
+        steps += 1
         if x == first(p):
             return p
     return None
@@ -183,14 +193,33 @@ def ziplist(ls1, ls2):
     return reverse(ret)
 
 
+def isList(s):
+    return s is nil or isinstance(s, LinkedList)
+
+
 # building association lists
+# s is either an association list or a persistent map (hamt.HashTrie)
 def ext(x, v, s):
+    if not isList(s):
+        return s.assoc(x, v)
     return LinkedList(SimplePair(x, v), s)
 
 
 def lookup(x, s):
+    if not isList(s):
+        return s.get(x)
     p = assq(x, s)
     if p != None:
         return rest(p)
     else:
         return None
+
+
+# bind all pairs of the association list ls over s, so that
+# bindings in ls shadow those in s
+def extend(ls, s):
+    if isList(s):
+        return append(ls, s)
+    for p in reverse(ls):
+        s = ext(first(p), rest(p), s)
+    return s
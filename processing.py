@@ -3,6 +3,7 @@ import pysonar
 import sys
 import os
 import ast
+import logging
 from collections import defaultdict
 
 # lookup arg in env if it is Name
@@ -14,9 +15,45 @@ def convertName(arg, env):
 import cProfile
 
 if __name__ == '__main__':
+    # PYSONAR_TRACE=file writes the debug trace, PYSONAR_TRACE_RING=n
+    # keeps the last n messages and prints them if the analysis fails
+    if os.environ.get('PYSONAR_TRACE'):
+        logging.basicConfig(filename=os.environ['PYSONAR_TRACE'],
+                            level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.WARN)
+    ring = os.environ.get('PYSONAR_TRACE_RING')
+    if os.environ.get('PYSONAR_TRACE') or ring:
+        pysonar.enableTracing(int(ring) if ring else None)
     pysonar.addToPythonPath(os.path.dirname(sys.argv[1]))
+    # records only need the names used in the arguments (convertName)
+    pysonar.useEnvSnapshots(True)
+    if os.environ.get('PYSONAR_HISTORY'):
+        pysonar.setHistoryPolicy(*os.environ['PYSONAR_HISTORY'].split(','))
+    # PYSONAR_PROFILE=self|total|visits|calls|hits|cutoffs|location
+    # prints what each analyzed function cost, sorted by that column
+    if os.environ.get('PYSONAR_PROFILE'):
+        pysonar.useProfiling(True)
+    # PYSONAR_ALLOC_SITES=depth makes one object per constructor call
+    # site and depth innermost callers
+    if os.environ.get('PYSONAR_ALLOC_SITES'):
+        pysonar.useAllocationSites(True, int(os.environ['PYSONAR_ALLOC_SITES']))
+    # PYSONAR_QUERY=Class,... records only the invocations of these
+    # classes and skips the code which can't reach them
+    if os.environ.get('PYSONAR_QUERY'):
+        pysonar.setQuery(os.environ['PYSONAR_QUERY'].split(','))
+    if os.environ.get('PYSONAR_CACHE'):
+        pysonar.setCacheDir(os.environ['PYSONAR_CACHE'])
+    if os.environ.get('PYSONAR_JSONL'):
+        # stream the invocations instead of collecting them in MYDICT
+        pysonar.setInvocationSink(
+            pysonar.JsonlSink(open(os.environ['PYSONAR_JSONL'], 'w')))
     #cProfile.run('pysonar.checkFile("' + sys.argv[1] + '")')
-    pysonar.checkFile(sys.argv[1])
+    try:
+        pysonar.checkFile(sys.argv[1])
+    except:
+        pysonar.dumpTrace()
+        raise
     constructor_params = defaultdict(set)
     for class_name, val in pysonar.getMethodInvocationInfo().items():
         print class_name
@@ -28,3 +65,10 @@ if __name__ == '__main__':
                     constructor_params[class_name].add(first_constructor_arg)
 #            print '\t', constrargs, map(lambda arg: convertName(arg, env), args)
     print constructor_params
+    sys.stderr.write('function summaries: %(hits)d hits, %(misses)d misses\n'
+                     % pysonar.getSummaryStats())
+    if pysonar.PROFILING:
+        pysonar.printProfile(os.environ['PYSONAR_PROFILE'], out=sys.stderr)
+    if pysonar.CACHE_DIR:
+        sys.stderr.write('module cache: %(hits)d hits, %(misses)d misses\n'
+                         % pysonar.getCacheStats())
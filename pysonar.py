@@ -5,24 +5,101 @@ import re
 import ast
 from ast import *
 from lists import lookup, nil, ext, first, rest, assq, reverse, maplist,\
-    SimplePair, append
-
-from collections import defaultdict
+    SimplePair, LinkedList, extend, isList
+from hamt import HashTrie
+import lists
+import hamt
+from cfg import CFG, STMT, RETURN, FORK, JOIN
+from query import QueryIndex
+
+from collections import defaultdict, OrderedDict, deque
 import os
 import logging
-from functools import partial
+import hashlib
+import difflib
+import cPickle
+import json
+import time
+import weakref
+from heapq import heappush, heappop
 
-logging.basicConfig(filename="_pysonar.log", level=logging.DEBUG)
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.WARN)
+logger.addHandler(logging.NullHandler())   # the application configures logging
+
+
+####################################################################
+## tracing
+####################################################################
+# debug(), warn() and error() keep their arguments and only join them
+# into a string when a handler actually writes the message. Tracing
+# (debug) is off by default: debug is then a function that does
+# nothing, and the hot paths check TRACING before calling it at all.
+# enableTracing(ring=n) also keeps the last n messages for dumpTrace.
+TRACING = False
+traceBuffer = None          # deque of (level, args)
+
+
+class Message(object):
+    __slots__ = ('args',)
+
+    def __init__(self, args):
+        self.args = args
+
+    def __str__(self):
+        return ' '.join(map(str, self.args))
+
+
+def noTrace(*args):
+    pass
+
 
+def trace(*args):
+    if traceBuffer is not None:
+        traceBuffer.append(('DEBUG', args))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(Message(args))
 
-def _log(fn, *args):
-    fn(' '.join(map(str, args)))
 
-debug = partial(_log, logger.debug)
-warn = partial(_log, logger.warn)
-error = partial(_log, logger.error)
+def warn(*args):
+    if traceBuffer is not None:
+        traceBuffer.append(('WARNING', args))
+    logger.warn(Message(args))
+
+
+def error(*args):
+    if traceBuffer is not None:
+        traceBuffer.append(('ERROR', args))
+    logger.error(Message(args))
+
+debug = noTrace
+
+
+def enableTracing(ring=None):
+    '''
+    Send debug messages to the logger, and keep the last ring
+    messages of every level in memory if ring is given.
+    @types: int -> None
+    '''
+    global TRACING, debug, traceBuffer
+    TRACING = True
+    debug = trace
+    if ring is not None:
+        traceBuffer = deque(maxlen=ring)
+
+
+def disableTracing():
+    global TRACING, debug, traceBuffer
+    TRACING = False
+    debug = noTrace
+    traceBuffer = None
+
+
+# write the kept messages, formatted now, e.g. after a crash
+def dumpTrace(out=sys.stderr):
+    if traceBuffer is None:
+        return
+    for (level, args) in traceBuffer:
+        out.write('%s: %s\n' % (level, Message(args)))
 
 
 ####################################################################
@@ -39,6 +116,14 @@ IS = isinstance
 MYDICT = defaultdict(list)
 PYTHONPATH = []
 
+# environments of the analyzed code are persistent hash tries,
+# association lists are still used for small local bindings
+emptyEnv = HashTrie()
+
+# how statement sequences are analyzed: 'recursive' (inferSeqRec)
+# or 'worklist' (inferSeqWorklist)
+ENGINE = 'recursive'
+
 
 ####################################################################
 ## utilities
@@ -78,26 +163,183 @@ def isDef(node):
 ##################################################################
 # per-node information store
 ##################################################################
-history = {}
+class History:
+    '''
+    Types of AST nodes, kept in lists indexed by a dense slot number,
+    with indexes of the recorded nodes by node class and by Name.id.
+    Reads like the dict {node: TypeSet} it replaces.
+
+    A node gets the next slot when it is first recorded, and keeps it
+    in node.nid, so the tables only grow with the recorded nodes. A
+    slot left on a node by another History or before clear() doesn't
+    hold the node here, and the node gets a new one.
+    '''
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.nodes = []         # slot -> node, in the order recorded
+        self.types = []         # slot -> TypeSet
+        self.kinds = {}         # node class -> slots
+        self.names = {}         # Name.id -> slots
+        self.keyIds = {}        # slots of keyword names, which aren't nodes
+
+    def find(self, node):
+        if not IS(node, AST):
+            return self.keyIds.get(node)
+        nid = getattr(node, 'nid', None)
+        if (nid is not None and nid < len(self.nodes)
+            and self.nodes[nid] is node):
+            return nid
+        return None
+
+    def get(self, node, default=None):
+        nid = self.find(node)
+        if nid is None:
+            return default
+        return self.types[nid]
+
+    def __getitem__(self, node):
+        nid = self.find(node)
+        if nid is None:
+            raise KeyError(node)
+        return self.types[nid]
+
+    def __setitem__(self, node, ts):
+        nid = self.find(node)
+        if nid is None:
+            nid = len(self.nodes)
+            if IS(node, AST):
+                node.nid = nid
+            else:
+                self.keyIds[node] = nid
+            self.nodes.append(node)
+            self.types.append(None)
+            self.kinds.setdefault(node.__class__, []).append(nid)
+            if IS(node, Name):
+                self.names.setdefault(node.id, []).append(nid)
+        self.types[nid] = ts
 
+    def __contains__(self, node):
+        return self.find(node) is not None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return list(self.nodes)
+
+    def values(self):
+        return list(self.types)
+
+    def items(self):
+        return zip(self.nodes, self.types)
+
+    iteritems = items
+
+    def byKind(self, cls):
+        '''@types: type -> list[tuple[ast.AST, TypeSet]]'''
+        return [(self.nodes[nid], self.types[nid])
+                for nid in self.kinds.get(cls, ())]
+
+    def byName(self, name):
+        '''@types: str -> list[tuple[ast.Name, TypeSet]]'''
+        return [(self.nodes[nid], self.types[nid])
+                for nid in self.names.get(name, ())]
 
-def putInfo(exp, item):
-    if exp in history:
-        seen = history[exp]
-    else:
-        seen = []
-    history[exp] = union([seen, item])
+
+history = History()
+
+# summaries being recorded, innermost last (see invokeClosure)
+recording = []
+
+# kinds of information putInfo records, see setHistoryPolicy
+INFO_NAMES = 1          # types of names where they are bound or used
+INFO_MODULE_NAMES = 2   # the same, only outside of function bodies
+INFO_FUNCS = 4          # the FuncType of every analyzed call
+INFO_ERRORS = 8         # errors and unreachable code
+HISTORY_POLICIES = {'all': INFO_NAMES | INFO_FUNCS | INFO_ERRORS,
+                    'names': INFO_NAMES,
+                    'module-names': INFO_MODULE_NAMES,
+                    'funcs': INFO_FUNCS,
+                    'errors': INFO_ERRORS,
+                    'off': 0}
+historyMask = HISTORY_POLICIES['all']
+callDepth = 0           # function bodies being analyzed
+
+
+def setHistoryPolicy(*policies):
+    '''
+    Record only the union of the given kinds of information, e.g.
+    setHistoryPolicy('module-names', 'errors'). The analysis itself
+    never reads the history, so this changes nothing but the history.
+    @types: str... -> None
+    '''
+    global historyMask
+    mask = 0
+    for policy in policies:
+        mask |= HISTORY_POLICIES[policy]
+    historyMask = mask
+
+
+# parameters are bound before the body is entered, keyword
+# parameters are bound by their names (str)
+def inModuleScope(exp):
+    return (callDepth == 0 and not IS(exp, str)
+            and not IS(getattr(exp, 'ctx', None), Param))
+
+
+def putInfo(exp, item, kind):
+    if not historyMask & kind:
+        if not (kind == INFO_NAMES and historyMask & INFO_MODULE_NAMES
+                and inModuleScope(exp)):
+            return
+    seen = history.get(exp)
+    if seen is None:
+        seen = history[exp] = TypeSet()
+    seen.update(item)
+    if WIDEN_LIMIT is not None and len(seen) > WIDEN_LIMIT:
+        history[exp] = widen(seen)
+    if recording:
+        noteEffect(('info', exp, item, kind))
 
 
 def getInfo(exp):
     return history[exp]
 
 
+##################################################################
+# work counters
+##################################################################
+# Counts of the analysis work, reset by clear(). Unlike timings they
+# are the same on every machine, so the unittests can hold them to
+# recorded budgets (unittests/budgets.json).
+nInfer = 0              # infer() calls
+nInferSeq = 0           # statements taken by inferSeq
+nUnion = 0              # types merged into a TypeSet
+nInvoke = 0             # invokeClosure() calls
+allocations = defaultdict(int)          # Type class -> instances
+
+
+def getWorkCounters():
+    '@types: -> dict'
+    return {'infer': nInfer, 'inferSeq': nInferSeq,
+            'lookup': lists.steps + hamt.steps, 'union': nUnion,
+            'invoke': nInvoke, 'unknown': nUnknown, 'skipped': nSkipped,
+            'alloc': dict((cls.__name__, n)
+                          for (cls, n) in allocations.iteritems())}
+
+
 ##################################################################
 # types used by pysonar
 ##################################################################
-class Type:
-    pass
+class Type(object):
+    def __new__(cls, *args, **kwargs):
+        allocations[cls] += 1
+        return object.__new__(cls)
 
 
 nUnknown = 0
@@ -142,6 +384,132 @@ class PrimType(Type):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash(self.name)
+
+
+class AttrMap(object):
+    '''
+    The attributes of a class or an object. Names which were not
+    written here are read through to the parents: an object reads
+    through to its class, a class to its bases. The own dict is only
+    made on the first write, so a new object costs O(1), not a copy
+    of all the attributes of its class.
+    '''
+    __slots__ = ('own', 'parents', 'writes', 'extra')
+
+    def __init__(self, parents=()):
+        '@types: tuple[AttrMap]'
+        self.own = None
+        self.parents = parents
+        self.writes = 0
+        self.extra = 0          # names written here the parents don't have
+
+    # changes with every write here or in a parent
+    def version(self):
+        v = self.writes
+        for p in self.parents:
+            v += p.version()
+        return v
+
+    def get(self, name, default=None):
+        if self.own is not None and name in self.own:
+            return self.own[name]
+        for p in self.parents:
+            value = p.get(name, missing)
+            if value is not missing:
+                return value
+        return default
+
+    def __getitem__(self, name):
+        value = self.get(name, missing)
+        if value is missing:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        return self.get(name, missing) is not missing
+
+    def __setitem__(self, name, value):
+        if self.own is None:
+            self.own = {}
+        if name not in self.own and name not in self:
+            self.extra += 1
+        self.own[name] = value
+        self.writes += 1
+
+    def iteritems(self):
+        seen = set()
+        for (name, value) in (self.own or {}).iteritems():
+            seen.add(name)
+            yield (name, value)
+        for p in self.parents:
+            for (name, value) in p.iteritems():
+                if name not in seen:
+                    seen.add(name)
+                    yield (name, value)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return [name for (name, _) in self.iteritems()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not IS(other, AttrMap):
+            return False
+        if (self.parents is other.parents
+            or sameParents(self.parents, other.parents)):
+            # only the names written here can differ. A parent can
+            # get one of the extra names later, then two equal maps
+            # may compare unequal, which only costs precision
+            if self.extra != other.extra:
+                return False
+            own = self.own or {}
+            other_own = other.own or {}
+            if own == other_own:
+                return True
+            if own.viewkeys() == other_own.viewkeys():
+                return False
+            for name in own:
+                if name not in other_own and own[name] != other.get(name):
+                    return False
+            for name in other_own:
+                if name not in own and other_own[name] != self.get(name):
+                    return False
+            for name in own:
+                if name in other_own and own[name] != other_own[name]:
+                    return False
+            return True
+        return dict(self.iteritems()) == dict(other.iteritems())
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+missing = object()
+
+
+def sameParents(ps1, ps2):
+    if len(ps1) == 1:
+        return len(ps2) == 1 and ps1[0] is ps2[0]
+    if len(ps1) != len(ps2):
+        return False
+    for i in xrange(len(ps1)):
+        if ps1[i] is not ps2[i]:
+            return False
+    return True
+
 
 class ClassType(Type):
     def __init__(self, name, bases, body, env, ast_def_class):
@@ -149,8 +517,8 @@ class ClassType(Type):
         assert IS(name, str)
         self.name = name
         self.env = env
-        self.attrs = {}
         self.ast = ast_def_class
+        parents = []
         for base in bases:
             if IS(base, Attribute) or base.id == 'object':
                 continue
@@ -158,19 +526,16 @@ class ClassType(Type):
             if (baseClasses and len(baseClasses) == 1
                 and IS(baseClasses[0], ClassType)):
                 # limit to one possible type
-                baseClass = baseClasses[0]
-                for key, val in baseClass.attrs.iteritems():
-                    self.attrs[key] = val
+                parents.append(baseClasses[0].attrs)
             else:
-                logger.error('Can\'t infer base of %s: %s %s'
-                             % (name, baseClasses, base.id))
-        self.__saveClassAttrs(body)
+                error("Can't infer base of", name, baseClasses, base.id)
+        # the definitions of the body shadow the bases, and a later
+        # base shadows an earlier one
+        self.attrs = AttrMap((classBody(body),) + tuple(reversed(parents)))
+        self.instanceParents = (self.attrs,)    # shared by its objects
 
-    def __saveClassAttrs(self, body):
-        env = close(body, nil)  # {Name.id -> (Closure | ClassType)}
-        for pair in env:
-            # Closure's env will be updated, when invoking AttrType
-            self.attrs[pair.fst] = pair.snd
+    # bumped on every attribute write, also of a base class
+    version = property(lambda self: self.attrs.version())
 
     def __repr__(self):
         return "ClassType:" + str(self.ast)
@@ -182,7 +547,7 @@ class ClassType(Type):
             return False
 
     def __hash__(self):
-        return hash(self.ast)
+        return hash(self.name)
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -192,30 +557,61 @@ class ObjType(Type):
     def __init__(self, classtype, ctorargs, env, ast):
         '@types: ClassType, list[Type], LinkedList, ast'
         self.classtype = classtype
-        self.attrs = {}
-        # copy class attributes over to instance
-        for name, attr in self.classtype.attrs.iteritems():
-            self.attrs[name] = attr
+        self.attrs = AttrMap(classtype.instanceParents)
         self.ctorargs = ctorargs
         self.ast = ast
 
+    # bumped on every attribute write, also of the class
+    version = property(lambda self: self.attrs.version())
+
     def __repr__(self):
         return ("'" + str(self.classtype.name) + "' instance"  # +", ctor:" +
                 #str(self.ctorargs) + ", attrs:" + str(self.attrs)
                 )
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if IS(other, ObjType):
-            return ((self.classtype == other.classtype) and
-                    self.attrs == other.attrs)
+            if not (self.classtype is other.classtype
+                    or self.classtype == other.classtype):
+                return False
+            (own, other_own) = (self.attrs.own, other.attrs.own)
+            # the common case: same class, same names written
+            if (self.attrs.parents is other.attrs.parents
+                and own is not None and other_own is not None
+                and len(own) == len(other_own)
+                and own.viewkeys() == other_own.viewkeys()):
+                return own == other_own
+            return self.attrs == other.attrs
         else:
             return False
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    # attrs change, so only the class can be hashed
     def __hash__(self):
-        return hash(self.ast)
+        return hash(self.classtype.name)
+
+
+class SiteObjType(ObjType):
+    '''
+    The one object of an allocation site (see ALLOC_SITES), it stands
+    for all the objects made there, so it is only equal to itself.
+    '''
+    def __init__(self, classtype, ctorargs, env, ast, site):
+        ObjType.__init__(self, classtype, ctorargs, env, ast)
+        self.site = site
+
+    def __eq__(self, other):
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
+
+    def __hash__(self):
+        return hash(self.site)
 
 
 class FuncType(Type):
@@ -227,13 +623,17 @@ class FuncType(Type):
         return str(self.fromtype) + " -> " + str(self.totype)
 
     def __eq__(self, other):
-        return (IS(other, FuncType)
-                and (self.fromtype == other.fromtype)
-                and self.totype == other.totype)
+        return self is other or (IS(other, FuncType)
+                                 and self.fromtype == other.fromtype
+                                 and self.totype == other.totype)
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash((hashTypes([(p.fst, p.snd) for p in self.fromtype]),
+                     hashTypes(self.totype)))
+
 
 class AttrType(Type):
     '''
@@ -256,17 +656,15 @@ class AttrType(Type):
         clo_repr = ','.join(map(str, self.clo))
         return '(attr "%s", "%s")' % (self.obj, clo_repr)
 
+    # an attribute reference is only equal to itself
     def __eq__(self, other):
-        if IS(other, FuncType):
-            return (self.clo == other.clo)
-        else:
-            return False
+        return self is other
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash(tuple(self.clo)) + hash(self.objT)
+        return id(self)
 
 
 class Closure(Type):
@@ -288,6 +686,8 @@ class TupleType(Type):
         return "tup:" + str(self.elts)
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if IS(other, TupleType):
             if len(self.elts) != len(other.elts):
                 return False
@@ -302,6 +702,9 @@ class TupleType(Type):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hashTypes(self.elts)
+
 
 class ListType(Type):
     def __init__(self, elts):
@@ -312,8 +715,8 @@ class ListType(Type):
         return "list:" + str(self.elts)
 
     def __eq__(self, other):
-        return (IS(other, ListType)
-                and self.elts == other.elts)
+        return self is other or (IS(other, ListType)
+                                 and self.elts == other.elts)
 
     def __hash__(self):
         return hash(self.elts)
@@ -378,11 +781,18 @@ class DictType(Type):
     @staticmethod
     def get_items(dict_):
         '@types: LinkedList -> list'
-        return [[TupleType([[pair.fst], pair.snd]) for pair in dict_]]
+        return [[tupleType([[pair.fst], pair.snd]) for pair in dict_]]
 
     def __repr__(self):
         return "dict:" + str(self.dict)
 
+    # attrs hold bound methods, pickle only the contents
+    def __getstate__(self):
+        return {'dict': self.dict}
+
+    def __setstate__(self, state):
+        self.__init__(state['dict'])
+
     # any hashable value can be used as keys
     # any object can be used as values
     # so we can know almost nothing about the dictionaries
@@ -392,6 +802,9 @@ class DictType(Type):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash(DictType)
+
 
 class UnionType(Type):
     def __init__(self, elts):
@@ -401,11 +814,152 @@ class UnionType(Type):
         return "U:" + str(self.elts)
 
 
+class ConstSetType(Type):
+    '''
+    Constants of one kind ('str' or 'num') which a widened union
+    stands for. Only the values are kept, not where they come from.
+    '''
+    def __init__(self, kind, values):
+        self.kind = kind
+        self.values = frozenset(values)
+
+    def __repr__(self):
+        values = sorted(self.values)
+        if len(values) > 10:
+            values = values[:10] + ['...']
+        return "%s{%s}" % (self.kind, ', '.join(map(repr, values)))
+
+    def __eq__(self, other):
+        return (IS(other, ConstSetType)
+                and self.kind == other.kind
+                and self.values == other.values)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.kind, self.values))
+
+
+# Constants. infer() returns one canonical node per value instead of
+# the Num or Str node of the source, so 'foo' written on 50 lines is
+# one member of a union, not 50. They are still Num and Str nodes,
+# but they have no location; the source nodes of a constant are kept
+# in constSites. There is only one node per value, also when it is
+# unpickled, so they compare by identity.
+class NumConst(Num):
+    # unpickle as the pooled constant
+    def __reduce__(self):
+        return (const, (self.n,))
+
+
+class StrConst(Str):
+    def __reduce__(self):
+        return (const, (self.s,))
+
+
+constants = {}          # (type, value) -> NumConst | StrConst
+constSites = {}         # NumConst | StrConst -> set of Num | Str
+
+
+def const(value):
+    '@types: object -> NumConst|StrConst'
+    key = (type(value), value)
+    c = constants.get(key)
+    if c is None:
+        if IS(value, basestring):
+            c = constants[key] = StrConst(s=value)
+        else:
+            c = constants[key] = NumConst(n=value)
+    return c
+
+
+def constOf(node):
+    '@types: Num|Str -> NumConst|StrConst'
+    c = const(node.n if IS(node, Num) else node.s)
+    sites = constSites.get(c)
+    if sites is None:
+        sites = constSites[c] = set()
+    sites.add(node)
+    return c
+
+
+def getConstSites(c):
+    '@types: NumConst|StrConst -> list[Num|Str]'
+    return sorted(constSites.get(c, ()),
+                  key=lambda node: (node.filename, node.lineno,
+                                    node.col_offset))
+
+
+# Hash-consing. listType(), tupleType(), funcType() and dictType()
+# return the one instance of a compound value with the same members,
+# so equal values are mostly the same object and == is a pointer
+# comparison. Members which are values (constants, PrimType) are
+# compared by value, all others by identity: an ObjType changes, and
+# two equal ones are still different objects. An instance keeps its
+# members alive, and it is dropped from the table when it is no
+# longer used. The constructors still make fresh instances.
+conses = weakref.WeakValueDictionary()
+
+
+def consKey(t):
+    if IS(t, (NumConst, StrConst, PrimType, ConstSetType)):
+        return t
+    elif IS(t, list):
+        return tuple([consKey(t1) for t1 in t])
+    return id(t)
+
+
+def hashCons(cls, key, make):
+    key = (cls, key)
+    t = conses.get(key)
+    if t is None:
+        t = conses[key] = make()
+    return t
+
+
+def listType(elts):
+    '@types: tuple -> ListType'
+    return hashCons(ListType, tuple([consKey(t) for t in elts]),
+                    lambda: ListType(elts))
+
+
+def tupleType(elts):
+    '@types: list[list[Type]] -> TupleType'
+    return hashCons(TupleType, tuple([consKey(t) for t in elts]),
+                    lambda: TupleType(elts))
+
+
+def funcType(fromtype, totype):
+    '@types: LinkedList, list[Type] -> FuncType'
+    key = (tuple([(first(p), consKey(rest(p))) for p in fromtype]),
+           consKey(totype))
+    return hashCons(FuncType, key, lambda: FuncType(fromtype, totype))
+
+
+def dictType(dict_):
+    '@types: LinkedList -> DictType'
+    key = tuple([(consKey(p.fst), consKey(p.snd)) for p in dict_])
+    return hashCons(DictType, key, lambda: DictType(dict_))
+
+
 # singleton primtive types
 contType = PrimType('cont')             # continuation type
 bottomType = PrimType('_|_')            # non-terminating recursion
 
 
+# names of the builtin module, used when a name is not bound in the env
+def makeBuiltins():
+    import __builtin__
+    return dict((name, [PrimType(getattr(__builtin__, name))])
+                for name in dir(__builtin__))
+
+BUILTINS = makeBuiltins()
+
+# Name nodes which are neither bound nor builtin
+unknownNames = {}
+
+
 # need to rewrite this when we have recursive types
 def typeEqual(t1, t2):
     if IS(t1, list) and IS(t2, list):
@@ -417,29 +971,171 @@ def typeEqual(t1, t2):
         return t1 == t2
 
 
-def subtypeBindings(rec1, rec2):
-    def find(a, rec2):
-        for b in rec2:
-            if (first(a) == first(b)) and typeEqual(rest(a), rest(b)):
-                return True
-        return False
-    for a in rec1:
-        if not find(a, rec2):
-            return False
-    return True
+# hash of a type or of nested lists of types, consistent with ==
+def hashTypes(t):
+    if IS(t, (list, tuple)):
+        return hash(tuple([hashTypes(t1) for t1 in t]))
+    return hash(t)
 
 
-def union(ts):
-    u = []
-    for t in ts:
+class TypeSet(list):
+    '''
+    A union of types: a list without duplicates, in insertion order, with
+    a hashed index for membership. Values which can't be hashed are
+    compared one by one.
+    '''
+    def __init__(self, ts=()):
+        list.__init__(self)
+        self.index = set()
+        self.unhashable = []
+        self.extend(ts)
+
+    def __contains__(self, t):
+        try:
+            return t in self.index
+        except TypeError:
+            return t in self.unhashable
+
+    def append(self, t):
+        global nUnion
+        nUnion += 1
+        try:
+            if t in self.index:
+                return
+            self.index.add(t)
+        except TypeError:
+            if t in self.unhashable:
+                return
+            self.unhashable.append(t)
+        list.append(self, t)
+
+    def update(self, t):
         if IS(t, list):                 # already a union (list)
             for b in t:
-                if b not in u:
-                    u.append(b)
+                self.append(b)
         else:
-            if t not in u:
-                u.append(t)
-    return u
+            self.append(t)
+
+    def extend(self, ts):
+        for t in ts:
+            self.append(t)
+
+    def __iadd__(self, ts):
+        self.extend(ts)
+        return self
+
+    def __reduce__(self):
+        return (TypeSet, (list(self),))
+
+
+def union(ts):
+    u = TypeSet()
+    for t in ts:
+        u.update(t)
+    return widen(u)
+
+
+# widening: a union with more than WIDEN_LIMIT members is collapsed.
+# Constants become one ConstSetType per kind, and the objects of a
+# class with several of them in the union become one object. If that
+# is not enough, the members past half the limit become a PrimType of
+# their class, so the next members don't widen it again at once
+WIDEN_LIMIT = 256
+nWidened = 0
+widenedObjects = {}     # id(ClassType) -> SiteObjType
+
+
+def setWidenLimit(limit):
+    '@types: int or None'
+    global WIDEN_LIMIT
+    WIDEN_LIMIT = limit
+
+
+def constKind(t):
+    if IS(t, Str):
+        return 'str'
+    elif IS(t, Num):
+        return 'num'
+    elif IS(t, ConstSetType):
+        return t.kind
+    return None
+
+
+# the object which stands for the objects of a class in widened
+# unions. It is a site object, so its attributes are weakly updated,
+# and those of the objects merged into it are added
+def widenedObject(classtype):
+    '@types: ClassType -> SiteObjType'
+    obj = widenedObjects.get(id(classtype))
+    if obj is None:
+        obj = widenedObjects[id(classtype)] = SiteObjType(
+            classtype, [], classtype.env, classtype.ast,
+            ('widened', id(classtype)))
+    return obj
+
+
+def mergeObjects(objs, into):
+    '@types: list[ObjType], SiteObjType -> None'
+    values = defaultdict(list)      # name -> [list[Type]]
+    for obj in objs:
+        for (name, value) in (obj.attrs.own or {}).iteritems():
+            values[name].append(value)
+    for (name, value) in values.iteritems():
+        old = into.attrs.get(name, [])
+        merged = union([old] + value)
+        if merged != old:
+            into.attrs[name] = merged
+    # of the instantiations with as many arguments as the first one
+    ctorargs = [into.ctorargs] if into.ctorargs else []
+    ctorargs.extend(obj.ctorargs for obj in objs)
+    arity = len(ctorargs[0])
+    into.ctorargs = [union(args) for args in
+                     zip(*[a for a in ctorargs if len(a) == arity])]
+
+
+def widen(ts):
+    if WIDEN_LIMIT is None or len(ts) <= WIDEN_LIMIT:
+        return ts
+    global nWidened
+    nWidened += 1
+    debug('widening union of', len(ts), 'types')
+
+    values = {}
+    objects = {}
+    for t in ts:
+        kind = constKind(t)
+        if IS(t, ConstSetType):
+            values.setdefault(kind, set()).update(t.values)
+        elif kind == 'str':
+            values.setdefault(kind, set()).add(t.s)
+        elif kind == 'num':
+            values.setdefault(kind, set()).add(t.n)
+        elif t.__class__ is ObjType:
+            objects.setdefault(id(t.classtype), []).append(t)
+    members = []
+    for t in ts:
+        kind = constKind(t)
+        if kind is not None:
+            if kind in values:
+                members.append(ConstSetType(kind, values.pop(kind)))
+        elif t.__class__ is not ObjType:
+            members.append(t)
+        elif id(t.classtype) in objects:
+            group = objects.pop(id(t.classtype))
+            obj = widenedObjects.get(id(t.classtype))
+            if len(group) > 1 or (obj is not None and obj in ts):
+                obj = widenedObject(t.classtype)
+                mergeObjects(group, obj)
+                t = obj
+            members.append(t)
+    members = TypeSet(members)
+
+    if len(members) > WIDEN_LIMIT:
+        keep = WIDEN_LIMIT // 2
+        rest = members[keep:]
+        members = TypeSet(members[:keep])
+        members.extend([PrimType(t.__class__.__name__) for t in rest])
+    return members
 
 
 ####################################################################
@@ -484,6 +1180,8 @@ def typeOnly(bs):
 
 # test whether a type is in a union
 def inUnion(t, u):
+    if IS(u, TypeSet):
+        return t in u
     for t2 in u:
         if t == t2:
             return True
@@ -491,6 +1189,8 @@ def inUnion(t, u):
 
 
 def removeType(t, u):
+    if IS(u, TypeSet):
+        return TypeSet([x for x in u if x != t])
     return [x for x in u if x != t]
 
 
@@ -498,8 +1198,10 @@ def removeType(t, u):
 # only assocs appear in both envs are preserved
 # use a variable bound in only one branch will cause type error
 def mergeEnv(env1, env2):
+    if not isList(env1) and not isList(env2):
+        return env1.merge(env2, lambda t1, t2: union([t1, t2]))
     ret = nil
-    for p1 in env1:
+    for p1 in reverse(env1):
         p2 = assq(first(p1), env2)
         if p2 != None:
             ret = ext(first(p1), union([rest(p1), rest(p2)]), ret)
@@ -515,23 +1217,27 @@ def getId(x):
         return x
 
 
-def getName(x, lineno):
-    return Name(id=x, lineno=lineno)
+# a Name for x made up at the statement stmt
+def getName(x, stmt):
+    name = Name(id=x, lineno=stmt.lineno)
+    if hasattr(stmt, 'filename'):
+        name.filename = stmt.filename
+    return name
 
 
 def bind(target, infered_value, env):
     if IS(target, Name) or IS(target, str):
         u = infered_value
-        putInfo(target, u)
+        putInfo(target, u, INFO_NAMES)
         return ext(getId(target), u, env)
     elif IS(target, Attribute):
         ast_name = target.value
-        infered_targets = infer(ast_name, env, nil)
+        infered_targets = infer(ast_name, env, emptyStack)
         for obj in infered_targets:
             if IS(obj, (ClassType, ObjType)):
-                obj.attrs[target.attr] = infered_value
+                setAttr(obj, target.attr, infered_value)
             elif IS(obj, AttrType):
-                obj.obj.attrs[target.attr] = infered_value
+                setAttr(obj.obj, target.attr, infered_value)
             else:
                 error("Syntax error: wrong target type in assignment: ",
                       obj, type(obj))
@@ -542,18 +1248,22 @@ def bind(target, infered_value, env):
         target_to_value = defaultdict(list)
         for infered_value in infered_values:
             if IS(infered_value, TupleType) or IS(infered_value, List):
-                debug('infered key, value:', infered_value)
+                if TRACING:
+                    debug('infered key, value:', infered_value)
                 if len(target.elts) == len(infered_value.elts):
                     for i in xrange(len(infered_value.elts)):
                         target_to_value[target.elts[i]].extend(infered_value.elts[i])
                 elif len(target.elts) < len(infered_value.elts):
-                    putInfo(target, ValueError('too many values to unpack'))
+                    putInfo(target, ValueError('too many values to unpack'),
+                            INFO_ERRORS)
                 else:
-                    putInfo(target, ValueError('too few values to unpack'))
+                    putInfo(target, ValueError('too few values to unpack'),
+                            INFO_ERRORS)
             else:
-                putInfo(target, TypeError('non-iterable object'))
+                putInfo(target, TypeError('non-iterable object'), INFO_ERRORS)
         for key, value in target_to_value.iteritems():
-            debug('binding %s to %s:' % (key, value))
+            if TRACING:
+                debug('binding', key, 'to', value)
             env = bind(key, value, env)
         return env
 
@@ -562,35 +1272,554 @@ def bind(target, infered_value, env):
               target)
         return env
     else:
-        putInfo(target, SyntaxError("not assignable"))
+        putInfo(target, SyntaxError("not assignable"), INFO_ERRORS)
         return env
 
 
+class CallStack:
+    '''
+    Call sites being analyzed together with their input types.
+    Frames are indexed by call site, and the input types of every frame
+    are indexed by parameter name, so a lookup only looks at the frames
+    of the same call site.
+    '''
+    def __init__(self, frames=HashTrie(), depth=0, calls=nil):
+        self.frames = frames    # {ast.Call -> LinkedList[{name -> types}]}
+        self.depth = depth
+        self.calls = calls      # LinkedList[ast.Call], the innermost first
+
+    def push(self, call, fromtype):
+        '@types: ast.Call, LinkedList -> CallStack'
+        sig = {}
+        for p in fromtype:
+            sig.setdefault(first(p), []).append(rest(p))
+        sigs = self.frames.get(call) or nil
+        return CallStack(self.frames.assoc(call, LinkedList(sig, sigs)),
+                         self.depth + 1, LinkedList(call, self.calls))
+
+    def context(self, depth):
+        '@types: int -> tuple[ast.Call]'
+        ret = []
+        if depth:
+            for call in self.calls:
+                ret.append(call)
+                if len(ret) == depth:
+                    break
+        return tuple(ret)
+
+    # whether a frame of call has, for every binding of args, the same
+    # name bound to types that include its types. Only the frames of
+    # call are looked at, through the call-site index in self.frames
+    def find(self, call, args):
+        for sig in self.frames.get(call) or nil:
+            for a in args:
+                if not any(typeEqual(rest(a), ts)
+                           for ts in sig.get(first(a), ())):
+                    break
+            else:
+                return True
+        return False
+
+    def __repr__(self):
+        return "<stack of %d calls>" % self.depth
+
+emptyStack = CallStack()
+
+
 def onStack(call, args, stk):
-    for p1 in stk:
-        call2 = first(p1)
-        args2 = rest(p1)
-        if call == call2 and subtypeBindings(args, args2):
-            return True
-    return False
+    '@types: ast.Call, LinkedList, CallStack -> bool'
+    return stk.find(call, args)
+
+
+# Queries. With setQuery(names) the analysis is after the invocations
+# of the named classes only. MYDICT records just theirs, and a call
+# whose result isn't used is skipped if its function can't reach them
+# (see query.py). Values which skipped calls would have written to
+# attributes nobody in relevant code reads are lost, which doesn't
+# change the records.
+QUERY = None            # frozenset of class names, None for everything
+queryIndex = None       # QueryIndex of the modules parsed so far
+nSkipped = 0            # calls skipped by the query
+
+
+def setQuery(classes):
+    '@types: iterable[str] | None -> None'
+    global QUERY, queryIndex
+    if classes is None:
+        QUERY = queryIndex = None
+        return
+    QUERY = frozenset(classes)
+    queryIndex = QueryIndex(QUERY)
+    for (module, _) in imported_modules.values():
+        indexModule(module)
+
+
+def indexModule(root):
+    '@types: ast.Module -> None'
+    global queryIndex
+    if not root.body:
+        return
+    if getattr(root, 'filename', None) in queryIndex.files:
+        # parsed again, forget the old functions of the file
+        queryIndex = QueryIndex(QUERY)
+        for (module, _) in imported_modules.values():
+            if module is not root and module.body:
+                queryIndex.add(module)
+    queryIndex.add(root)
+
+
+def skipCall(call, func):
+    '@types: ast.Call, ast.FunctionDef | ast.Lambda -> bool'
+    return (getattr(call, 'unused', False) and IS(func, FunctionDef)
+            and not queryIndex.relevant(func))
 
 
 def saveMethodInvocationInfo(call, clo, env, stk):
     '''
     @types: ast.Call, ObjType, LinkedList, LinkedList -> None
     '''
+    if QUERY is not None and clo.obj.classtype.name not in QUERY:
+        return
     if call.args:
         ctorargs = [a for a in clo.obj.ctorargs]
         callargs = [infer(arg, env, stk) for arg in call.args]
         # TODO save keywords
-        MYDICT[clo.obj.classtype.name].append((ctorargs, callargs, env))
+        if invocationSink is not None:
+            # the sink doesn't read it, and summaries keep the record
+            env = nil
+        elif ENV_SNAPSHOTS:
+            env = snapshotEnv(call, env)
+        record = (ctorargs, callargs, env)
+        addInvocation(clo.obj.classtype.name, record, call)
+        if recording:
+            noteEffect(('call', clo.obj.classtype.name, record, call))
+
+
+# A record keeps the whole env of the call, which keeps everything
+# reachable from it alive. With ENV_SNAPSHOTS it keeps only the
+# bindings of the names used in the call's arguments, and records
+# with the same bindings share one snapshot.
+ENV_SNAPSHOTS = False
+snapshots = {}          # ((name, id(value)), ...) -> snapshot
+argNames = {}           # ast.Call -> names used in its arguments
+
+
+def useEnvSnapshots(flag):
+    global ENV_SNAPSHOTS
+    ENV_SNAPSHOTS = flag
+
+
+def getArgNames(call):
+    names = argNames.get(call)
+    if names is None:
+        names = set()
+        for arg in call.args:
+            for node in ast.walk(arg):
+                if IS(node, Name):
+                    names.add(node.id)
+        names = argNames[call] = sorted(names)
+    return names
+
+
+def snapshotEnv(call, env):
+    '''@types: ast.Call, LinkedList -> LinkedList'''
+    bindings = []
+    for name in getArgNames(call):
+        value = lookup(name, env)
+        if value is not None:
+            bindings.append((name, value))
+    # the snapshot keeps the values alive, so their ids stay valid
+    key = tuple([(name, id(value)) for (name, value) in bindings])
+    snapshot = snapshots.get(key)
+    if snapshot is None:
+        snapshot = nil
+        for (name, value) in reversed(bindings):
+            snapshot = ext(name, value, snapshot)
+        snapshots[key] = snapshot
+    return snapshot
+
+
+# recorded invocations go to MYDICT, or only to the sink if there is one
+invocationSink = None
+
+
+def setInvocationSink(sink):
+    '''
+    @types: JsonlSink -> None
+    sink.add(name, record, call) is called for every invocation,
+    None keeps them in MYDICT again
+    '''
+    global invocationSink
+    invocationSink = sink
+
+
+def addInvocation(name, record, call):
+    emitInvocation(name, record, call)
+    if loading:                 # remembered by the module being analyzed
+        (module, entry) = loading[-1]
+        entry['invocations'][module].setdefault(name, []).append(
+            (record, call))
+
+
+def emitInvocation(name, record, call):
+    if invocationSink is None:
+        MYDICT[name].append(record)
+    else:
+        invocationSink.add(name, record, call)
 
 
 def getMethodInvocationInfo():
     return MYDICT
 
 
+# types as plain values: constants keep their value, a widened set
+# of constants gives all its values, everything else is known by its
+# printed form
+def projectType(t):
+    if IS(t, Num) and not IS(t.n, complex):
+        return ['num', t.n]
+    elif IS(t, Str):
+        return ['str', t.s]
+    else:
+        return ['type', repr(t)]
+
+
+def projectTypes(ts):
+    if not IS(ts, list):
+        ts = [ts]
+    ret = []
+    for t in ts:
+        if IS(t, ConstSetType):
+            ret.extend([projectType(const(v)) for v in sorted(t.values)])
+        else:
+            ret.append(projectType(t))
+    return ret
+
+
+class JsonlSink:
+    '''
+    Writes every method invocation as one line of JSON as soon as it
+    is recorded: class, constructor and call arguments, file and line
+    of the call. Nothing is kept.
+    '''
+    def __init__(self, out):
+        self.out = out
+        self.count = 0
+
+    def add(self, name, record, call):
+        (ctorargs, callargs, _) = record
+        line = json.dumps({'class': name,
+                           'ctorargs': map(projectTypes, ctorargs),
+                           'callargs': map(projectTypes, callargs),
+                           'file': getattr(call, 'filename', None),
+                           'line': getattr(call, 'lineno', None)},
+                          sort_keys=True)
+        self.out.write(line + '\n')
+        self.out.flush()            # readers can follow the file
+        self.count += 1
+
+
+##################################################################
+# function summaries
+##################################################################
+# Analyzing a function body again with the same input types gives the
+# same return types and the same side effects, so invokeClosure keeps
+# them in a summary and replays them on the next call.
+#
+# A summary is keyed by the function, the identity of the closure's env
+# and a canonical form of the input types. Values inside the input types
+# (constants, objects) may be different nodes or instances at each call
+# site, so the replay maps the recorded ones onto the current ones.
+SUMMARIES = True
+summaries = {}
+summaryHits = 0
+summaryMisses = 0
+carried = None          # summaries of the last run of a Session
+
+
+class Summary:
+    def __init__(self, leaves, fenv):
+        self.leaves = leaves        # input values in canonical order
+        self.fenv = fenv            # keep the env alive, its id is in the key
+        self.effects = []
+        self.reads = {}             # id -> objects whose attrs were read
+        self.versions = []          # (obj, obj.version) of these objects
+        self.fresh = {}             # id -> objects created in the body
+        self.deps = set()           # functions whose bodies went into it
+        self.reusable = True
+        self.to = None
+
+    def isValid(self):
+        if not self.reusable:
+            return False
+        for (obj, version) in self.versions:
+            if obj.version != version:
+                return False
+        return True
+
+    def finish(self, to):
+        self.to = to
+        if self.escapes(to):
+            self.reusable = False
+        for effect in self.effects:
+            if (effect[0] == 'attr' and id(effect[1]) not in self.fresh
+                and self.escapes(effect[3])):
+                self.reusable = False
+        args = set(map(id, self.leaves))
+        self.versions = [(obj, obj.version)
+                         for (i, obj) in self.reads.iteritems()
+                         if i not in args and i not in self.fresh]
+        self.reads = None
+
+    # a fresh object which outlives the call would be shared
+    # between all calls which reuse this summary
+    def escapes(self, t):
+        if IS(t, list):
+            for t1 in t:
+                if self.escapes(t1):
+                    return True
+            return False
+        elif IS(t, ObjType):
+            return id(t) in self.fresh
+        elif IS(t, AttrType):
+            return self.escapes(t.obj)
+        elif IS(t, (ListType, TupleType)):
+            return self.escapes(list(t.elts))
+        return False
+
+
+def noteEffect(effect):
+    for s in recording:
+        s.effects.append(effect)
+
+
+def noteRead(obj):
+    for s in recording:
+        s.reads[id(obj)] = obj
+
+
+def noteFresh(obj):
+    for s in recording:
+        s.fresh[id(obj)] = obj
+
+
+def noteCutoff():
+    for s in recording:
+        s.reusable = False
+
+
+def noteDeps(funcs):
+    for s in recording:
+        s.deps.update(funcs)
+
+
+def setAttr(obj, name, value):
+    if IS(obj, SiteObjType):
+        # a weak update, the other objects of the site keep the old value
+        value = union([obj.attrs.get(name, []), value])
+    obj.attrs[name] = value
+    if recording:
+        noteEffect(('attr', obj, name, value))
+
+
+def canonTypes(ts, leaves, seen):
+    if IS(ts, list):
+        return tuple([canonType(t, leaves, seen) for t in ts])
+    return canonType(ts, leaves, seen)
+
+
+# a hashable description of a value, equal for values that give the
+# same analysis results. Every value visited is added to leaves in order
+def canonType(t, leaves, seen):
+    leaves.append(t)
+    if IS(t, Num):
+        return ('num', type(t.n), t.n)
+    elif IS(t, Str):
+        return ('str', type(t.s), t.s)
+    elif IS(t, PrimType):
+        return ('prim', t.name)
+    elif IS(t, UnknownType):
+        return ('unknown', t.obj.lineno)
+    elif IS(t, ConstSetType):
+        return ('consts', t.kind, t.values)
+    elif IS(t, (ListType, TupleType)):
+        return (t.__class__.__name__,
+                tuple([canonTypes(e, leaves, seen) for e in t.elts]))
+    elif IS(t, ObjType):
+        if id(t) in seen:
+            return ('cycle', seen[id(t)])
+        seen[id(t)] = len(seen)
+        # the invocations of its methods record the ctorargs. The
+        # attributes it reads through to its class are known by the
+        # class and its version, so its methods aren't visited
+        own = t.attrs.own or {}
+        return ('obj', id(t.classtype), t.classtype.version,
+                tuple([canonTypes(a, leaves, seen) for a in t.ctorargs]),
+                tuple([(name, canonTypes(own[name], leaves, seen))
+                       for name in sorted(own)]))
+    else:
+        return ('id', id(t))
+
+
+def canonFromtype(fromtype):
+    '@types: LinkedList -> tuple, list'
+    leaves = []
+    seen = {}
+    key = tuple([(first(p), canonTypes(rest(p), leaves, seen))
+                 for p in fromtype])
+    return (key, leaves)
+
+
+# the mapping also keeps what the values in it were mapped to, types
+# nested in lists share their parts
+def remap(t, mapping):
+    if id(t) in mapping:
+        return mapping[id(t)]
+    elif IS(t, list):
+        t1 = [remap(t1, mapping) for t1 in t]
+    elif IS(t, tuple):
+        t1 = tuple([remap(t1, mapping) for t1 in t])
+    elif IS(t, AttrType):
+        t1 = AttrType(t.clo, remap(t.obj, mapping), t.objT)
+    elif IS(t, ListType):
+        t1 = listType(remap(t.elts, mapping))
+    elif IS(t, TupleType):
+        t1 = tupleType(remap(t.elts, mapping))
+    elif IS(t, FuncType):
+        t1 = funcType(maplist(lambda p: SimplePair(first(p),
+                                                   remap(rest(p), mapping)),
+                              t.fromtype),
+                      remap(t.totype, mapping))
+    else:
+        return t
+    mapping[id(t)] = t1
+    return t1
+
+
+def replay(summary, leaves):
+    mapping = {}
+    for (old, new) in zip(summary.leaves, leaves):
+        if old is not new:
+            mapping[id(old)] = new
+    for effect in summary.effects:
+        if effect[0] == 'info':
+            putInfo(effect[1], remap(effect[2], mapping), effect[3])
+        elif effect[0] == 'attr':
+            setAttr(remap(effect[1], mapping), effect[2],
+                    remap(effect[3], mapping))
+        else:
+            (_, name, record, call) = effect
+            (ctorargs, callargs, env) = record
+            record = (remap(ctorargs, mapping), remap(callargs, mapping), env)
+            addInvocation(name, record, call)
+            noteEffect(('call', name, record, call))
+    return remap(summary.to, mapping)
+
+
+def getSummaryStats():
+    return {'hits': summaryHits, 'misses': summaryMisses,
+            'size': len(summaries)}
+
+
+def useSummaries(flag):
+    global SUMMARIES
+    SUMMARIES = flag
+    summaries.clear()
+
+
 # invoke one closure
+##################################################################
+# profiling the analyzed code
+##################################################################
+# With PROFILING on, the analysis work is charged to the analyzed
+# function, class or module it was done for: wall time (own and
+# including callees), infer() visits, invocations, summary replays
+# and recursion cutoffs. Entries are keyed by (filename, line, name)
+# and are reset by clear().
+PROFILING = False
+profile = {}                # (filename, lineno, name) -> ProfileEntry
+profileStack = []           # [entry, start time, time of callees]
+
+
+class ProfileEntry(object):
+    __slots__ = ('key', 'calls', 'hits', 'cutoffs', 'visits',
+                 'selfTime', 'totalTime', 'active')
+
+    def __init__(self, key):
+        self.key = key
+        self.calls = 0          # invocations
+        self.hits = 0           # of these, replayed from a summary
+        self.cutoffs = 0        # of these, cut off as recursive
+        self.visits = 0         # infer() calls in its own body
+        self.selfTime = 0.0
+        self.totalTime = 0.0
+        self.active = 0         # frames on profileStack
+
+
+def useProfiling(flag):
+    global PROFILING
+    PROFILING = flag
+
+
+def getProfile():
+    return profile
+
+
+def profileEntry(node, name):
+    key = (getattr(node, 'filename', '<string>'),
+           getattr(node, 'lineno', 0), name)
+    entry = profile.get(key)
+    if entry is None:
+        entry = profile[key] = ProfileEntry(key)
+    return entry
+
+
+def enterProfile(entry):
+    entry.active += 1
+    profileStack.append([entry, time.time(), 0.0])
+
+
+def leaveProfile():
+    (entry, start, callees) = profileStack.pop()
+    elapsed = time.time() - start
+    entry.active -= 1
+    entry.selfTime += elapsed - callees
+    if entry.active == 0:           # recursion is counted once
+        entry.totalTime += elapsed
+    if profileStack:
+        profileStack[-1][2] += elapsed
+
+
+PROFILE_COLUMNS = {'self': lambda e: e.selfTime,
+                   'total': lambda e: e.totalTime,
+                   'visits': lambda e: e.visits,
+                   'calls': lambda e: e.calls,
+                   'hits': lambda e: e.hits,
+                   'cutoffs': lambda e: e.cutoffs,
+                   'location': lambda e: e.key}
+
+
+def printProfile(sort='self', limit=20, out=sys.stdout):
+    '''
+    Print the most expensive entries, sorted by one of the columns
+    self, total, visits, calls, hits, cutoffs or location.
+    @types: str, int, file -> None
+    '''
+    key = PROFILE_COLUMNS[sort]
+    entries = sorted(profile.itervalues(), key=key,
+                     reverse=(sort != 'location'))
+    if limit is not None:
+        entries = entries[:limit]
+    out.write('%9s %9s %8s %7s %7s %7s  %s\n'
+              % ('self', 'total', 'visits', 'calls', 'hits', 'cutoffs',
+                 'location'))
+    for e in entries:
+        (filename, lineno, name) = e.key
+        out.write('%9.4f %9.4f %8d %7d %7d %7d  %s:%d %s\n'
+                  % (e.selfTime, e.totalTime, e.visits, e.calls, e.hits,
+                     e.cutoffs, filename, lineno, name))
+
+
 def invoke1(call, clo, env, stk):
     '''@types: ast.Call, Callable, LinkedList, LinkedList -> ast.AST or Type
     '''
@@ -608,23 +1837,19 @@ def invoke1(call, clo, env, stk):
         for k in call.keywords:
             infer(k.value, env, stk)
         err = TypeError('calling non-callable', clo)
-        putInfo(call, err)
+        putInfo(call, err, INFO_ERRORS)
         return [err]
     if IS(clo, ClassType):
         debug('creating instance of', clo)
-        ctorargs = [infer(arg, env, stk) for arg in call.args]
-        new_obj = ObjType(clo, ctorargs, clo.env, call)
-        init_closures = new_obj.attrs.get('__init__', [])
-        if len(init_closures):
-            # we don't really care about this name,
-            # we just don't want to collide with method's global symbols
-            # TODO: generate a special name,
-            #       that would represent a temporary object
-            self_arg = get_self_arg_name(init_closures[0].func)
-            ref_to_init = AttrType(init_closures, new_obj, self_arg)
-            init_env = ext(self_arg.id, [new_obj], env)
-            invoke1(call, ref_to_init, init_env, stk)
-        return [new_obj]
+        if PROFILING:
+            entry = profileEntry(clo.ast, clo.name)
+            entry.calls += 1
+            enterProfile(entry)
+            try:
+                return newInstance(call, clo, env, stk)
+            finally:
+                leaveProfile()
+        return newInstance(call, clo, env, stk)
     if IS(clo, AttrType):
         attr = clo
         if IS(attr.obj, ObjType):
@@ -665,11 +1890,66 @@ def invoke1(call, clo, env, stk):
         else:
             err = TypeError('AttrType object is not supported for the invoke',
                             attr)
-            putInfo(call, err)
+            putInfo(call, err, INFO_ERRORS)
             return [err]
     return invokeClosure(call, call.args, clo, env, stk)
 
 
+# Allocation sites. By default every instantiation makes a new
+# ObjType, so the number of objects grows with the number of calls.
+# With ALLOC_SITES there is one object per call site, class and the
+# SITE_DEPTH innermost call sites on the stack. Later instantiations
+# there update it, and its attributes are only weakly updated.
+ALLOC_SITES = False
+SITE_DEPTH = 0
+sites = {}      # (ast.Call, id(ClassType), context) -> SiteObjType
+
+
+def useAllocationSites(flag, depth=0):
+    '@types: bool, int -> None'
+    global ALLOC_SITES, SITE_DEPTH
+    ALLOC_SITES = flag
+    SITE_DEPTH = depth
+    sites.clear()
+
+
+def siteObject(call, clo, ctorargs, stk):
+    '@types: ast.Call, ClassType, list[list[Type]], CallStack -> SiteObjType'
+    site = (call, id(clo), stk.context(SITE_DEPTH))
+    obj = sites.get(site)
+    if obj is None:
+        obj = sites[site] = SiteObjType(clo, ctorargs, clo.env, call, site)
+    else:
+        obj.ctorargs = [union([a, b])
+                        for (a, b) in zip(obj.ctorargs, ctorargs)]
+    if SITE_DEPTH:
+        # a summary would return it to callers in other contexts
+        noteFresh(obj)
+    return obj
+
+
+def newInstance(call, clo, env, stk):
+    '''@types: ast.Call, ClassType, LinkedList, CallStack -> list[ObjType]'''
+    ctorargs = [infer(arg, env, stk) for arg in call.args]
+    noteRead(clo)
+    if ALLOC_SITES:
+        new_obj = siteObject(call, clo, ctorargs, stk)
+    else:
+        new_obj = ObjType(clo, ctorargs, clo.env, call)
+        noteFresh(new_obj)
+    init_closures = new_obj.attrs.get('__init__', [])
+    if len(init_closures):
+        # we don't really care about this name,
+        # we just don't want to collide with method's global symbols
+        # TODO: generate a special name,
+        #       that would represent a temporary object
+        self_arg = get_self_arg_name(init_closures[0].func)
+        ref_to_init = AttrType(init_closures, new_obj, self_arg)
+        init_env = ext(self_arg.id, [new_obj], env)
+        invoke1(call, ref_to_init, init_env, stk)
+    return [new_obj]
+
+
 def get_self_arg_name(fn_def):
     ''' Expecting to get ast.Name with id, for instance, self
     @types: ast.FunctionDef -> ast.Name
@@ -683,47 +1963,81 @@ def get_self_arg_name(fn_def):
     raise ValueError(msg % fn_def.name)
 
 
+# the parameters of a FunctionDef or Lambda, worked out once by
+# createAST instead of from func.args at every call
+class ParamLayout(object):
+    __slots__ = ('args', 'names', 'ids', 'named', 'firstDefault',
+                 'vararg', 'kwarg')
+
+    def __init__(self, args):
+        '@types: ast.arguments'
+        self.args = args.args
+        # None for a tuple parameter, which bind() unpacks
+        self.names = [IS(a, Name) and a.id or None for a in args.args]
+        self.ids = map(getId, args.args)
+        self.named = frozenset(name for name in self.names if name)
+        self.firstDefault = len(args.args) - len(args.defaults)
+        self.vararg = args.vararg
+        self.kwarg = args.kwarg
+
+    # what bind() does for parameter i
+    def bind(self, i, t, env):
+        '@types: int, list[Type], LinkedList -> LinkedList'
+        name = self.names[i]
+        if name is None:
+            return bind(self.args[i], t, env)
+        putInfo(self.args[i], t, INFO_NAMES)
+        return ext(name, t, env)
+
+
 def invokeClosure(call, actualParams, clo, env, stk):
     '''
     @types: ast.Call, list[ast.AST], Closure, LinkedList, LinkedList -> list[Type]
     '''
-    debug('invoking closure', clo.func, 'with args', actualParams)
-    debug(clo.func.body)
+    global nInvoke
+    nInvoke += 1
+    if TRACING:
+        debug('invoking closure', clo.func, 'with args', actualParams)
+        debug(clo.func.body)
 
     func = clo.func
+    layout = func.layout
     fenv = clo.env
     pos = nil
     kwarg = nil
+    if PROFILING:
+        entry = profileEntry(func, getattr(func, 'name', '<lambda>'))
+        entry.calls += 1
 
     # bind positionals first
-    poslen = min(len(func.args.args), len(actualParams))
+    nargs = len(layout.args)
+    poslen = min(nargs, len(actualParams))
     for i in xrange(poslen):
         t = infer(actualParams[i], env, stk)
-        pos = bind(func.args.args[i], t, pos)
+        pos = layout.bind(i, t, pos)
 
     # put extra positionals into vararg if provided
     # report error and go on otherwise
-    if len(actualParams) > len(func.args.args):
-        if func.args.vararg == None:
+    if len(actualParams) > nargs:
+        if layout.vararg == None:
             err = TypeError('excess arguments to function')
-            putInfo(call, err)
+            putInfo(call, err, INFO_ERRORS)
             return [err]
         else:
             ts = []
-            for i in xrange(len(func.args.args), len(actualParams)):
+            for i in xrange(nargs, len(actualParams)):
                 t = infer(actualParams[i], env, stk)
                 ts = ts + t
-            pos = bind(func.args.vararg, ts, pos)
+            pos = bind(layout.vararg, ts, pos)
 
     # bind keywords, collect kwarg
-    ids = map(getId, func.args.args)
     for k in call.keywords:
         ts = infer(k.value, env, stk)
         tloc1 = lookup(k.arg, pos)
         if tloc1 != None:
             putInfo(call, TypeError('multiple values for keyword argument',
-                                     k.arg, tloc1))
-        elif k.arg not in ids:
+                                    k.arg, tloc1), INFO_ERRORS)
+        elif k.arg not in layout.named:
             kwarg = bind(k.arg, ts, kwarg)
         else:
             pos = bind(k.arg, ts, pos)
@@ -731,38 +2045,88 @@ def invokeClosure(call, actualParams, clo, env, stk):
     # put extras in kwarg or report them
     # bind call.keywords to func.args.kwarg
     if kwarg != nil:
-        if func.args.kwarg != None:
-            pos = bind(func.args.kwarg, [DictType(reverse(kwarg))], pos)
+        if layout.kwarg != None:
+            pos = bind(layout.kwarg, [dictType(reverse(kwarg))], pos)
         else:
-            putInfo(call, TypeError("unexpected keyword arguements", kwarg))
-    elif func.args.kwarg != None:
-        pos = bind(func.args.kwarg, [DictType(nil)], pos)
+            putInfo(call, TypeError("unexpected keyword arguements", kwarg),
+                    INFO_ERRORS)
+    elif layout.kwarg != None:
+        pos = bind(layout.kwarg, [dictType(nil)], pos)
 
     # bind defaults, avoid overwriting bound vars
     # types for defaults are already inferred when the function was defined
-    i = len(func.args.args) - len(func.args.defaults)
-    _ = len(func.args.args)
+    i = layout.firstDefault
     for j in xrange(len(clo.defaults)):
-        tloc = lookup(getId(func.args.args[i]), pos)
+        tloc = lookup(layout.ids[i], pos)
         if tloc == None:
-            pos = bind(func.args.args[i], clo.defaults[j], pos)
+            pos = layout.bind(i, clo.defaults[j], pos)
             i += 1
 
     # finish building the input type
     fromtype = maplist(lambda p: SimplePair(first(p), typeOnly(rest(p))), pos)
 
+    if QUERY is not None and skipCall(call, func):
+        global nSkipped
+        nSkipped += 1
+        return [bottomType]
+
     # check whether the same call site is on stack with same input types
     # if so, we are back to a loop, terminate
     if onStack(call, fromtype, stk):
+        noteCutoff()
+        if PROFILING:
+            entry.cutoffs += 1
         return [bottomType]
 
+    # reuse the summary of an earlier call with the same input types
+    if SUMMARIES:
+        global summaryHits, summaryMisses
+        (canon, leaves) = canonFromtype(fromtype)
+        key = (func, id(fenv), canon)
+        summary = summaries.get(key)
+        if summary is None and carried is not None:
+            summary = carried.find(func, canon, fenv)
+            if summary is not None:
+                summaries[key] = summary
+        if summary is not None and summary.isValid():
+            summaryHits += 1
+            if PROFILING:
+                entry.hits += 1
+            if recording:
+                noteDeps(summary.deps)
+            to = replay(summary, leaves)
+            if historyMask & INFO_FUNCS:
+                putInfo(func, funcType(reverse(fromtype), to), INFO_FUNCS)
+            return to
+        summaryMisses += 1
+        summary = Summary(leaves, fenv)
+        recording.append(summary)
+        noteDeps((func,))
+
     # push the call site onto the stack and analyze the function body
-    stk = ext(call, fromtype, stk)
-    fenv = append(pos, fenv)
-    to = infer(func.body, fenv, stk)
+    stk = stk.push(call, fromtype)
+    if fenv == nil:
+        fenv = emptyEnv
+    fenv = extend(pos, fenv)
+    global callDepth
+    callDepth += 1
+    if PROFILING:
+        enterProfile(entry)
+    try:
+        to = infer(func.body, fenv, stk)
+    finally:
+        callDepth -= 1
+        if PROFILING:
+            leaveProfile()
+        if SUMMARIES:
+            recording.pop()
+    if SUMMARIES:
+        summary.finish(to)
+        summaries[key] = summary
 
     # record the function type
-    putInfo(func, FuncType(reverse(fromtype), to))
+    if historyMask & INFO_FUNCS:
+        putInfo(func, funcType(reverse(fromtype), to), INFO_FUNCS)
     return to
 
 
@@ -777,16 +2141,53 @@ def invoke(call, env, stk):
     return totypes
 
 
+# Definitions. close() runs for every block that is analyzed, so the
+# Closure or ClassType of a module level definition is kept: a module
+# closed again binds the same objects, until the definition statement
+# runs and gives the object its env. From then on it may have been
+# returned, so the next close makes a new one. Other blocks get new
+# objects, a function body has a new env at every call anyway. Class
+# bodies are always closed in nil, all the ClassTypes of a body share
+# one layer of its definitions, which is never written.
+definitions = {}        # (ast node, id(env)) -> (env, Closure | ClassType)
+classBodies = {}        # id(body) -> (body, AttrMap)
+
+
+def define(e, env):
+    '@types: ast.FunctionDef | ast.ClassDef, LinkedList -> Closure | ClassType'
+    key = (e, id(env))
+    entry = definitions.get(key)
+    if entry is not None and entry[0] is env and entry[1].env is nil:
+        return entry[1]
+    if IS(e, FunctionDef):
+        c = Closure(e, nil)
+    else:
+        c = ClassType(e.name, e.bases, e.body, nil, e)
+    if env is emptyEnv:
+        definitions[key] = (env, c)
+    return c
+
+
+def classBody(body):
+    '@types: list[ast.AST] -> AttrMap'
+    entry = classBodies.get(id(body))
+    if entry is not None and entry[0] is body:
+        return entry[1]
+    layer = AttrMap()
+    for pair in close(body, nil):   # {Name.id -> (Closure | ClassType)}
+        # Closure's env will be updated, when invoking AttrType
+        layer[pair.fst] = pair.snd
+    classBodies[id(body)] = (body, layer)
+    return layer
+
+
 # pre-bind names to functions in sequences
 def close(code_block, env):
     '''@types: list[ast.AST], LinkedList -> LinkedList'''
+    scope = env
     for e in code_block:
-        if IS(e, FunctionDef):
-            c = Closure(e, nil)
-            env = ext(e.name, [c], env)
-        elif IS(e, ClassDef):
-            c = ClassType(e.name, e.bases, e.body, nil, e)
-            env = ext(e.name, [c], env)
+        if IS(e, (FunctionDef, ClassDef)):
+            env = ext(e.name, [define(e, scope)], env)
         # here we also need Import and Assign
         # Assign is complicated
     return env
@@ -800,361 +2201,506 @@ def finalize(t):
     return removeType(contType, t)
 
 
+# how a sequence goes on after a statement with two arms (If, While,
+# For, TryExcept, TryFinally). Returns the types contributed by the arms
+# and the env to continue with, or None if both arms terminate
+def joinArms(t1, env1, t2, env2):
+    if isTerminating(t1) and isTerminating(t2):          # both terminates
+        return (union([t1, t2]), None)
+    elif isTerminating(t1) and not isTerminating(t2):    # t1 terminates
+        return (union([t1, finalize(t2)]), env2)
+    elif not isTerminating(t1) and isTerminating(t2):    # t2 terminates
+        return (union([finalize(t1), t2]), env1)
+    else:                                                # both non-terminating
+        return (union([finalize(t1), finalize(t2)]), mergeEnv(env1, env2))
+
+
+def markUnreachable(exp):
+    for e2 in exp:
+        putInfo(e2, TypeError('unreachable code'), INFO_ERRORS)
+
+
+# Dispatch. infer, inferSeqRec and inferStmt look up the handler of a
+# node by its class in a table, instead of testing it against a chain
+# of IS(...) checks. The table of a class is filled the first time the
+# class is seen, from the rules in order, so a subclass gets the
+# handler of its first matching base.
+class Dispatch(object):
+    def __init__(self, rules, default):
+        '@types: list[tuple[type|tuple[type], function]], function'
+        self.rules = rules
+        self.default = default
+        self.table = {}
+
+    def resolve(self, cls):
+        '@types: type -> function'
+        handler = self.default
+        for (classes, h) in self.rules:
+            if issubclass(cls, classes):
+                handler = h
+                break
+        self.table[cls] = handler
+        return handler
+
+    def __call__(self, node):
+        handler = self.table.get(node.__class__, missing)
+        if handler is missing:
+            handler = self.resolve(node.__class__)
+        return handler
+
+
+# statements which don't change control flow, they return the new env
+def inferAssign(e, env, stk):
+    t = infer(e.value, env, stk)
+    for x in e.targets:
+        env = bind(x, t, env)
+    return env
+
+
+def inferAugAssign(e, env, stk):
+    t = infer(e.value, env, stk)
+    return bind(e.target, t, env)
+
+
+def inferFunctionDef(e, env, stk):
+    cs = lookup(e.name, env)
+    if not cs:
+        debug('Function', e.name, 'not found in scope', env)
+    # infer types for default arguments. The closure may be
+    # bound again (see define), so they are replaced
+    defaults = [infer(d, env, stk) for d in e.args.defaults]
+    for c in cs:
+        c.env = env              # create circular env to support recursion
+        if IS(c, Closure) and c.func is e:
+            c.defaults = defaults
+    return env
+
+
+def inferExpr(e, env, stk):
+    infer(e.value, env, stk)
+    return env
+
+
+def inferImportFrom(e, env, stk):
+    _, module_symbols = get_module_symbols(e.module)
+    for module_name in e.names:
+        name_to_import = module_name.name
+        name_import_as = module_name.asname or name_to_import
+        module_symbol = lookup(name_to_import, module_symbols)
+        env = bind(getName(name_import_as, e), module_symbol, env)
+    return env
+
+
+def inferImport(e, env, stk):
+    for module_name in e.names:
+        name_to_import = module_name.name
+        module, module_env = get_module_symbols(name_to_import)
+        name_import_as = module_name.asname or module_name.name
+        module_class = ClassType('module', [], module.body, module_env, e)
+        module_obj = [ObjType(module_class, [], nil, e)]
+        noteFresh(module_obj[0])
+        env = bind(getName(name_import_as, e), module_obj, env)
+    return env
+
+
+def inferClassDef(e, env, stk):
+    cs = lookup(e.name, env)
+    if not cs:
+        debug('Class def', e.name, 'not found in scope', env)
+    for c in cs:
+        c.env = env
+    return env
+
+
+def inferNoEffect(e, env, stk):
+    # Global: TODO this should affect bind behaviour when assigning
+    # We don't have a way to change env for now,
+    # we can only append
+    # see tests/assign.py
+    return env
+
+
+def inferUnknownStmt(e, env, stk):
+    raise TypeError('recognized node in effect context', e)
+
+
+stmtHandler = Dispatch([
+    (Assign, inferAssign),
+    (AugAssign, inferAugAssign),
+    (FunctionDef, inferFunctionDef),
+    (Expr, inferExpr),
+    (ImportFrom, inferImportFrom),
+    (Import, inferImport),
+    (ClassDef, inferClassDef),
+    ((Break, Continue, Raise, Pass, Print, Assert, ast.Delete,
+      ast.Subscript, ast.Exec, Global), inferNoEffect)],
+    inferUnknownStmt)
+
+
+# infer a statement which doesn't change control flow
+def inferStmt(e, env, stk):
+    '@types: ast.stmt, LinkedList, LinkedList -> LinkedList'
+    return stmtHandler(e)(e, env, stk)
+
+
 # infer a sequence of statements
 def inferSeq(exp, env, stk):
-    debug('Infering sequence', exp)
+    if ENGINE == 'worklist':
+        return inferSeqWorklist(exp, env, stk)
+    return inferSeqRec(exp, env, stk)
+
+
+# the recursive engine: one Python call per statement
+def inferSeqRec(exp, env, stk):
+    global nInferSeq
+    nInferSeq += 1
+    if TRACING:
+        debug('Infering sequence', exp)
 
     if exp == []:                       # reached end without return
         return ([contType], env)
 
     e = exp[0]
-    if IS(e, If):
-        _ = infer(e.test, env, stk)
-        (t1, env1) = inferSeq(e.body, close(e.body, env), stk)
-        (t2, env2) = inferSeq(e.orelse, close(e.orelse, env), stk)
-
-        if isTerminating(t1) and isTerminating(t2):          # both terminates
-            for e2 in exp[1:]:
-                putInfo(e2, TypeError('unreachable code'))
-            return (union([t1, t2]), env)
-
-        elif isTerminating(t1) and not isTerminating(t2):    # t1 terminates
-            (t3, env3) = inferSeq(exp[1:], env2, stk)
-            t2 = finalize(t2)
-            return (union([t1, t2, t3]), env3)
-
-        elif not isTerminating(t1) and isTerminating(t2):    # t2 terminates
-            (t3, env3) = inferSeq(exp[1:], env1, stk)
-            t1 = finalize(t1)
-            return (union([t1, t2, t3]), env3)
-        else:                                            # both non-terminating
-            (t3, env3) = inferSeq(exp[1:], mergeEnv(env1, env2), stk)
-            t1 = finalize(t1)
-            t2 = finalize(t2)
-            return (union([t1, t2, t3]), env3)
-
-    elif IS(e, While):
-        # todo evaluate test
-        (t1, env1) = inferSeq(e.body, close(e.body, env), stk)
-        (t2, env2) = inferSeq(e.orelse, close(e.orelse, env), stk)
-
-        if isTerminating(t1) and isTerminating(t2):          # both terminates
-            for e2 in exp[1:]:
-                putInfo(e2, TypeError('unreachable code'))
-            return (union([t1, t2]), env)
-
-        elif isTerminating(t1) and not isTerminating(t2):   # t1 terminates
-            (t3, env3) = inferSeq(exp[1:], env2, stk)
-            t2 = finalize(t2)
-            return (union([t1, t2, t3]), env3)
-
-        elif not isTerminating(t1) and isTerminating(t2):   # t2 terminates
-            (t3, env3) = inferSeq(exp[1:], env1, stk)
-            t1 = finalize(t1)
-            return (union([t1, t2, t3]), env3)
-        else:                                            # both non-terminating
-            (t3, env3) = inferSeq(exp[1:], mergeEnv(env1, env2), stk)
-            t1 = finalize(t1)
-            t2 = finalize(t2)
-            return (union([t1, t2, t3]), env3)
-
-    elif IS(e, For):
-        values = infer(e.iter, env, stk)
-        value = flatten(values)
-        env = bind(e.target, value, env)
-        (t1, env1) = inferSeq(e.body, close(e.body, env), stk)
-        (t2, env2) = inferSeq(e.orelse, close(e.orelse, env), stk)
-
-        if isTerminating(t1) and isTerminating(t2):           # both terminates
-            for e2 in exp[1:]:
-                putInfo(e2, TypeError('unreachable code'))
-            return (union([t1, t2]), env)
-
-        elif isTerminating(t1) and not isTerminating(t2):    # t1 terminates
-            (t3, env3) = inferSeq(exp[1:], env2, stk)
-            t2 = finalize(t2)
-            return (union([t1, t2, t3]), env3)
-
-        elif not isTerminating(t1) and isTerminating(t2):    # t2 terminates
-            (t3, env3) = inferSeq(exp[1:], env1, stk)
-            t1 = finalize(t1)
-            return (union([t1, t2, t3]), env3)
-        else:                                           # both non-terminating
-            (t3, env3) = inferSeq(exp[1:], mergeEnv(env1, env2), stk)
-            t1 = finalize(t1)
-            t2 = finalize(t2)
-            return (union([t1, t2, t3]), env3)
-
-    elif IS(e, Assign):
-        t = infer(e.value, env, stk)
-        for x in e.targets:
-            env = bind(x, t, env)
-        return inferSeq(exp[1:], env, stk)
-
-    elif IS(e, AugAssign):
-        t = infer(e.value, env, stk)
-        env = bind(e.target, t, env)
-        return inferSeq(exp[1:], env, stk)
-
-    elif IS(e, FunctionDef):
-        cs = lookup(e.name, env)
-        if not cs:
-            debug('Function %s not found in scope %s' % (e.name, env))
-        for c in cs:
-            c.env = env              # create circular env to support recursion
-        for d in e.args.defaults:    # infer types for default arguments
-            dt = infer(d, env, stk)
-            c.defaults.append(dt)
-        return inferSeq(exp[1:], env, stk)
-
-    elif IS(e, Return):
-        if e.value is None:
-            t1 = [PrimType(None)]
-        else:
-            t1 = infer(e.value, env, stk)
-        (t2, env2) = inferSeq(exp[1:], env, stk)
-        for e2 in exp[1:]:
-            putInfo(e2, TypeError('unreachable code'))
-        return (t1, env)
-
-    elif IS(e, Expr):
-        t1 = infer(e.value, env, stk)
-        return inferSeq(exp[1:], env, stk)
-
-    elif IS(e, ImportFrom):
-        _, module_symbols = get_module_symbols(e.module)
-        for module_name in e.names:
-            name_to_import = module_name.name
-            name_import_as = module_name.asname or name_to_import
-            module_symbol = lookup(name_to_import, module_symbols)
-            env = bind(getName(name_import_as, e.lineno), module_symbol, env)
-        return inferSeq(exp[1:], env, stk)
-
-    elif IS(e, Import):
-        for module_name in e.names:
-            name_to_import = module_name.name
-            module, module_env = get_module_symbols(name_to_import)
-            name_import_as = module_name.asname or module_name.name
-            module_class = ClassType('module', [], module.body, module_env, e)
-            module_obj = [ObjType(module_class, [], nil, e)]
-            env = bind(getName(name_import_as, e.lineno), module_obj, env)
-        return inferSeq(exp[1:], env, stk)
-
-    elif IS(e, ClassDef):
-        cs = lookup(e.name, env)
-        if not cs:
-            debug('Class def %s not found in scope %s' % (e.name, env))
-        for c in cs:
-            c.env = env
-
-        (t2, env2) = inferSeq(exp[1:], env, stk)
-        return (t2, env2)
-
-    elif IS(e, Break):
-        return inferSeq(exp[1:], env, stk)
-
-    elif IS(e, Continue):
-        return inferSeq(exp[1:], env, stk)
-
-    elif IS(e, TryExcept):
-        (t1, env1) = inferSeq(e.body, close(e.body, env), stk)
-        (t2, env2) = inferSeq(e.orelse, close(e.orelse, env), stk)
-        (_, _) = inferSeq(e.handlers, close(e.handlers, env), stk)
-
-        if isTerminating(t1) and isTerminating(t2):           # both terminates
-            for e2 in exp[1:]:
-                putInfo(e2, TypeError('unreachable code'))
-            return (union([t1, t2]), env)
-
-        elif isTerminating(t1) and not isTerminating(t2):     # t1 terminates
-            (t3, env3) = inferSeq(exp[1:], env2, stk)
-            t2 = finalize(t2)
-            return (union([t1, t2, t3]), env3)
-
-        elif not isTerminating(t1) and isTerminating(t2):    # t2 terminates
-            (t3, env3) = inferSeq(exp[1:], env1, stk)
-            t1 = finalize(t1)
-            return (union([t1, t2, t3]), env3)
-        else:                                           # both non-terminating
-            (t3, env3) = inferSeq(exp[1:], mergeEnv(env1, env2), stk)
-            t1 = finalize(t1)
-            t2 = finalize(t2)
-            return (union([t1, t2, t3]), env3)
-
-    elif IS(e, TryFinally):
-        (t1, env1) = inferSeq(e.body, close(e.body, env), stk)
-        (t2, env2) = inferSeq(e.finalbody, close(e.finalbody, env), stk)
-
-        if isTerminating(t1) and isTerminating(t2):        # both terminates
-            for e2 in exp[1:]:
-                putInfo(e2, TypeError('unreachable code'))
-            return (union([t1, t2]), env)
-
-        elif isTerminating(t1) and not isTerminating(t2):     # t1 terminates
-            (t3, env3) = inferSeq(exp[1:], env2, stk)
-            t2 = finalize(t2)
-            return (union([t1, t2, t3]), env3)
-
-        elif not isTerminating(t1) and isTerminating(t2):    # t2 terminates
-            (t3, env3) = inferSeq(exp[1:], env1, stk)
-            t1 = finalize(t1)
-            return (union([t1, t2, t3]), env3)
-        else:                                            # both non-terminating
-            (t3, env3) = inferSeq(exp[1:], mergeEnv(env1, env2), stk)
-            t1 = finalize(t1)
-            t2 = finalize(t2)
-            return (union([t1, t2, t3]), env3)
-
-    elif IS(e, ExceptHandler):
-        (t1, env1) = inferSeq(e.body, close(e.body, env), stk)
-        (t3, env3) = inferSeq(exp[1:], env1, stk)
-        return (union([t1, t3]), env3)
-
-    elif IS(e, Raise):
-        return inferSeq(exp[1:], env, stk)
-
-    elif IS(e, Pass):
-        return inferSeq(exp[1:], env, stk)
-
-    elif IS(e, Print):
-        return inferSeq(exp[1:], env, stk)
-
-    elif IS(e, With):
-        # TODO infer e.context_expr,
-        # call __enter__ from e.context_expr
-        # bind e.optional_vars to the result of __enter__
-        # call __exit__
-        (t1, env1) = inferSeq(e.body, close(e.body, env), stk)
-        (t2, env2) = inferSeq(exp[1:], env1, stk)
-        return (union([t1, t2]), env2)
-
-    elif IS(e, Assert):
-        return inferSeq(exp[1:], env, stk)
-
-    elif IS(e, Global):
-        # TODO this should affect bind behaviour when assigning
-        # We don't have a way to change env for now,
-        # we can only append
-        # see tests/assign.py
-        return inferSeq(exp[1:], env, stk)
-    elif IS(e, ast.Delete):
-        return inferSeq(exp[1:], env, stk)
-
-    elif IS(e, ast.Subscript):
-        return inferSeq(exp[1:], env, stk)
-
-    elif IS(e, ast.Exec):
-        return inferSeq(exp[1:], env, stk)
-
+    handler = seqHandler(e)
+    if handler is None:
+        env = inferStmt(e, env, stk)
+        return inferSeqRec(exp[1:], env, stk)
+    return handler(e, exp, env, stk)
+
+
+# the rest of the sequence exp after its first statement had two arms
+def goOn(exp, env, stk, t1, env1, t2, env2):
+    (t, env3) = joinArms(t1, env1, t2, env2)
+    if env3 is None:
+        markUnreachable(exp[1:])
+        return (t, env)
+    (t3, env3) = inferSeqRec(exp[1:], env3, stk)
+    return (union([t, t3]), env3)
+
+
+# statements which change control flow, e is the first of exp
+def seqIf(e, exp, env, stk):
+    _ = infer(e.test, env, stk)
+    (t1, env1) = inferSeqRec(e.body, close(e.body, env), stk)
+    (t2, env2) = inferSeqRec(e.orelse, close(e.orelse, env), stk)
+    return goOn(exp, env, stk, t1, env1, t2, env2)
+
+
+def seqWhile(e, exp, env, stk):
+    # todo evaluate test
+    (t1, env1) = inferSeqRec(e.body, close(e.body, env), stk)
+    (t2, env2) = inferSeqRec(e.orelse, close(e.orelse, env), stk)
+    return goOn(exp, env, stk, t1, env1, t2, env2)
+
+
+def seqFor(e, exp, env, stk):
+    values = infer(e.iter, env, stk)
+    value = widen(flatten(values))
+    env = bind(e.target, value, env)
+    (t1, env1) = inferSeqRec(e.body, close(e.body, env), stk)
+    (t2, env2) = inferSeqRec(e.orelse, close(e.orelse, env), stk)
+    return goOn(exp, env, stk, t1, env1, t2, env2)
+
+
+def seqReturn(e, exp, env, stk):
+    if e.value is None:
+        t1 = [PrimType(None)]
     else:
-        raise TypeError('recognized node in effect context', e)
+        t1 = infer(e.value, env, stk)
+    (t2, env2) = inferSeqRec(exp[1:], env, stk)
+    markUnreachable(exp[1:])
+    return (t1, env)
+
+
+def seqTryExcept(e, exp, env, stk):
+    (t1, env1) = inferSeqRec(e.body, close(e.body, env), stk)
+    (t2, env2) = inferSeqRec(e.orelse, close(e.orelse, env), stk)
+    (_, _) = inferSeqRec(e.handlers, close(e.handlers, env), stk)
+    return goOn(exp, env, stk, t1, env1, t2, env2)
+
+
+def seqTryFinally(e, exp, env, stk):
+    (t1, env1) = inferSeqRec(e.body, close(e.body, env), stk)
+    (t2, env2) = inferSeqRec(e.finalbody, close(e.finalbody, env), stk)
+    return goOn(exp, env, stk, t1, env1, t2, env2)
+
+
+def seqExceptHandler(e, exp, env, stk):
+    (t1, env1) = inferSeqRec(e.body, close(e.body, env), stk)
+    (t3, env3) = inferSeqRec(exp[1:], env1, stk)
+    return (union([t1, t3]), env3)
+
+
+def seqWith(e, exp, env, stk):
+    # TODO infer e.context_expr,
+    # call __enter__ from e.context_expr
+    # bind e.optional_vars to the result of __enter__
+    # call __exit__
+    (t1, env1) = inferSeqRec(e.body, close(e.body, env), stk)
+    (t2, env2) = inferSeqRec(exp[1:], env1, stk)
+    return (union([t1, t2]), env2)
+
+
+# None for the statements of inferStmt
+seqHandler = Dispatch([
+    (If, seqIf),
+    (While, seqWhile),
+    (For, seqFor),
+    (Return, seqReturn),
+    (TryExcept, seqTryExcept),
+    (TryFinally, seqTryFinally),
+    (ExceptHandler, seqExceptHandler),
+    (With, seqWith)],
+    None)
+
+
+# the worklist engine: runs over the control-flow graph of the sequence
+# (see cfg.py) and gives the same results as inferSeqRec
+class SeqRun:
+    '''one analysis of a statement sequence'''
+    def __init__(self, owner, report=True):
+        self.owner = owner          # (join index, arm) or None for the top
+        self.report = report        # False for code after a return
+        self.types = []
+        self.result = None
+
+
+cfgs = {}
+
+
+def getCFG(exp):
+    '@types: list[ast.stmt] -> cfg.CFG'
+    if id(exp) in cfgs:
+        return cfgs[id(exp)][1]
+    graph = CFG(exp)
+    cfgs[id(exp)] = (exp, graph)    # keep exp alive, its id is the key
+    return graph
+
+
+def inferSeqWorklist(exp, env, stk):
+    global nInferSeq
+    if TRACING:
+        debug('Infering sequence', exp)
+    graph = getCFG(exp)
+    nodes = graph.nodes
+    inbox = {}
+    worklist = []
+
+    # every edge goes to a node with a larger index, so taking the
+    # smallest index first visits each node after all its predecessors
+    def deliver(i, item):
+        if i not in inbox:
+            inbox[i] = []
+            heappush(worklist, i)
+        inbox[i].append(item)
+
+    top = SeqRun(None)
+    deliver(graph.entry, (top, env))
+    while worklist:
+        n = nodes[heappop(worklist)]
+        items = inbox.pop(n.index)
+        nInferSeq += 1
+
+        if n.kind == STMT:
+            (run, env) = items[0]
+            deliver(n.succ, (run, inferStmt(n.stmt, env, stk)))
+
+        elif n.kind == RETURN:
+            (run, env) = items[0]
+            e = n.stmt
+            if e.value is None:
+                t1 = [PrimType(None)]
+            else:
+                t1 = infer(e.value, env, stk)
+            run.types = union([run.types, t1])
+            # code after return is still inferred, its result is dropped
+            deliver(n.succ, (SeqRun(None, False), env))
+            deliver(n.exit, ('return', run, env, n.rest))
+
+        elif n.kind == FORK:
+            (run, env) = items[0]
+            e = n.stmt
+            if IS(e, If):
+                infer(e.test, env, stk)
+            elif IS(e, For):
+                values = infer(e.iter, env, stk)
+                env = bind(e.target, widen(flatten(values)), env)
+            deliver(n.join, ('fork', run, env))
+            for k in xrange(len(n.arms)):
+                (entry, body) = n.arms[k]
+                deliver(entry, (SeqRun((n.join, k)), close(body, env)))
+
+        elif n.kind == JOIN:
+            (_, run, env) = items[0]
+            arms = {}
+            for (_, k, result) in items[1:]:
+                arms[k] = result
+            if IS(n.stmt, (With, ExceptHandler)):
+                (t1, env1) = arms[0]
+                run.types = union([run.types, t1])
+                deliver(n.succ, (run, env1))
+            else:
+                (t1, env1) = arms[0]
+                (t2, env2) = arms[1]
+                (t, env3) = joinArms(t1, env1, t2, env2)
+                run.types = union([run.types, t])
+                if env3 is None:
+                    markUnreachable(n.rest)
+                    deliver(n.exit, ('stop', run, env, None))
+                else:
+                    deliver(n.succ, (run, env3))
+
+        else:                           # EXIT
+            for item in items:
+                if len(item) == 4:
+                    (how, run, env, _) = item
+                    run.result = (run.types, env)
+                else:                   # reached end without return
+                    (run, env) = item
+                    run.result = (union([run.types, [contType]]), env)
+                if run.report and n.owner is not None:
+                    (join, k) = n.owner
+                    deliver(join, ('arm', k, run.result))
+            # inner returns mark their rest before the outer ones
+            for item in reversed(items):
+                if len(item) == 4 and item[0] == 'return':
+                    markUnreachable(item[3])
+
+    return top.result
 
 
 # main type inferencer
 def infer(exp, env, stk):
     '@types: ast.AST|object, LinkedList, LinkedList -> list[Type]'
-    debug('infering', exp, exp.__class__)
+    global nInfer
+    nInfer += 1
+    if TRACING:
+        debug('infering', exp, exp.__class__)
+    if PROFILING and profileStack:
+        profileStack[-1][0].visits += 1
     assert exp is not None
+    return inferHandler(exp)(exp, env, stk)
 
-    if IS(exp, Module):
-        return infer(exp.body, env, stk)
 
-    elif IS(exp, list):
-        env = close(exp, env)
-        (t, _) = inferSeq(exp, env, stk)   # env ignored (out of scope)
-        return t
+def inferModule(exp, env, stk):
+    return infer(exp.body, env, stk)
 
-    elif IS(exp, Num):
-        # we need objects, not types
-        return [exp]  # [PrimType(type(exp.n))]
 
-    elif IS(exp, Str):
-        # we need objects, not types
-        return [exp]  # [PrimType(type(exp.s))]
+def inferBlock(exp, env, stk):
+    env = close(exp, env)
+    (t, _) = inferSeq(exp, env, stk)   # env ignored (out of scope)
+    return t
+
+
+def inferConst(exp, env, stk):
+    # we need objects, not types
+    return [constOf(exp)]
 
-    elif IS(exp, Name):
-        b = lookup(exp.id, env)
-        debug('infering name:', b, env)
-        if (b != None):
-            putInfo(exp, b)
-            return b
-        else:
-            try:
-                t = eval(exp.id)  # try use information from Python interpreter
-                return [PrimType(t)]
-            except NameError as _:
-                putInfo(exp, UnknownType(exp))
-                return [UnknownType(exp)]
-
-    elif IS(exp, Lambda):
-        c = Closure(exp, env)
-        for d in exp.args.defaults:
-            dt = infer(d, env, stk)
-            c.defaults.append(dt)
-        return [c]
-
-    elif IS(exp, Call):
-        return invoke(exp, env, stk)
-
-    elif IS(exp, Attribute):
-        t = infer(exp.value, env, stk)
-        if t:
-            attribs = []
-            # find attr name in object and return it
-            for o in t:
-                if not IS(o, (ObjType, ClassType, DictType)):
-                    attribs.append(TypeError('unknown object', o))
-                    continue
-                if exp.attr in o.attrs:
-                    attribs.append(AttrType(o.attrs[exp.attr], o, exp.value))
-                else:
-                    attribs.append(TypeError('no such attribute', exp.attr))
-            return attribs
-        else:
-            return [UnknownType(exp)]
-
-    ## ignore complex types for now
-    # elif IS(exp, List):
-    #     eltTypes = []
-    #     for e in exp.elts:
-    #         t = infer(e, env, stk)
-    #         eltTypes.append(t)
-    #     return [Bind(ListType(eltTypes), exp)]
-
-    # elif IS(exp, Tuple):
-    #     eltTypes = []
-    #     for e in exp.elts:
-    #         t = infer(e, env, stk)
-    #         eltTypes.append(t)
-    #     return [Bind(TupleType(eltTypes), exp)]
-
-    elif IS(exp, ObjType):
-        return exp
-
-    elif IS(exp, ast.List):
-        infered_elts = flatten([infer(el, env, stk) for el in exp.elts])
-        return [ListType(tuple(infered_elts))]
-
-    elif IS(exp, ast.Dict):
-        infered_keys = [infer(key, env, stk) for key in exp.keys]
-        infered_values = [infer(value, env, stk) for value in exp.values]
-        temp_dict = defaultdict(list)
-        dic = nil
-        for keys, value in zip(infered_keys, infered_values):
-            for key in keys:
-                try:
-                    temp_dict[key] = value  # only the last value
-                                            # with the same key is stored
-                except TypeError, _:  # unhashable instance
-                    dic = ext(key, value, dic)
-
-        for key, value in temp_dict.iteritems():
-            dic = ext(key, value, dic)
-        return [DictType(dic)]
 
+def inferName(exp, env, stk):
+    b = lookup(exp.id, env)
+    if TRACING:
+        debug('infering name:', b, env)
+    if (b != None):
+        putInfo(exp, b, INFO_NAMES)
+        return b
+    t = BUILTINS.get(exp.id)
+    if t is not None:
+        return t
+    t = unknownNames.get(exp)
+    if t is None:
+        t = unknownNames[exp] = [UnknownType(exp)]
+    putInfo(exp, t, INFO_NAMES)
+    return t
+
+
+def inferLambda(exp, env, stk):
+    c = Closure(exp, env)
+    for d in exp.args.defaults:
+        dt = infer(d, env, stk)
+        c.defaults.append(dt)
+    return [c]
+
+
+def inferAttribute(exp, env, stk):
+    t = infer(exp.value, env, stk)
+    if t:
+        attribs = []
+        # find attr name in object and return it
+        for o in t:
+            if not IS(o, (ObjType, ClassType, DictType)):
+                attribs.append(TypeError('unknown object', o))
+                continue
+            if recording and not IS(o, DictType):
+                noteRead(o)
+            if exp.attr in o.attrs:
+                attribs.append(AttrType(o.attrs[exp.attr], o, exp.value))
+            else:
+                attribs.append(TypeError('no such attribute', exp.attr))
+        return attribs
     else:
         return [UnknownType(exp)]
 
+## ignore complex types for now
+# List:
+#     eltTypes = []
+#     for e in exp.elts:
+#         t = infer(e, env, stk)
+#         eltTypes.append(t)
+#     return [Bind(ListType(eltTypes), exp)]
+
+# Tuple:
+#     eltTypes = []
+#     for e in exp.elts:
+#         t = infer(e, env, stk)
+#         eltTypes.append(t)
+#     return [Bind(TupleType(eltTypes), exp)]
+
+
+def inferObject(exp, env, stk):
+    return exp
+
+
+def inferList(exp, env, stk):
+    infered_elts = flatten([infer(el, env, stk) for el in exp.elts])
+    return [listType(tuple(infered_elts))]
+
+
+def inferDict(exp, env, stk):
+    infered_keys = [infer(key, env, stk) for key in exp.keys]
+    infered_values = [infer(value, env, stk) for value in exp.values]
+    temp_dict = OrderedDict()   # keys in source order
+    dic = nil
+    for keys, value in zip(infered_keys, infered_values):
+        for key in keys:
+            try:
+                temp_dict[key] = value  # only the last value
+                                        # with the same key is stored
+            except TypeError, _:  # unhashable instance
+                dic = ext(key, value, dic)
+
+    for key, value in temp_dict.iteritems():
+        dic = ext(key, value, dic)
+    return [dictType(dic)]
+
+
+def inferUnknown(exp, env, stk):
+    return [UnknownType(exp)]
+
+
+inferHandler = Dispatch([
+    (Module, inferModule),
+    (list, inferBlock),
+    ((Num, Str), inferConst),
+    (Name, inferName),
+    (Lambda, inferLambda),
+    (Call, invoke),
+    (Attribute, inferAttribute),
+    (ObjType, inferObject),
+    (ast.List, inferList),
+    (ast.Dict, inferDict)],
+    inferUnknown)
+
 
 ##################################################################
 # drivers(wrappers)
@@ -1163,8 +2709,28 @@ def infer(exp, env, stk):
 def clear():
     history.clear()
     MYDICT.clear()
-    global nUnknown
+    cfgs.clear()
+    summaries.clear()
+    unknownNames.clear()
+    constSites.clear()
+    sites.clear()
+    widenedObjects.clear()
+    definitions.clear()
+    classBodies.clear()
+    snapshots.clear()
+    argNames.clear()
+    profile.clear()
+    del profileStack[:]
+    del recording[:]
+    global nUnknown, nWidened, summaryHits, summaryMisses
     nUnknown = 0
+    nWidened = 0
+    summaryHits = 0
+    summaryMisses = 0
+    global nInfer, nInferSeq, nUnion, nInvoke, nSkipped
+    nInfer = nInferSeq = nUnion = nInvoke = nSkipped = 0
+    allocations.clear()
+    lists.steps = hamt.steps = 0
 
 
 def nodekey(node):
@@ -1177,8 +2743,18 @@ def nodekey(node):
 # check a single (parsed) expression
 def checkExp(exp):
     clear()
-    ret = infer(exp, nil, nil)
-    if history.keys() != [] and logger.isEnabledFor(logging.DEBUG):
+    return checkCleared(exp)
+
+
+def checkCleared(exp):
+    if PROFILING:
+        enterProfile(profileEntry(exp, '<module>'))
+    try:
+        ret = infer(exp, emptyEnv, emptyStack)
+    finally:
+        if PROFILING:
+            leaveProfile()
+    if TRACING and len(history) and logger.isEnabledFor(logging.DEBUG):
         debug("---------------------------- history -------------------------")
         for k in sorted(history.keys(), key=nodekey):
             debug(k, ":", history[k])
@@ -1207,21 +2783,410 @@ def createAST(string, filename='<string>'):
     root_node = ast.parse(string)
     for node in ast.walk(root_node):
         node.filename = filename
+        if IS(node, (FunctionDef, Lambda)):
+            node.layout = ParamLayout(node.args)
+    if QUERY is not None:
+        indexModule(root_node)
     return root_node
 
 
-def getModuleExp(modulename):
+def getModuleFile(modulename):
     modulename = modulename.replace('.', os.path.sep)
     if PYTHONPATH:
         directory_name = PYTHONPATH[0]
     else:
         directory_name = '.'
+    return os.path.join(directory_name, modulename + '.py')
+
+
+# source of a module, None if it can't be read
+def readSource(filename):
     try:
-        filename = os.path.join(directory_name, modulename + '.py')
-        return parseFile(filename)
+        f = open(filename, 'r')
+        try:
+            return f.read()
+        finally:
+            f.close()
     except IOError, e:
         warn(str(e))
+        return None
+
+
+def getModuleExp(modulename):
+    filename = getModuleFile(modulename)
+    source = readSource(filename)
+    if source is None:
         return createAST('')
+    return createAST(source, filename)
+
+
+###################################################################
+# incremental analysis
+###################################################################
+# A Session checks new versions of one file. The top level statements
+# are matched with the last version: an unchanged statement keeps its
+# AST nodes, so its functions and classes keep their Closure and
+# ClassType (see define), and the module level code runs again with
+# the summaries of the last run at hand. A call whose summary still
+# holds is replayed instead of analyzing the function body again.
+#
+# A summary of the last run holds if none of the functions its body
+# went into (Summary.deps) was changed or reads a name which may be
+# bound to something else now, and every value it recorded is the
+# same in this run: constants, the kept functions and classes, the
+# inputs of the call and the objects made in the body. Imported
+# modules are reused as by repeated checkFile calls.
+def readNames(node):
+    '@types: ast.AST -> set[str]'
+    return set(n.id for n in ast.walk(node) if IS(n, Name))
+
+
+# names a top level statement binds, also in its blocks
+def boundNames(stmt):
+    '@types: ast.stmt -> set[str]'
+    names = set()
+    todo = [stmt]
+    while todo:
+        node = todo.pop()
+        if IS(node, (FunctionDef, ClassDef)):
+            names.add(node.name)
+            continue
+        elif IS(node, Name) and not IS(node.ctx, Load):
+            names.add(node.id)
+        elif IS(node, alias):
+            names.add((node.asname or node.name).split('.')[0])
+        elif IS(node, Lambda):
+            continue
+        todo.extend(iter_child_nodes(node))
+    return names
+
+
+# names whose values may differ from the last run: the names the
+# changed statements bind, and those of the unchanged statements
+# which read them, directly or through the top level definitions
+def dirtyNames(body, changed, names=readNames):
+    '@types: list[ast.stmt], set[ast.stmt], (ast.AST -> set[str]) -> set[str]'
+    dirty = set()
+    for stmt in changed:
+        dirty |= boundNames(stmt)
+    defs = defaultdict(list)
+    for stmt in body:
+        if IS(stmt, (FunctionDef, ClassDef)):
+            defs[stmt.name].append(stmt)
+    rules = []
+    for stmt in body:
+        if IS(stmt, (FunctionDef, ClassDef)) or stmt in changed:
+            continue
+        reads = set(names(stmt))
+        todo = [name for name in reads if name in defs]
+        while todo:
+            for d in defs[todo.pop()]:
+                for name in names(d):
+                    if name in defs and name not in reads:
+                        todo.append(name)
+                    reads.add(name)
+        rules.append((boundNames(stmt), reads))
+    grown = True
+    while grown:
+        grown = False
+        for (bound, reads) in rules:
+            if not bound <= dirty and not reads.isdisjoint(dirty):
+                dirty |= bound
+                grown = True
+    return dirty
+
+
+class Carried(object):
+    '''the summaries of the last run, for the next run of a Session'''
+
+    def __init__(self, summaries, moduleFuncs, dropped, dirty, kept,
+                 names=readNames):
+        self.summaries = summaries
+        self.names = names          # the names a function reads
+        self.byInput = defaultdict(list)    # (func, canon) -> [Summary]
+        for ((func, _, canon), s) in summaries.iteritems():
+            self.byInput[(func, canon)].append(s)
+        self.moduleFuncs = moduleFuncs      # functions of module level
+        self.dropped = dropped      # functions of the changed statements
+        self.dirty = dirty
+        self.kept = kept            # id -> kept Closure or ClassType
+        self.checked = {}           # id(Summary) -> bool
+        self.cleanFuncs = {}        # function -> bool
+        self.effectNeeds = {}       # id(effect) -> set[id] | None
+        self.envs = []              # keep the envs of the new keys alive
+        self.hits = 0
+
+    def find(self, func, canon, fenv):
+        '@types: ast.AST, tuple, LinkedList -> Summary | None'
+        # the env of a nested function has the locals of its parent,
+        # one of the module level is nil until its definition runs
+        for s in self.byInput.get((func, canon), ()):
+            if ((s.fenv is fenv or func in self.moduleFuncs
+                 and (s.fenv is nil) == (fenv is nil))
+                and self.holds(s)):
+                self.hits += 1
+                self.envs.append(fenv)
+                return s
+        return None
+
+    def holds(self, s):
+        ok = self.checked.get(id(s))
+        if ok is None:
+            ok = self.checked[id(s)] = self.check(s)
+        return ok
+
+    def check(self, s):
+        if not s.reusable or s.to is None:
+            return False
+        for func in s.deps:
+            if func in self.dropped or not self.clean(func):
+                return False
+        for (obj, _) in s.versions:
+            if id(obj) not in self.kept:
+                return False
+        own = set(map(id, s.leaves))
+        own.update(s.fresh)
+        needs = self.needs(s.to)
+        if needs is None or not needs <= own:
+            return False
+        for effect in s.effects:
+            # an effect is in the summaries of all the calls around it
+            needs = self.effectNeeds.get(id(effect), missing)
+            if needs is missing:
+                if effect[0] == 'info':
+                    needs = self.needs(effect[2])
+                elif effect[0] == 'attr':
+                    needs = self.needs([effect[1], effect[3]])
+                else:
+                    needs = self.needs(effect[2][:2])
+                self.effectNeeds[id(effect)] = needs
+            if needs is None or not needs <= own:
+                return False
+        return True
+
+    # a function which reads none of the dirty names
+    def clean(self, func):
+        ok = self.cleanFuncs.get(func)
+        if ok is None:
+            ok = self.cleanFuncs[func] = self.dirty.isdisjoint(
+                self.names(func))
+        return ok
+
+    # ids of the values which are the same in this run only if they
+    # are inputs of the call or made in its body, None if some value
+    # isn't the same anyway
+    def needs(self, t):
+        acc = set()
+        if self.collect(t, acc, set()):
+            return acc
+        return None
+
+    def collect(self, t, acc, seen):
+        if id(t) in seen:
+            return True
+        seen.add(id(t))
+        if IS(t, (list, tuple)):
+            parts = t
+        elif IS(t, (Num, Str, PrimType, UnknownType, ConstSetType, AST,
+                    str, int, long, float, type(None))) or t is nil:
+            return True
+        elif IS(t, (Closure, ClassType)):
+            if id(t) not in self.kept:
+                acc.add(id(t))
+            return True
+        elif IS(t, ObjType):
+            acc.add(id(t))
+            return True
+        elif IS(t, (ListType, TupleType, UnionType)):
+            parts = t.elts
+        elif IS(t, AttrType):
+            parts = (t.clo, t.obj)
+        elif IS(t, FuncType):
+            parts = (t.fromtype, t.totype)
+        elif IS(t, DictType):
+            parts = t.dict
+        elif IS(t, LinkedList):
+            parts = t
+        elif IS(t, SimplePair):
+            parts = (first(t), rest(t))
+        elif IS(t, Exception):
+            parts = t.args
+        else:
+            return False
+        for t1 in parts:
+            if not self.collect(t1, acc, seen):
+                return False
+        return True
+
+
+# what the statements of a module are compared by: their source up
+# to the next statement, without the blank lines before it. A comment
+# there may be the end of a string, it counts
+def stmtKeys(source, body):
+    '@types: str, list[ast.stmt] -> list[str]'
+    lines = source.splitlines()
+    ends = [(stmt.lineno, stmt.col_offset) for stmt in body[1:]]
+    ends.append((len(lines) + 1, 0))
+    keys = []
+    for (stmt, (line, col)) in zip(body, ends):
+        text = lines[stmt.lineno - 1:line]
+        if text:
+            text[-1] = text[-1][:col] if line <= len(lines) else text[-1]
+            text[0] = text[0][stmt.col_offset:]
+        while text and not text[-1].strip():
+            text.pop()
+        keys.append('%d:%s' % (stmt.col_offset, '\n'.join(text)))
+    return keys
+
+
+def analysisMode():
+    return (historyMask, QUERY, ALLOC_SITES, SITE_DEPTH, ENGINE, SUMMARIES,
+            invocationSink is None)
+
+
+class Session(object):
+    '''
+    Checks the versions of one file, each run reusing what the changes
+    leave of the last one.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.tree = None            # the last version
+        self.keys = None            # stmtKeys of its statements
+        self.reads = {}             # node -> readNames(node)
+        self.mode = None
+        self.summaries = {}         # of the last run
+        self.defs = {}              # definitions of the top level
+        self.bodies = {}            # classBodies of the top level
+        self.imported = {}          # filename -> (module, {id: object})
+        self.stats = {}
+
+    def check(self, source=None):
+        '@types: str -> list[Type]'
+        if source is None:
+            f = open(self.filename, 'r')
+            try:
+                source = f.read()
+            finally:
+                f.close()
+        tree = createAST(source, self.filename)
+        keys = stmtKeys(source, tree.body)
+        global carried
+        clear()
+        last = None
+        if self.tree is not None and self.mode == analysisMode():
+            last = self.carry(tree, keys)
+        else:
+            self.stats = {'statements': len(tree.body),
+                          'changed': len(tree.body), 'reused': 0}
+        carried = last
+        try:
+            ret = checkCleared(tree)
+        finally:
+            carried = None
+        self.capture(tree, last)
+        self.keys = keys
+        return ret
+
+    # match the statements of the new version with the last one
+    def carry(self, tree, keys):
+        '@types: ast.Module, list[str] -> Carried'
+        (old, new) = (self.tree.body, tree.body)
+        matcher = difflib.SequenceMatcher(None, self.keys, keys,
+                                          autojunk=False)
+        reused = set()
+        for (i, j, n) in matcher.get_matching_blocks():
+            for k in xrange(n):
+                stmt = old[i + k]
+                if stmt.lineno != new[j + k].lineno:
+                    increment_lineno(stmt, new[j + k].lineno - stmt.lineno)
+                new[j + k] = stmt
+                reused.add(stmt)
+        changed = set(stmt for stmt in old + new if stmt not in reused)
+        dropped = set(node for stmt in old if stmt not in reused
+                      for node in ast.walk(stmt)
+                      if IS(node, (FunctionDef, Lambda)))
+        dirty = dirtyNames(new, changed, self.readNames)
+        self.stats = {'statements': len(new), 'changed': len(changed),
+                      'reused': 0}
+
+        # the kept definitions start over as in a new run
+        kept = {}
+        for (key, entry) in self.defs.iteritems():
+            if key[0] in reused:
+                definitions[key] = entry
+                kept[id(entry[1])] = entry[1]
+        for stmt in reused:
+            entry = IS(stmt, ClassDef) and self.bodies.get(id(stmt.body))
+            if entry:
+                classBodies[id(stmt.body)] = entry
+                for (_, objects) in entry[1].iteritems():
+                    kept.update((id(obj), obj) for obj in objects)
+        for obj in kept.values():
+            obj.env = nil
+            if IS(obj, Closure):
+                obj.defaults = []
+            elif obj.attrs.own is not None:
+                obj.attrs.own = None
+                obj.attrs.extra = 0
+                obj.attrs.writes += 1   # no version of the last run
+        live = dict((getattr(module, 'filename', None), module)
+                    for (module, _) in imported_modules.values())
+        for (filename, (module, objects)) in self.imported.iteritems():
+            if live.get(filename) is module:
+                kept.update(objects)
+
+        moduleFuncs = set()
+        for stmt in new:
+            if IS(stmt, FunctionDef):
+                moduleFuncs.add(stmt)
+            elif IS(stmt, ClassDef):
+                moduleFuncs.update(e for e in stmt.body
+                                   if IS(e, FunctionDef))
+        if '*' in dirty:        # from ... import * of a changed statement
+            summaries = {}
+        else:
+            summaries = self.summaries
+        return Carried(summaries, moduleFuncs, dropped, dirty, kept,
+                       self.readNames)
+
+    def readNames(self, node):
+        names = self.reads.get(node)
+        if names is None:
+            names = self.reads[node] = readNames(node)
+        return names
+
+    def capture(self, tree, last):
+        self.tree = tree
+        self.reads = dict((stmt, self.reads[stmt]) for stmt in tree.body
+                          if stmt in self.reads)
+        self.mode = analysisMode()
+        self.summaries = dict(summaries)
+        if last is not None:
+            self.stats['reused'] = last.hits
+            # summaries of nested calls aren't found again after a hit
+            for (key, s) in last.summaries.iteritems():
+                if key not in self.summaries and last.holds(s):
+                    self.summaries[key] = s
+        top = set(tree.body)
+        self.defs = dict((key, entry)
+                         for (key, entry) in definitions.iteritems()
+                         if key[0] in top and entry[0] is emptyEnv)
+        self.bodies = dict((id(stmt.body), classBodies[id(stmt.body)])
+                           for stmt in tree.body if IS(stmt, ClassDef)
+                           and id(stmt.body) in classBodies)
+        # the definitions of modules imported by this run stay
+        # while the modules are
+        live = dict((getattr(module, 'filename', None), module)
+                    for (module, _) in imported_modules.values())
+        for (key, (env, obj)) in definitions.iteritems():
+            filename = getattr(key[0], 'filename', None)
+            if filename == self.filename or filename not in live \
+                    or env is nil:
+                continue
+            if self.imported.get(filename, (None,))[0] is not live[filename]:
+                self.imported[filename] = (live[filename], {})
+            self.imported[filename][1][id(obj)] = obj
 
 
 ###################################################################
@@ -1326,6 +3291,12 @@ def addToPythonPath(dirname):
     PYTHONPATH.append(dirname)
 
 
+def setEngine(name):
+    assert name in ('recursive', 'worklist')
+    global ENGINE
+    ENGINE = name
+
+
 def installPrinter():
     import inspect
     for _, obj in inspect.getmembers(ast):
@@ -1334,20 +3305,197 @@ def installPrinter():
 
 installPrinter()
 
-if __name__ == '__main__':
-    # test the checker on a file
-    addToPythonPath(os.path.dirname(sys.argv[1]))
-    checkFile(sys.argv[1])
-
 imported_modules = {}
 
 
+####################################################################
+## on-disk cache of module summaries
+####################################################################
+# With a cache directory (see setCacheDir) every analyzed module is
+# also pickled to disk: its AST, its exported symbols and the method
+# invocations recorded while analyzing it. A later run that imports
+# the same unchanged module loads it instead of running inferSeq
+# over its body. Entries are keyed by module path, content hash and
+# analyzer version, and are dropped when any module they import
+# has changed since.
+CACHE_DIR = None
+cacheHits = 0
+cacheMisses = 0
+moduleDeps = {}         # module name -> list of (path, digest) it depends on
+loading = []            # entries of the modules being analyzed, innermost last
+analyzerVersion = None
+PICKLE_RECURSION_LIMIT = 20000      # environments are long linked lists
+
+
+def setCacheDir(dirname):
+    global CACHE_DIR
+    if dirname is not None and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    CACHE_DIR = dirname
+
+
+def getCacheStats():
+    return {'hits': cacheHits, 'misses': cacheMisses}
+
+
+def digest(source):
+    if source is None:
+        return None
+    return hashlib.sha1(source).hexdigest()
+
+
+# hash of the analyzer's own sources, a changed analyzer
+# never reads entries written by another one
+def getAnalyzerVersion():
+    global analyzerVersion
+    if analyzerVersion is None:
+        import lists, hamt, cfg, query
+        h = hashlib.sha1()
+        for m in (sys.modules[__name__], lists, hamt, cfg, query):
+            h.update(readSource(os.path.splitext(m.__file__)[0] + '.py')
+                     or m.__name__)
+        analyzerVersion = h.hexdigest()
+    return analyzerVersion
+
+
+def cachePath(name, dep):
+    key = repr((getAnalyzerVersion(), ENGINE, WIDEN_LIMIT, SUMMARIES,
+                ENV_SNAPSHOTS, invocationSink is None, ALLOC_SITES, SITE_DEPTH,
+                QUERY and sorted(QUERY), name, dep))
+    return os.path.join(CACHE_DIR, hashlib.sha1(key).hexdigest() + '.pickle')
+
+
+def isFresh(deps):
+    for (path, d) in deps:
+        if digest(readSource(path)) != d:
+            return False
+    return True
+
+
+def loadEntry(path):
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return None
+    try:
+        try:
+            return cPickle.load(f)
+        except Exception, e:
+            warn('ignoring broken cache entry', path, e)
+            return None
+    finally:
+        f.close()
+
+
+def saveEntry(path, entry):
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, PICKLE_RECURSION_LIMIT))
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        try:
+            f = open(tmp, 'wb')
+            try:
+                cPickle.dump(entry, f, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(tmp, path)        # readers never see partial entries
+        except (IOError, OSError, RuntimeError,
+                cPickle.PicklingError, TypeError), e:
+            warn('can\'t cache module summary', path, e)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+# make the modules of a cache entry known as if they had been
+# analyzed here, and add them to the entry of the importing module
+def useEntry(entry):
+    for (name, deps) in entry['deps'].iteritems():
+        if name not in imported_modules:
+            imported_modules[name] = entry['modules'][name]
+            if QUERY is not None:
+                indexModule(imported_modules[name][0])
+            moduleDeps[name] = deps
+            for (cls, records) in entry['invocations'].get(name, {}).iteritems():
+                for (record, call) in records:
+                    emitInvocation(cls, record, call)
+    if loading:
+        (_, outer) = loading[-1]
+        for key in ('deps', 'modules', 'invocations'):
+            for (name, value) in entry[key].iteritems():
+                outer[key].setdefault(name, value)
+
+
+def noteImport(name):
+    if loading:
+        (_, outer) = loading[-1]
+        outer['deps'].setdefault(name, moduleDeps[name])
+        outer['modules'].setdefault(name, imported_modules[name])
+        outer['invocations'].setdefault(name, {})
+
+
+def allDeps(entry):
+    ret = set()
+    for deps in entry['deps'].itervalues():
+        ret.update(deps)
+    return ret
+
+
 def get_module_symbols(name):
+    global cacheHits, cacheMisses, callDepth
     if name in imported_modules:
+        noteImport(name)
         return imported_modules.get(name)
-    else:
-        module = getModuleExp(name)
-        env1 = close(module.body, nil)  # TODO refactor along with infer(list)
-        _, module_symbols = inferSeq(module.body, env1, nil)
-        imported_modules[name] = (module, module_symbols)
+
+    filename = getModuleFile(name)
+    source = readSource(filename)
+    dep = (os.path.abspath(filename), digest(source))
+    path = None
+    if CACHE_DIR is not None:
+        path = cachePath(name, dep)
+        entry = loadEntry(path)
+        if entry is not None and isFresh(allDeps(entry)):
+            cacheHits += 1
+            useEntry(entry)
+            return imported_modules[name]
+        cacheMisses += 1
+
+    # the modules imported while analyzing this one and the
+    # invocations recorded by each of them
+    entry = {'deps': {}, 'modules': {}, 'invocations': {name: {}}}
+    loading.append((name, entry))
+    depth = callDepth
+    callDepth = 0               # the module's body is a module scope
+    try:
+        if source is None:
+            module = createAST('')
+        else:
+            module = createAST(source, filename)
+        if PROFILING:
+            enterProfile(profileEntry(module, '<module %s>' % name))
+        try:
+            env1 = close(module.body, emptyEnv)  # TODO refactor along with infer(list)
+            _, module_symbols = inferSeq(module.body, env1, emptyStack)
+        finally:
+            if PROFILING:
+                leaveProfile()
+    finally:
+        callDepth = depth
+        loading.pop()
+    imported_modules[name] = (module, module_symbols)
+    moduleDeps[name] = sorted(allDeps(entry) | set([dep]))
+    entry['deps'][name] = moduleDeps[name]
+    entry['modules'][name] = imported_modules[name]
+    if path is not None:
+        saveEntry(path, entry)
+    if loading:
+        useEntry(entry)
     return module, module_symbols
+
+
+if __name__ == '__main__':
+    # test the checker on a file
+    logging.basicConfig(level=logging.WARN)
+    addToPythonPath(os.path.dirname(sys.argv[1]))
+    checkFile(sys.argv[1])
@@ -0,0 +1,199 @@
+# query.py - which functions can reach the invocations of some classes
+'''
+A syntactic index of the functions of the parsed modules, for the
+query mode of pysonar (see pysonar.setQuery). Functions are known by
+name only: a call f(...) or x.f(...) may reach every function named f.
+
+A function is relevant to the queried classes if it
+
+  * instantiates one of them or calls a method one of them defines,
+  * calls a function by the name of a relevant one, or instantiates a
+    class with a relevant method, or refers to one of them as a value,
+  * calls a name which is no function or class of the index nor a
+    builtin: a parameter, a local or an attribute may hold any
+    function, or
+  * writes an attribute which relevant code reads, the value may end
+    up in the arguments of an invocation.
+
+Module level code always runs, so its reads count as well. Relevance
+only grows as modules are added.
+'''
+import ast
+import __builtin__
+from ast import FunctionDef, ClassDef, Call, Name, Attribute, Assign, \
+    Expr, Global, Load, Store
+from collections import defaultdict
+
+
+# calls by these names can't reach the queried classes, unless an
+# index function or class has the name
+BUILTIN_NAMES = frozenset(dir(__builtin__))
+BUILTIN_METHODS = frozenset(name for t in (str, unicode, list, tuple, dict,
+                                           set, frozenset, int, long,
+                                           float, complex, file)
+                            for name in dir(t))
+
+
+class Def(object):
+    '''a function of the index'''
+    __slots__ = ('name', 'owner', 'calls', 'writes', 'reads', 'relevant')
+
+    def __init__(self, name, owner, calls, writes, reads):
+        self.name = name
+        self.owner = owner          # name of the class of a method
+        self.calls = calls          # names of the functions called or
+                                    # referred to as values
+        self.writes = writes        # names of the written attributes
+        self.reads = reads          # names of the read attributes
+        self.relevant = False
+
+    def __repr__(self):
+        return '<Def %s%s>' % (self.name, ' relevant' * self.relevant)
+
+
+# the nodes of a scope, without the functions defined in it
+def walkScope(node):
+    todo = [node]
+    while todo:
+        node = todo.pop()
+        yield node
+        for child in ast.iter_child_nodes(node):
+            if not isinstance(child, FunctionDef):
+                todo.append(child)
+
+
+# the names called, the names loaded as values, the attributes written
+# and read
+def scan(nodes):
+    '@types: iterable[ast.AST] -> tuple[set[str], ...]'
+    (calls, refs, writes, reads) = (set(), set(), set(), set())
+    callees = set()
+    for node in nodes:
+        if isinstance(node, Call):
+            callees.add(node.func)
+            if isinstance(node.func, Name):
+                calls.add(node.func.id)
+            elif isinstance(node.func, Attribute):
+                calls.add(node.func.attr)
+        elif isinstance(node, Attribute):
+            if isinstance(node.ctx, Load):
+                reads.add(node.attr)
+                if node not in callees:
+                    refs.add(node.attr)
+            else:
+                writes.add(node.attr)
+        elif (isinstance(node, Name) and isinstance(node.ctx, Load)
+              and node not in callees):
+            refs.add(node.id)
+    return (calls, refs, writes, reads)
+
+
+# Calls whose result isn't used get call.unused: expression statements,
+# and assignments in a function to names the function never reads
+def markUnused(root, functions):
+    for node in ast.walk(root):
+        if isinstance(node, Expr) and isinstance(node.value, Call):
+            node.value.unused = True
+    for func in functions:
+        nodes = list(ast.walk(func))
+        used = set()
+        for node in nodes:
+            if isinstance(node, Name) and not isinstance(node.ctx, Store):
+                used.add(node.id)
+            elif isinstance(node, Global):
+                used.update(node.names)
+        for node in nodes:
+            if (isinstance(node, Assign) and isinstance(node.value, Call)
+                and all(isinstance(t, Name) and t.id not in used
+                        for t in node.targets)):
+                node.value.unused = True
+
+
+class QueryIndex(object):
+    def __init__(self, classes):
+        '@types: iterable[str]'
+        self.classes = frozenset(classes)
+        self.defs = {}              # (filename, lineno, col_offset) -> Def
+        self.files = set()
+        self.known = set()          # names of the functions and classes
+        self.hotNames = set()       # calls by these names reach the classes
+        self.hotAttrs = set()       # attributes read by relevant code
+        self.byCall = defaultdict(list)     # name -> [Def] calling it
+        self.byWrite = defaultdict(list)    # attribute -> [Def] writing it
+        self.pending = []           # Defs found relevant, to be marked
+        for name in self.classes:
+            self.heatName(name)
+
+    def add(self, root):
+        '@types: ast.Module -> None'
+        filename = getattr(root, 'filename', None)
+        self.files.add(filename)
+        functions = []
+        owners = {}
+        for node in ast.walk(root):
+            if isinstance(node, FunctionDef):
+                functions.append(node)
+                self.known.add(node.name)
+            elif isinstance(node, ClassDef):
+                self.known.add(node.name)
+                for stmt in node.body:
+                    if isinstance(stmt, FunctionDef):
+                        owners[stmt] = node.name
+                        if node.name in self.classes:
+                            self.heatName(stmt.name)
+        markUnused(root, functions)
+        for func in functions:
+            (calls, refs, writes, reads) = scan(ast.walk(func))
+            d = Def(func.name, owners.get(func), frozenset(calls | refs),
+                    frozenset(writes), frozenset(reads))
+            self.defs[(filename, func.lineno, func.col_offset)] = d
+            for name in d.calls:
+                self.byCall[name].append(d)
+            for attr in d.writes:
+                self.byWrite[attr].append(d)
+            if (not d.calls.isdisjoint(self.hotNames)
+                or not d.writes.isdisjoint(self.hotAttrs)
+                or not self.knownCalls(calls)):
+                self.pending.append(d)
+        (_, _, _, reads) = scan(walkScope(root))
+        self.heatAttrs(reads)
+        self.settle()
+
+    # whether all the names may only call index functions and classes,
+    # or builtins
+    def knownCalls(self, names):
+        for name in names:
+            if (name not in self.known and name not in BUILTIN_NAMES
+                and name not in BUILTIN_METHODS):
+                return False
+        return True
+
+    def heatName(self, name):
+        if name not in self.hotNames:
+            self.hotNames.add(name)
+            self.pending.extend(self.byCall.get(name, ()))
+
+    def heatAttrs(self, attrs):
+        for attr in attrs:
+            if attr not in self.hotAttrs:
+                self.hotAttrs.add(attr)
+                self.pending.extend(self.byWrite.get(attr, ()))
+
+    def settle(self):
+        while self.pending:
+            d = self.pending.pop()
+            if not d.relevant:
+                d.relevant = True
+                self.heatName(d.name)
+                # an instantiation may run __init__ or give an object
+                # whose methods are called later
+                if d.owner is not None:
+                    self.heatName(d.owner)
+                self.heatAttrs(d.reads)
+
+    def relevant(self, func):
+        '@types: ast.FunctionDef -> bool'
+        d = self.defs.get((getattr(func, 'filename', None),
+                           func.lineno, func.col_offset))
+        # a function of a module parsed before the query: analyze it
+        return d is None or d.relevant
@@ -2,4 +2,4 @@ from distutils.core import setup
 
 setup(name='mini-pysonar',
       version='1.0',
-      py_modules=['pysonar', 'lists'])
+      py_modules=['pysonar', 'lists', 'hamt', 'cfg', 'query'])
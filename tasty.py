@@ -28,6 +28,9 @@ class GetNodeValue(VisitorByType):
     def visit_Str(self, node):
         return node.s
 
+    visit_NumConst = visit_Num
+    visit_StrConst = visit_Str
+
     def visit_str(self, node):
         return node
     
@@ -146,10 +149,8 @@ def as_unit(fn):
 
 
 def find_in_history(id_, ps):
-    for ast_node, value in ps.history.iteritems():
-        if (isinstance(ast_node, ast.Name)
-            and ast_node.id == id_):
-            return value
+    for ast_node, value in ps.history.byName(id_):
+        return value
 
 def first_in_history(id_, ps):
     values = find_in_history(id_, ps)
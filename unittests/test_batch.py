@@ -0,0 +1,67 @@
+import unittest
+import pysonar as ps
+import batch
+
+
+FILES = ['tests/dice.py', 'tests/import_test.py', 'tests/obj.py',
+         'tests/performance_issue.py']
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_workers_do_not_change_the_result(self):
+        one = batch.analyze(FILES, jobs=1)
+        two = batch.analyze(FILES, jobs=2)
+        self.assertEqual(one, two)
+        self.assertEqual(sorted(FILES), sorted(one['files']))
+        self.assertEqual({}, one['errors'])
+
+    def test_only_nodes_of_the_file(self):
+        result = batch.analyze(['tests/import_test.py'], jobs=1)
+        for (_, _, node, _) in result['files']['tests/import_test.py']:
+            self.assertTrue('tests/import_test.py' in node, node)
+
+    def test_history_policy(self):
+        full = batch.analyze(FILES, jobs=1)
+        off = batch.analyze(FILES, jobs=1, history=['off'])
+        self.assertEqual(full['invocations'], off['invocations'])
+        self.assertEqual([[]] * len(FILES), off['files'].values())
+
+    def test_query(self):
+        full = batch.analyze(FILES, jobs=1)
+        query = batch.analyze(FILES, jobs=1, query=['ObjectStateHolder'])
+        self.assertEqual(['ObjectStateHolder'], query['invocations'].keys())
+        self.assertEqual(full['invocations']['ObjectStateHolder'],
+                         query['invocations']['ObjectStateHolder'])
+        self.assertEqual(None, ps.QUERY)
+
+    def test_globals_are_restored(self):
+        ps.setHistoryPolicy('errors')
+        path = ps.PYTHONPATH[:]
+        modules = dict(ps.imported_modules)
+        try:
+            batch.analyze(FILES, jobs=1, history=['off'], query=['A'])
+            self.assertEqual(ps.HISTORY_POLICIES['errors'], ps.historyMask)
+            self.assertEqual(path, ps.PYTHONPATH)
+            self.assertEqual(modules, ps.imported_modules)
+            self.assertEqual(None, ps.QUERY)
+        finally:
+            ps.setHistoryPolicy('all')
+
+    def test_merge_is_ordered_by_file(self):
+        results = [batch.analyzeFile(f) for f in FILES]
+        a = batch.merge(results)
+        b = batch.merge(reversed(results))
+        self.assertEqual(a, b)
+        files = [r['file'] for r in a['invocations']['ObjectStateHolder']]
+        self.assertEqual(sorted(files), files)
+
+    def test_errors_are_reported_per_file(self):
+        result = batch.analyze(['tests/mod1.py', 'tests/dice.py'], jobs=1)
+        self.assertTrue(result['errors']['tests/mod1.py']
+                        .startswith('SyntaxError'))
+        self.assertTrue(result['files']['tests/dice.py'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+'''
+Hold the work counters of every file in tests/ to the budgets in
+budgets.json. The counters don't depend on timing, so an algorithmic
+regression fails here on any machine. After a change which is meant
+to do more work, record the budgets again:
+
+    PYSONAR_BUDGETS=record python -m nose unittests/test_budgets.py
+'''
+import glob
+import json
+import os
+import unittest
+import pysonar as ps
+
+
+BUDGETS = os.path.join(os.path.dirname(__file__), 'budgets.json')
+# headroom over the recorded counts, lookups vary a bit with
+# hash randomization (python -R), more so in the small files
+SLACK = 0.2
+MARGIN = 10
+
+
+def flatten(counters):
+    ret = {}
+    for (name, value) in counters.iteritems():
+        if name == 'alloc':
+            for (cls, n) in value.iteritems():
+                ret['alloc.' + cls] = n
+        else:
+            ret[name] = value
+    return ret
+
+
+def measure():
+    ret = {}
+    for filename in sorted(glob.glob('tests/*.py')):
+        # analyze the imported modules again, their work counts too
+        ps.imported_modules.clear()
+        try:
+            ps.checkFile(filename)
+        except SyntaxError:
+            continue
+        ret[filename] = flatten(ps.getWorkCounters())
+    return ret
+
+
+class TestBudgets(unittest.TestCase):
+
+    def setUp(self):
+        self.path = ps.PYTHONPATH[:]
+        ps.PYTHONPATH[:] = ['tests']
+
+    def tearDown(self):
+        ps.PYTHONPATH[:] = self.path
+        ps.imported_modules.clear()
+
+    def test_work_within_budgets(self):
+        counters = measure()
+        if os.environ.get('PYSONAR_BUDGETS') == 'record':
+            f = open(BUDGETS, 'w')
+            json.dump(counters, f, indent=1, sort_keys=True)
+            f.write('\n')
+            f.close()
+            return
+        budgets = json.load(open(BUDGETS))
+        self.assertEqual(sorted(budgets), sorted(counters))
+        over = []
+        for (filename, counts) in sorted(counters.iteritems()):
+            budget = budgets[filename]
+            for (name, n) in sorted(counts.iteritems()):
+                if n > budget.get(name, 0) * (1 + SLACK) + MARGIN:
+                    over.append('%s %s: %d, budget %d'
+                                % (filename, name, n, budget.get(name, 0)))
+        self.assertEqual([], over)
+
+    def test_counters_are_reset(self):
+        ps.checkString('x = 1')
+        small = ps.getWorkCounters()
+        ps.checkFile('tests/dice.py')
+        ps.checkString('x = 1')
+        self.assertEqual(small, ps.getWorkCounters())
+        # the constant is its Num node, nothing is allocated
+        self.assertEqual({}, small['alloc'])
+        self.assertTrue(small['infer'] > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
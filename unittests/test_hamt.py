@@ -0,0 +1,120 @@
+import unittest
+import lists
+from lists import nil, ext, lookup
+import hamt
+from hamt import HashTrie
+import pysonar as ps
+
+
+class CollidingKey(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __hash__(self):
+        return 42
+
+    def __eq__(self, other):
+        return isinstance(other, CollidingKey) and self.name == other.name
+
+
+class TestHashTrie(unittest.TestCase):
+
+    def test_lookup_missing(self):
+        self.assertEqual(None, lookup('x', HashTrie()))
+
+    def test_shadowing(self):
+        env = ext('x', 2, ext('x', 1, HashTrie()))
+        self.assertEqual(2, lookup('x', env))
+        self.assertEqual(1, len(env))
+
+    def test_persistence(self):
+        env1 = ext('x', 1, HashTrie())
+        env2 = ext('x', 2, env1)
+        self.assertEqual(1, lookup('x', env1))
+        self.assertEqual(2, lookup('x', env2))
+
+    def test_many_keys(self):
+        env = HashTrie()
+        for i in xrange(5000):
+            env = ext('name%d' % i, i, env)
+        for i in xrange(5000):
+            self.assertEqual(i, lookup('name%d' % i, env))
+        self.assertEqual(5000, len(env))
+
+    def test_hash_collisions(self):
+        a, b = CollidingKey('a'), CollidingKey('b')
+        env = ext(b, 2, ext(a, 1, ext('x', 0, HashTrie())))
+        self.assertEqual(1, lookup(a, env))
+        self.assertEqual(2, lookup(b, env))
+        self.assertEqual(2, lookup(b, ext(a, 3, env)))
+        self.assertEqual(3, lookup(a, ext(a, 3, env)))
+
+    def test_iterates_newest_first(self):
+        env = ext('z', 3, ext('x', 2, ext('y', 1, HashTrie())))
+        self.assertEqual(['z', 'x', 'y'], [p.fst for p in env])
+
+    def test_nodes_count_their_leaves(self):
+        env = HashTrie()
+        for i in xrange(2000):
+            env = ext('name%d' % i, i, env)
+        env = ext(CollidingKey('b'), 2, ext(CollidingKey('a'), 1, env))
+        todo = [env.root]
+        while todo:
+            node = todo.pop()
+            self.assertEqual(len(list(hamt.leaves(node))), hamt.size(node))
+            if isinstance(node, hamt.Node):
+                todo.extend(node.items)
+        self.assertEqual(2002, hamt.size(env.root))
+
+    def test_extend_shadows_like_append(self):
+        pos = ext('x', 1, ext('y', 2, nil))
+        env = lists.extend(pos, ext('x', 0, HashTrie()))
+        self.assertEqual(1, lookup('x', env))
+        self.assertEqual(2, lookup('y', env))
+
+
+class TestMergeEnv(unittest.TestCase):
+
+    def test_keeps_common_names(self):
+        base = ext('a', [1], HashTrie())
+        env1 = ext('b', [2], base)
+        env2 = ext('b', [3], ext('c', [4], base))
+        merged = ps.mergeEnv(env1, env2)
+        self.assertEqual([1], lookup('a', merged))
+        self.assertEqual([2, 3], lookup('b', merged))
+        self.assertEqual(None, lookup('c', merged))
+
+    def test_shared_subtries_are_not_visited(self):
+        env = HashTrie()
+        for i in xrange(5000):
+            env = ext('name%d' % i, i, env)
+        visited = []
+        leaves = hamt.leaves
+
+        def counting(node):
+            visited.append(node)
+            return leaves(node)
+        hamt.leaves = counting
+        try:
+            merged = env.merge(ext('new', 0, env), lambda a, b: a)
+        finally:
+            hamt.leaves = leaves
+        self.assertEqual(5000, len(merged))
+        # only the leaves on the path to the new key
+        self.assertTrue(len(visited) < 10, len(visited))
+
+    def test_same_result_as_lists(self):
+        def build(env):
+            env = ext('x', [1], ext('y', [2], env))
+            return (ext('x', [3], env), ext('y', [4], env))
+        (l1, l2) = build(nil)
+        (t1, t2) = build(HashTrie())
+        merged_lists = ps.mergeEnv(l1, l2)
+        merged_trie = ps.mergeEnv(t1, t2)
+        for name in ['x', 'y']:
+            self.assertEqual(lookup(name, merged_lists),
+                             lookup(name, merged_trie))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import glob
+import unittest
+import pysonar as ps
+from tasty import find_in_history
+
+
+SOURCE = '''
+def helper(x):
+    return x
+
+def f(a):
+    y = helper(a)
+    return y
+
+class A:
+    def m(self, v):
+        return f(v)
+
+r = f(1)
+s = A().m(2)
+'''
+
+
+def results():
+    history = sorted('%r %r %r' % (k, getattr(k, 'col_offset', None),
+                                   sorted(set(map(repr, v))))
+                     for (k, v) in ps.history.items())
+    invocations = sorted((name, repr(map(ps.projectTypes, ctorargs)),
+                          repr(map(ps.projectTypes, callargs)))
+                         for (name, rs) in ps.getMethodInvocationInfo().items()
+                         for (ctorargs, callargs, _) in rs)
+    return (history, invocations)
+
+
+def fresh(source, filename='<string>'):
+    ps.checkExp(ps.createAST(source, filename))
+    return results()
+
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        self.path = ps.PYTHONPATH[:]
+        ps.PYTHONPATH[:] = ['tests']
+
+    def tearDown(self):
+        ps.PYTHONPATH[:] = self.path
+        ps.imported_modules.clear()
+
+    # the session leaves the same results as a new analysis
+    def check(self, session, source):
+        expected = fresh(source, session.filename)
+        session.check(source)
+        self.assertEqual(expected, results())
+        return session.stats
+
+    def test_unchanged_functions_are_replayed(self):
+        session = ps.Session('<string>')
+        self.assertEqual(0, self.check(session, SOURCE)['reused'])
+        stats = self.check(session, SOURCE + 'z = f(1)\n')
+        # r = f(1) and A().m(2), z = f(1) then reuses the one of r
+        self.assertEqual({'statements': 6, 'changed': 1, 'reused': 2},
+                         stats)
+
+    def test_changed_function_is_analyzed_again(self):
+        session = ps.Session('<string>')
+        session.check(SOURCE)
+        stats = self.check(session,
+                           SOURCE.replace('return x', 'return [x]'))
+        # f and m call helper
+        self.assertEqual(0, stats['reused'])
+        self.assertEqual('[list:(1,)]', repr(find_in_history('r', ps)))
+
+    def test_changed_global_is_read_again(self):
+        source = '''
+K = 1
+
+def get():
+    return K
+
+r = get()
+'''
+        session = ps.Session('<string>')
+        session.check(source)
+        stats = self.check(session, source.replace('K = 1', "K = 'one'"))
+        self.assertEqual(0, stats['reused'])
+        self.assertEqual(['one'], [t.s for t in find_in_history('r', ps)])
+
+    def test_call_before_definition(self):
+        source = '''
+def h(x):
+    return h
+
+r = h(1)
+'''
+        session = ps.Session('<string>')
+        session.check(source)
+        # h isn't bound in its env yet where it is called now
+        self.check(session, 'r = h(1)\n' + source)
+
+    def test_moved_statements(self):
+        session = ps.Session('<string>')
+        session.check(SOURCE)
+        stats = self.check(session, '\n\n' + SOURCE)
+        self.assertEqual(0, stats['changed'])
+        self.assertEqual(2, stats['reused'])
+
+    def test_same_as_check_after_deleting_statements(self):
+        for filename in sorted(glob.glob('tests/*.py')):
+            source = open(filename).read()
+            session = ps.Session(filename)
+            try:
+                session.check(source)
+            except SyntaxError:     # also in an imported module
+                continue
+            lines = source.split('\n')
+            starts = [stmt.lineno - 1 for stmt in session.tree.body]
+            for (start, end) in zip(starts, starts[1:] + [len(lines)]):
+                self.check(session, '\n'.join(lines[:start] + lines[end:]))
+                self.check(session, source)
+
+
+if __name__ == '__main__':
+    unittest.main()
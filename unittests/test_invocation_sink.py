@@ -0,0 +1,121 @@
+import json
+import unittest
+from StringIO import StringIO
+import pysonar as ps
+
+
+SOURCE = '''
+class Conn:
+    def __init__(self, host):
+        self.host = host
+
+    def send(self, data):
+        return data
+
+def use(c):
+    c.send('ping')
+
+c = Conn('db')
+c.send(42)
+use(Conn('db'))
+use(Conn('cache'))
+'''
+
+
+class TestJsonlSink(unittest.TestCase):
+
+    def setUp(self):
+        self.out = StringIO()
+        ps.setInvocationSink(ps.JsonlSink(self.out))
+
+    def tearDown(self):
+        ps.setInvocationSink(None)
+
+    def lines(self):
+        return [json.loads(line) for line in self.out.getvalue().splitlines()]
+
+    def test_invocations_are_streamed(self):
+        ps.checkString(SOURCE)
+        self.assertEqual({}, dict(ps.getMethodInvocationInfo()))
+        lines = self.lines()
+        self.assertEqual(6, len(lines))
+        self.assertEqual({'class': 'Conn',
+                          'ctorargs': [[['str', 'db']]],
+                          'callargs': [[['num', 42]]],
+                          'file': '<string>',
+                          'line': 13}, lines[1])
+
+    def test_replayed_summaries_are_streamed(self):
+        ps.checkString(SOURCE)
+        self.assertEqual(1, ps.getSummaryStats()['hits'])
+        # the second use() is replayed onto the 'cache' connection
+        replayed = self.lines()[-1]
+        self.assertEqual(10, replayed['line'])
+        self.assertEqual([[['str', 'cache']]], replayed['ctorargs'])
+        self.assertEqual([[['str', 'ping']]], replayed['callargs'])
+
+    def test_summaries_keep_no_envs(self):
+        ps.checkString(SOURCE)
+        envs = [effect[2][2] for s in ps.summaries.values()
+                for effect in s.effects if effect[0] == 'call']
+        # of use(), with c.send('ping')
+        self.assertTrue(envs)
+        self.assertTrue(all(env is ps.nil for env in envs))
+
+    def test_widened_constants_are_streamed_whole(self):
+        names = ["'n%d'" % i for i in xrange(15)]
+        ps.setWidenLimit(10)
+        try:
+            ps.checkString(SOURCE + '''
+for name in [%s]:
+    c.send(name)
+''' % ', '.join(names))
+        finally:
+            ps.setWidenLimit(256)
+        callargs = self.lines()[-1]['callargs']
+        self.assertEqual(sorted('n%d' % i for i in xrange(15)),
+                         [value for (_, value) in callargs[0]])
+
+    def test_same_records_as_mydict(self):
+        ps.checkString(SOURCE)
+        streamed = len(self.lines())
+        ps.setInvocationSink(None)
+        ps.checkString(SOURCE)
+        self.assertEqual(streamed,
+                         len(ps.getMethodInvocationInfo()['Conn']))
+
+
+class TestEnvSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        ps.useEnvSnapshots(True)
+
+    def tearDown(self):
+        ps.useEnvSnapshots(False)
+
+    def test_only_argument_names_are_kept(self):
+        ps.checkString('''
+class Conn:
+    def send(self, data):
+        return data
+
+unrelated = 'x'
+msg = 'ping'
+c = Conn()
+c.send(msg)
+c.send(msg)
+c.send('pong')
+''')
+        records = ps.getMethodInvocationInfo()['Conn']
+        self.assertEqual(3, len(records))
+        env = records[0][2]
+        self.assertEqual(['msg'], [p.fst for p in env])
+        # what processing.convertName does
+        self.assertEqual('ping', ps.lookup('msg', env)[0].s)
+        # the same bindings share one snapshot
+        self.assertTrue(env is records[1][2])
+        self.assertTrue(records[2][2] is ps.nil)
+
+
+if __name__ == '__main__':
+    unittest.main()
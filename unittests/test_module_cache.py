@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pysonar as ps
+from tasty import first_in_history
+
+
+class TestModuleCache(unittest.TestCase):
+
+    def setUp(self):
+        self.src = tempfile.mkdtemp()
+        self.cache = tempfile.mkdtemp()
+        self.path = ps.PYTHONPATH[:]
+        ps.PYTHONPATH.insert(0, self.src)
+        ps.setCacheDir(self.cache)
+        ps.cacheHits = ps.cacheMisses = 0
+        self.write('util', '''
+class Conn:
+    def send(self, x):
+        return x
+
+def connect(host):
+    c = Conn()
+    c.send(host)
+    return c
+''')
+        self.write('app_base', '''
+import util
+from util import connect
+conn = connect('db')
+''')
+
+    def tearDown(self):
+        ps.setCacheDir(None)
+        ps.PYTHONPATH[:] = self.path
+        self.forget()
+        shutil.rmtree(self.src)
+        shutil.rmtree(self.cache)
+
+    def write(self, name, source):
+        f = open(os.path.join(self.src, name + '.py'), 'w')
+        f.write(source)
+        f.close()
+
+    # start over like a new process would
+    def forget(self):
+        for name in ('util', 'app_base'):
+            ps.imported_modules.pop(name, None)
+            ps.moduleDeps.pop(name, None)
+
+    def check(self):
+        ps.checkString('from app_base import conn\nresult = conn')
+        return first_in_history('result', ps)
+
+    def test_warm_run_reads_the_cache(self):
+        cold = self.check()
+        cold_calls = len(ps.getMethodInvocationInfo()['Conn'])
+        self.assertEqual({'hits': 0, 'misses': 2}, ps.getCacheStats())
+
+        self.forget()
+        warm = self.check()
+        self.assertEqual({'hits': 1, 'misses': 2}, ps.getCacheStats())
+        self.assertTrue(isinstance(warm, ps.ObjType))
+        self.assertEqual(cold.classtype, warm.classtype)
+        self.assertEqual(sorted(cold.attrs), sorted(warm.attrs))
+        self.assertEqual(cold_calls,
+                         len(ps.getMethodInvocationInfo()['Conn']))
+        # the modules imported by app_base come along
+        self.assertTrue('util' in ps.imported_modules)
+
+    def test_changed_import_invalidates(self):
+        self.check()
+        self.forget()
+        self.write('util', '''
+def connect(host):
+    return host
+''')
+        self.check()
+        self.assertEqual({'hits': 0, 'misses': 4}, ps.getCacheStats())
+        self.assertEqual('db', self.check().s)
+
+    def test_in_process_modules_are_kept(self):
+        self.check()
+        self.check()
+        self.assertEqual({'hits': 0, 'misses': 2}, ps.getCacheStats())
+
+
+if __name__ == '__main__':
+    unittest.main()
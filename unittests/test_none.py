@@ -24,5 +24,20 @@ class Test(PysonarTest):
         self.assertEqual([PrimType(None)], a)
 
 
+class TestNames(PysonarTest):
+
+    def testBuiltinNames(self):
+        pysonar.checkString('a = len\nb = True')
+        self.assertEqual([PrimType(len)], self.first_in_history('a'))
+        self.assertEqual([PrimType(True)], self.first_in_history('b'))
+
+    def testAnalyzerNamesAreNotVisible(self):
+        pysonar.checkString('a = history\nb = history')
+        a = self.first_in_history('a')
+        self.assertTrue(isinstance(a[0], pysonar.UnknownType))
+        # unknown names are remembered per node
+        self.assertEqual(2, len(pysonar.unknownNames))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -13,7 +13,10 @@ class Test(PysonarTest):
     def testShouldPrintFilename(self):
         pysonar.checkString('a = 1\nb = 1')
         b = self.first_in_history('b')
-        self.assertEqual(str(b), '[1@<string>:2]')
+        self.assertEqual(str(b), '[1]')
+        # values are shared, their locations are kept on the side
+        self.assertEqual(str(pysonar.getConstSites(b[0])),
+                         '[1@<string>:1, 1@<string>:2]')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+import unittest
+from StringIO import StringIO
+import pysonar as ps
+
+
+SOURCE = '''
+class A:
+    def __init__(self, x):
+        self.x = x
+
+def fact(n):
+    return fact(n)
+
+def g(x):
+    return x
+
+a = A(1)
+fact(1)
+g(1)
+g(1)
+'''
+
+
+class TestProfile(unittest.TestCase):
+
+    def setUp(self):
+        ps.useProfiling(True)
+
+    def tearDown(self):
+        ps.useProfiling(False)
+
+    def entries(self):
+        return dict((key[1:], entry)
+                    for (key, entry) in ps.getProfile().iteritems())
+
+    def test_work_is_charged_to_analyzed_definitions(self):
+        ps.checkString(SOURCE)
+        entries = self.entries()
+        self.assertEqual(
+            [(0, '<module>'), (2, 'A'), (3, '__init__'), (6, 'fact'),
+             (9, 'g')], sorted(entries))
+        self.assertEqual(1, entries[(2, 'A')].calls)
+        self.assertEqual(1, entries[(3, '__init__')].calls)
+        # the recursive call site is cut off the second time it is reached
+        self.assertEqual(3, entries[(6, 'fact')].calls)
+        self.assertEqual(1, entries[(6, 'fact')].cutoffs)
+        self.assertEqual((2, 1), (entries[(9, 'g')].calls,
+                                  entries[(9, 'g')].hits))
+        module = entries[(0, '<module>')]
+        self.assertTrue(module.visits > entries[(9, 'g')].visits > 0)
+        self.assertTrue(module.totalTime >= module.selfTime >= 0)
+        self.assertEqual([], ps.profileStack)
+
+    def test_report(self):
+        ps.checkString(SOURCE)
+        out = StringIO()
+        ps.printProfile('calls', limit=2, out=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].split()[:2] == ['self', 'total'])
+        self.assertTrue(lines[1].endswith('<string>:6 fact')
+                        or lines[1].endswith('<string>:9 g'))
+
+    def test_off(self):
+        ps.useProfiling(False)
+        ps.checkString(SOURCE)
+        self.assertEqual({}, ps.getProfile())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@ Created on Jul 5, 2013
 
 @author: signalpillar
 '''
+import cPickle
 import unittest
 import pysonar as ps
 import lists
@@ -33,6 +34,422 @@ class Test(unittest.TestCase):
         self.assertEqual([2, 3, 4, 5],
                          ps.removeType(1, [1, 2, 3, 1, 4, 5]))
 
+    def test_union_keeps_insertion_order(self):
+        u = ps.union([[3, 1], 2, [1, 3, 4]])
+        self.assertEqual([3, 1, 2, 4], u)
+        self.assertTrue(ps.inUnion(4, u))
+        self.assertFalse(ps.inUnion(5, u))
+
+    def test_union_of_equal_types(self):
+        u = ps.union([[ps.PrimType(None), ps.DictType(lists.nil)],
+                      [ps.PrimType(None), ps.DictType(lists.nil),
+                       ps.TupleType([[1], [2]]), ps.TupleType([[1], [2]])]])
+        self.assertEqual(3, len(u))
+
+    def test_union_of_unhashable_values(self):
+        u = ps.union([[{}, 1], [{}, 1]])
+        self.assertEqual([{}, 1], u)
+
+    def test_equal_types_have_equal_hashes(self):
+        pairs = [(ps.PrimType('int'), ps.PrimType('int')),
+                 (ps.DictType(lists.nil), ps.DictType(lists.slist([1]))),
+                 (ps.TupleType([[1], [2]]), ps.TupleType([[1], [2]])),
+                 (ps.ListType((1, 2)), ps.ListType((1, 2))),
+                 (ps.FuncType(lists.slist([lists.SimplePair('x', [1])]), [2]),
+                  ps.FuncType(lists.slist([lists.SimplePair('x', [1])]), [2]))]
+        for (t1, t2) in pairs:
+            self.assertEqual(t1, t2)
+            self.assertEqual(hash(t1), hash(t2))
+
+
+class TestCallStack(unittest.TestCase):
+
+    def test_finds_frame_with_wider_input_types(self):
+        call = object()
+        stk = ps.emptyStack.push(call, lists.slist([lists.SimplePair('x', [1, 2])]))
+        self.assertTrue(ps.onStack(call, lists.slist([lists.SimplePair('x', [1])]), stk))
+        self.assertFalse(ps.onStack(call, lists.slist([lists.SimplePair('x', [3])]), stk))
+        self.assertFalse(ps.onStack(call, lists.slist([lists.SimplePair('y', [1])]), stk))
+
+    def test_only_frames_of_the_same_call_site(self):
+        call1, call2 = object(), object()
+        args = lists.slist([lists.SimplePair('x', [1])])
+        stk = ps.emptyStack.push(call1, args)
+        self.assertFalse(ps.onStack(call2, args, stk))
+        self.assertTrue(ps.onStack(call1, args, stk.push(call2, args)))
+        self.assertFalse(ps.onStack(call1, args, ps.emptyStack))
+
+
+class TestHistory(unittest.TestCase):
+
+    def test_tables_only_hold_recorded_nodes(self):
+        sizes = set()
+        for _ in xrange(5):
+            ps.checkString('x = 1\ny = x')
+            self.assertEqual(len(ps.history), len(ps.history.types))
+            sizes.add(len(ps.history.nodes))
+        # parsing more trees doesn't make them grow
+        self.assertEqual(set([3]), sizes)
+
+    def test_indexes(self):
+        ps.checkString('''
+x = 1
+y = x
+x = 'a'
+''')
+        xs = ps.history.byName('x')
+        self.assertEqual([2, 3, 4], [node.lineno for (node, _) in xs])
+        self.assertEqual([4], [node.lineno for node
+                               in ps.getConstSites(xs[2][1][0])])
+        self.assertEqual(4, len(ps.history.byKind(ps.Name)))
+        self.assertEqual([], ps.history.byName('z'))
+
+    def test_reads_like_a_dict(self):
+        h = ps.History()
+        node = ps.Name(id='n', lineno=1)
+        h[node] = [1]
+        h['kwarg'] = [2]                # keyword names aren't nodes
+        h[node] = [3]
+        self.assertEqual([3], h[node])
+        self.assertEqual([2], h.get('kwarg'))
+        self.assertEqual(None, h.get(ps.Name(id='n', lineno=1)))
+        self.assertEqual([(node, [3]), ('kwarg', [2])], h.items())
+        self.assertEqual(2, len(h))
+        self.assertRaises(KeyError, lambda: h['other'])
+
+    def test_stale_id_is_renumbered(self):
+        h = ps.History()
+        old = ps.Name(id='a', lineno=1)
+        new = ps.Name(id='b', lineno=1)
+        h[old] = [1]
+        new.nid = old.nid               # e.g. a module read from the cache
+        h[new] = [2]
+        self.assertNotEqual(old.nid, new.nid)
+        self.assertEqual([1], h[old])
+        self.assertEqual([2], h[new])
+
+
+class TestHistoryPolicy(unittest.TestCase):
+
+    source = '''
+def f(x):
+    y = x
+    return y
+
+a = f(1)
+b = z
+'''
+
+    def tearDown(self):
+        ps.setHistoryPolicy('all')
+
+    def recorded(self):
+        return sorted(set(node.__class__.__name__
+                          for node in ps.history.keys()))
+
+    def test_all(self):
+        ps.checkString(self.source)
+        self.assertEqual(['FunctionDef', 'Name'], self.recorded())
+
+    def test_off(self):
+        ps.setHistoryPolicy('off')
+        ps.checkString(self.source)
+        self.assertEqual(1, ps.getSummaryStats()['misses'])   # f was analyzed
+        self.assertEqual(0, len(ps.history))
+
+    def test_module_names(self):
+        ps.setHistoryPolicy('module-names')
+        ps.checkString(self.source)
+        self.assertEqual(['a', 'b', 'f', 'z'],
+                         sorted(node.id for node in ps.history.keys()))
+
+    def test_funcs_and_errors(self):
+        ps.setHistoryPolicy('funcs', 'errors')
+        ps.checkString(self.source + 'c = 1()\n')
+        self.assertEqual(['Call', 'FunctionDef'], self.recorded())
+
+
+class TestConstants(unittest.TestCase):
+
+    def test_one_union_member_per_value(self):
+        ps.checkString('''
+def f(x):
+    if x:
+        return 'foo'
+    elif x:
+        return 'foo'
+    return 1.0
+
+r = f(1)
+''')
+        r = ps.history.byName('r')[0][1]
+        self.assertEqual(['foo', 1.0],
+                         [getattr(t, 's', getattr(t, 'n', t)) for t in r])
+        self.assertEqual([4, 6], [node.lineno
+                                  for node in ps.getConstSites(r[0])])
+        # 1.0 == 1, but they are different constants
+        self.assertFalse(ps.const(1) == ps.const(1.0))
+
+    def test_repeated_dict_keys(self):
+        ps.checkString("d = {'a': 1, 'b': 2, 'a': 3}")
+        d = ps.history.byName('d')[0][1][0]
+        self.assertEqual([('b', [2]), ('a', [3])],
+                         [(p.fst.s, [t.n for t in p.snd]) for p in d.dict])
+
+    def test_unpickled_as_pooled_constant(self):
+        c = ps.const('foo')
+        self.assertTrue(c is cPickle.loads(cPickle.dumps(c, 2)))
+
+
+
+class TestHashConsing(unittest.TestCase):
+
+    def test_equal_values_are_shared(self):
+        one = ps.const(1)
+        t = ps.tupleType([[one], [ps.PrimType(None)]])
+        self.assertTrue(t is ps.tupleType([[one], [ps.PrimType(None)]]))
+        self.assertTrue(ps.listType((t,)) is ps.listType((t,)))
+        f = ps.funcType(lists.slist([lists.SimplePair('x', [one])]), [t])
+        self.assertTrue(f is ps.funcType(
+            lists.slist([lists.SimplePair('x', [one])]), [t]))
+        self.assertTrue(ps.dictType(nil) is ps.dictType(nil))
+        # the constructors are not shared, but still equal
+        self.assertEqual(t, ps.TupleType([[one], [ps.PrimType(None)]]))
+
+    def test_objects_by_identity(self):
+        ps.checkString('''
+class A:
+    pass
+
+a = A()
+b = A()
+''')
+        a = ps.history.byName('a')[0][1][0]
+        b = ps.history.byName('b')[0][1][0]
+        self.assertEqual(a, b)
+        self.assertFalse(ps.listType((a,)) is ps.listType((b,)))
+        self.assertTrue(ps.listType((a,)) is ps.listType((a,)))
+
+    def test_unused_values_are_dropped(self):
+        key = (ps.ListType, (ps.const('dropped'),))
+        ps.listType((ps.const('dropped'),))
+        self.assertFalse(key in ps.conses)
+
+
+class TestAttrMap(unittest.TestCase):
+
+    def test_reads_through_to_parents(self):
+        base = ps.AttrMap()
+        base['m'] = [1]
+        base['n'] = [2]
+        cls = ps.AttrMap((base,))
+        cls['n'] = [3]
+        obj = ps.AttrMap((cls,))
+        self.assertTrue(obj.own is None)
+        self.assertEqual([3], obj['n'])
+        self.assertEqual([('m', [1]), ('n', [3])], sorted(obj.iteritems()))
+        version = obj.version()
+        base['m'] = [4]
+        self.assertEqual([4], obj.get('m'))
+        self.assertNotEqual(version, obj.version())
+        self.assertRaises(KeyError, lambda: obj['x'])
+
+    def test_equality(self):
+        cls = ps.AttrMap()
+        cls['x'] = [1]
+        a = ps.AttrMap((cls,))
+        b = ps.AttrMap((cls,))
+        self.assertEqual(a, b)
+        a['x'] = [1]
+        self.assertEqual(a, b)
+        b['y'] = [2]
+        self.assertNotEqual(a, b)
+        flat = ps.AttrMap()
+        flat['x'] = [1]
+        flat['y'] = [2]
+        self.assertEqual(flat, b)
+
+    def test_instances_share_class_attributes(self):
+        ps.checkString('''
+class A:
+    def m(self):
+        pass
+
+a = A()
+a.x = 1
+''')
+        a = ps.history.byName('a')[0][1][0]
+        self.assertEqual(['m', 'x'], sorted(a.attrs))
+        self.assertEqual(['x'], a.attrs.own.keys())
+        self.assertTrue(a.attrs.parents[0] is a.classtype.attrs)
+
+
+class TestDispatch(unittest.TestCase):
+
+    def test_subclass_gets_first_matching_rule(self):
+        dispatch = ps.Dispatch([(ps.Num, 'num'), ((ps.Num, ps.Str), 'const')],
+                               'default')
+        self.assertEqual('num', dispatch(ps.const(1)))
+        self.assertEqual('const', dispatch(ps.Str(s='s')))
+        self.assertEqual('default', dispatch(ps.Name(id='n')))
+        self.assertEqual([ps.Name, ps.NumConst, ps.Str],
+                         sorted(dispatch.table, key=lambda c: c.__name__))
+
+    def test_statements_keep_their_order(self):
+        self.assertTrue(ps.seqHandler(ps.If()) is ps.seqIf)
+        self.assertEqual(None, ps.seqHandler(ps.Assign()))
+        self.assertTrue(ps.stmtHandler(ps.Assign()) is ps.inferAssign)
+        self.assertRaises(TypeError, ps.inferStmt, ps.Lambda(), nil, None)
+
+    def test_parameter_layout(self):
+        tree = ps.createAST('def f(a, (b, c), d=1, *rest, **kw):\n'
+                            '    pass\n'
+                            'g = lambda x, y=2: x\n')
+        f = tree.body[0].layout
+        self.assertEqual(['a', None, 'd'], f.names)
+        self.assertEqual(frozenset(['a', 'd']), f.named)
+        self.assertEqual((2, 'rest', 'kw'), (f.firstDefault, f.vararg, f.kwarg))
+        g = tree.body[1].value.layout
+        self.assertEqual((['x', 'y'], 1), (g.names, g.firstDefault))
+        ps.checkString('def f(a, (b, c), d=1, *rest, **kw):\n'
+                       '    return kw\n'
+                       'r = f(1, (2, 3), x=4)\n')
+        r = ps.history.byName('r')[0][1]
+        self.assertEqual([['type', "dict:(('x' . [4]))"]], ps.projectTypes(r))
+
+
+class TestDefinitions(unittest.TestCase):
+
+    def test_class_body_is_closed_once(self):
+        ps.checkString('''
+def make(x):
+    class C:
+        def m(self, a=x):
+            return a
+    return C()
+
+a = make(1)
+b = make('s')
+''')
+        a = ps.history.byName('a')[0][1][0]
+        b = ps.history.byName('b')[0][1][0]
+        self.assertFalse(a.classtype is b.classtype)
+        self.assertTrue(a.classtype.attrs.parents[0]
+                        is b.classtype.attrs.parents[0])
+        # make and one m
+        self.assertEqual(2, ps.getWorkCounters()['alloc']['Closure'])
+        # class writes stay with their ClassType
+        a.classtype.attrs['v'] = [1]
+        self.assertEqual(None, b.classtype.attrs.get('v'))
+
+    def test_same_env_same_definitions(self):
+        tree = ps.createAST('def f():\n    pass\nclass A:\n    pass\n')
+        env1 = ps.close(tree.body, ps.emptyEnv)
+        env2 = ps.close(tree.body, ps.emptyEnv)
+        for name in ('f', 'A'):
+            self.assertTrue(ps.lookup(name, env1)[0]
+                            is ps.lookup(name, env2)[0])
+        env3 = ps.close(tree.body, ps.ext('x', [1], ps.emptyEnv))
+        self.assertFalse(ps.lookup('f', env1)[0] is ps.lookup('f', env3)[0])
+
+    def test_returned_closure_keeps_its_env(self):
+        ps.checkString('''
+class O:
+    pass
+
+o = O()
+
+def g():
+    x = o.v
+    def inner():
+        return x
+    return inner
+
+o.v = 1
+a = g()
+o.v = 'changed'
+b = g()
+ra = a()
+''')
+        # an attribute reference to the value of o.v when a was made
+        [ra] = ps.history.byName('ra')[0][1]
+        self.assertEqual([1], [t.n for t in ra.clo])
+
+    def test_nested_definitions_are_not_kept(self):
+        sizes = []
+        for calls in (5, 50):
+            ps.checkString('''
+def g(x):
+    def inner():
+        return x
+    return inner
+''' + ''.join('r%d = g(%d)\n' % (i, i) for i in xrange(calls)))
+            sizes.append(len(ps.definitions))
+        # only g
+        self.assertEqual([1, 1], sizes)
+
+    def test_defaults_are_not_repeated(self):
+        ps.checkString('''
+def g(a=1):
+    return a
+
+r = g()
+''')
+        g = ps.history.byName('g')[0][1][0]
+        self.assertEqual(1, len(g.defaults))
+
+
+class TestAllocationSites(unittest.TestCase):
+
+    def tearDown(self):
+        ps.useAllocationSites(False)
+
+    def objects(self, name):
+        return [t for (_, ts) in ps.history.byName(name) for t in ts
+                if ps.IS(t, ps.ObjType)]
+
+    def test_one_object_per_site(self):
+        ps.useAllocationSites(True)
+        ps.checkString('''
+class A:
+    def __init__(self, v):
+        self.v = v
+
+def make(v):
+    return A(v)
+
+a = make(1)
+b = make('s')
+c = A(2)
+''')
+        (a,) = self.objects('a')
+        (b,) = self.objects('b')
+        (c,) = self.objects('c')
+        self.assertTrue(a is b)
+        self.assertFalse(a is c)
+        self.assertNotEqual(a, c)
+        # weak updates, the site has seen both values
+        self.assertEqual([1, 's'], [getattr(t, 'n', getattr(t, 's', None))
+                                    for t in a.attrs['v']])
+
+    def test_context_splits_sites(self):
+        ps.useAllocationSites(True, 1)
+        ps.checkString('''
+class A:
+    pass
+
+def make():
+    return A()
+
+a = make()
+b = make()
+''')
+        (a,) = self.objects('a')
+        (b,) = self.objects('b')
+        self.assertFalse(a is b)
+        self.assertNotEqual(a.site, b.site)
+
+
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.test_remove_type']
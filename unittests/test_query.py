@@ -0,0 +1,198 @@
+import unittest
+import pysonar as ps
+from query import QueryIndex
+
+
+SOURCE = '''
+class Conn:
+    def __init__(self, host):
+        self.host = host
+
+    def send(self, data):
+        return data
+
+class Other:
+    def run(self, x):
+        return x
+
+def log(msg):
+    out = msg
+    return out
+
+def config(o):
+    o.name = 'db'
+
+def connect(o):
+    c = Conn(o.name)
+    c.send('hello')
+
+class Holder:
+    pass
+
+h = Holder()
+config(h)
+log('start')
+connect(h)
+Other().run(1)
+r = log('used')
+'''
+
+
+def records():
+    return dict((name, [(map(ps.projectTypes, ctorargs),
+                         map(ps.projectTypes, callargs))
+                        for (ctorargs, callargs, _) in rs])
+                for (name, rs) in ps.getMethodInvocationInfo().items() if rs)
+
+
+class TestQueryIndex(unittest.TestCase):
+
+    def relevant(self, source, classes):
+        index = QueryIndex(classes)
+        index.add(ps.ast.parse(source))
+        return sorted(d.name for d in index.defs.values() if d.relevant)
+
+    def test_reaching_functions(self):
+        self.assertEqual(['config', 'connect'],
+                         self.relevant(SOURCE, ['Conn']))
+        # Other is instantiated at module level only
+        self.assertEqual([], self.relevant(SOURCE, ['Other']))
+
+    def test_through_calls_and_attributes(self):
+        source = '''
+class A:
+    def m(self, x):
+        pass
+
+def top(o):
+    middle(o)
+
+def middle(o):
+    o.a.m(o.value)
+
+def setValue(o):
+    o.value = 1
+
+def setOther(o):
+    o.other = 1
+'''
+        self.assertEqual(['middle', 'setValue', 'top'],
+                         self.relevant(source, ['A']))
+
+    def test_through_constructors(self):
+        source = SOURCE + '''
+class Wrapper:
+    def __init__(self, host):
+        self.conn = Conn(host)
+        self.conn.send('hi')
+
+def wrap():
+    Wrapper('db')
+'''
+        self.assertEqual(['__init__', 'config', 'connect', 'wrap'],
+                         self.relevant(source, ['Conn']))
+
+    def test_through_function_values(self):
+        source = SOURCE + '''
+def helper(c):
+    c.send('payload')
+
+def run(fn, c):
+    fn(c)
+
+def pick():
+    return helper
+
+def sizes(l):
+    return len(l) + len(l.keys())
+'''
+        # fn may be any function, pick refers to helper
+        self.assertEqual(['config', 'connect', 'helper', 'pick', 'run'],
+                         self.relevant(source, ['Conn']))
+
+    def test_unused_results(self):
+        tree = ps.ast.parse('''
+def f():
+    a = g()
+    b = g()
+    g()
+    return b
+
+x = g()
+''')
+        QueryIndex(['A']).add(tree)
+        calls = [n for n in ps.ast.walk(tree) if ps.IS(n, ps.Call)]
+        self.assertEqual([(3, True), (4, False), (5, True), (8, False)],
+                         sorted((c.lineno, getattr(c, 'unused', False))
+                                for c in calls))
+
+
+class TestQuery(unittest.TestCase):
+
+    def tearDown(self):
+        ps.setQuery(None)
+
+    def test_same_records_for_the_queried_class(self):
+        ps.checkString(SOURCE)
+        full = records()
+        self.assertEqual(0, ps.getWorkCounters()['skipped'])
+        ps.setQuery(['Conn'])
+        ps.checkString(SOURCE)
+        self.assertEqual({'Conn': full['Conn']}, records())
+        # log('start'), Other().run(1) and c.send('hello')
+        self.assertEqual(3, ps.getWorkCounters()['skipped'])
+
+    def test_instantiation_of_a_wrapper(self):
+        source = '''
+class Conn:
+    def send(self, data):
+        return data
+
+class Wrapper:
+    def __init__(self, data):
+        Conn().send(data)
+
+def wrap():
+    Wrapper('hi')
+
+wrap()
+'''
+        ps.checkString(source)
+        full = records()
+        ps.setQuery(['Conn'])
+        ps.checkString(source)
+        self.assertEqual({'Conn': full['Conn']}, records())
+        # only the body of send
+        self.assertEqual(1, ps.getWorkCounters()['skipped'])
+
+    def test_higher_order_calls(self):
+        source = '''
+class Conn:
+    def send(self, data):
+        return data
+
+def helper(c):
+    c.send('payload')
+
+def run(fn, c):
+    fn(c)
+
+run(helper, Conn())
+'''
+        ps.checkString(source)
+        full = records()
+        ps.setQuery(['Conn'])
+        ps.checkString(source)
+        self.assertEqual({'Conn': [([], [[['str', 'payload']]])]}, full)
+        self.assertEqual(full, records())
+
+    def test_parsed_again(self):
+        ps.imported_modules.clear()
+        ps.setQuery(['Conn'])
+        ps.checkString(SOURCE)
+        ps.checkString('def f():\n    pass\n')
+        self.assertEqual(['f'], [d.name for d in ps.queryIndex.defs.values()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import unittest
+import pysonar as ps
+from tasty import PysonarTest, find_in_history
+
+
+class TestSummaries(PysonarTest):
+
+    def tearDown(self):
+        ps.useSummaries(True)
+
+    def test_repeated_call_is_replayed(self):
+        ps.checkString('''
+def f(x):
+    y = x
+    return y
+
+a = f(1)
+b = f(1)
+''')
+        self.assertEqual({'hits': 1, 'misses': 1, 'size': 1},
+                         ps.getSummaryStats())
+        # both call sites pass the same constant
+        self.assertTrue(find_in_history('b', ps)[0]
+                        is find_in_history('a', ps)[0])
+
+    def test_attribute_writes_go_to_the_new_object(self):
+        ps.checkString('''
+class A:
+    def __init__(self, p):
+        self.p = p
+
+a1 = A(1)
+a2 = A(1)
+''')
+        self.assertEqual(1, ps.getSummaryStats()['hits'])
+        a1 = find_in_history('a1', ps)[0]
+        a2 = find_in_history('a2', ps)[0]
+        self.assertFalse(a1 is a2)
+        self.assertNum(1, a2.attrs['p'][0])
+        self.assertEqual([6, 7], [node.lineno for node
+                                  in ps.getConstSites(a2.attrs['p'][0])])
+
+    def test_method_invocations_are_replayed(self):
+        s = '''
+class A:
+    def m(self, x):
+        return x
+
+def use(a):
+    a.m('arg')
+
+use(A())
+use(A())
+'''
+        ps.checkString(s)
+        self.assertEqual(1, ps.getSummaryStats()['hits'])
+        self.assertEqual(2, len(ps.getMethodInvocationInfo()['A']))
+
+    def test_invocations_keep_their_ctorargs(self):
+        ps.checkString('''
+class H:
+    def __init__(self, name):
+        pass
+
+    def set(self, v):
+        pass
+
+def use(h):
+    h.set(1)
+
+use(H('a'))
+use(H('b'))
+''')
+        # the objects differ in their ctorargs only
+        self.assertEqual(0, ps.getSummaryStats()['hits'])
+        self.assertEqual(['a', 'a', 'b', 'b'],
+                         sorted(ctorargs[0][0].s for (ctorargs, _, _)
+                                in ps.getMethodInvocationInfo()['H']))
+
+    def test_key_of_an_object_skips_its_methods(self):
+        def source(methods):
+            lines = ['class Big:',
+                     '    def __init__(self, v):',
+                     '        self.v = v']
+            for i in xrange(methods):
+                lines += ['    def m%d(self):' % i, '        return %d' % i]
+            lines += ['def make(i):', '    return Big(i)']
+            lines += ['o%d = make(%d)' % (i, i) for i in xrange(20)]
+            return '\n'.join(lines) + '\n'
+        visited = []
+        for methods in (10, 200):
+            ps.checkString(source(methods))
+            visited.append(sum(len(s.leaves)
+                               for s in ps.summaries.values()))
+        self.assertEqual(visited[0], visited[1])
+
+    def test_changed_global_object_invalidates(self):
+        ps.checkString('''
+class Conf:
+    pass
+
+conf = Conf()
+conf.v = 1
+
+def get():
+    return conf.v
+
+a = get()
+conf.v = 2
+b = get()
+''')
+        self.assertEqual(0, ps.getSummaryStats()['hits'])
+        self.assertNum(2, find_in_history('b', ps)[0].clo[0])
+
+    def test_changed_class_invalidates(self):
+        ps.checkString('''
+class Conf:
+    v = 1
+
+conf = Conf()
+
+def get():
+    return conf.v
+
+a = get()
+Conf.v = 2
+b = get()
+''')
+        # conf reads v through to its class
+        self.assertEqual(0, ps.getSummaryStats()['hits'])
+        self.assertNum(2, find_in_history('b', ps)[0].clo[0])
+
+    def test_same_history_without_summaries(self):
+        def run(flag):
+            ps.useSummaries(flag)
+            ps.checkFile('tests/performance_issue.py')
+            return sorted('%r %r' % (k, set(map(repr, v)))
+                          for k, v in ps.history.items())
+        self.assertEqual(run(False), run(True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import logging
+import unittest
+from StringIO import StringIO
+import pysonar as ps
+
+
+class Loud:
+    '''counts how often it is printed'''
+    printed = 0
+
+    def __str__(self):
+        Loud.printed += 1
+        return 'loud'
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        Loud.printed = 0
+        self.level = ps.logger.level
+
+    def tearDown(self):
+        ps.disableTracing()
+        ps.logger.setLevel(self.level)
+
+    def test_off_formats_nothing(self):
+        ps.debug('value', Loud())
+        ps.checkString('x = 1\ny = x')
+        self.assertEqual(0, Loud.printed)
+        self.assertFalse(ps.TRACING)
+
+    def test_ring_keeps_the_last_messages(self):
+        ps.logger.setLevel(logging.WARN)
+        ps.enableTracing(ring=3)
+        for i in range(5):
+            ps.debug('message', i, Loud())
+        self.assertEqual(0, Loud.printed)   # only formatted when dumped
+        out = StringIO()
+        ps.dumpTrace(out)
+        self.assertEqual(['DEBUG: message 2 loud', 'DEBUG: message 3 loud',
+                          'DEBUG: message 4 loud'],
+                         out.getvalue().splitlines())
+
+    def test_messages_are_formatted_by_the_handler(self):
+        out = StringIO()
+        handler = logging.StreamHandler(out)
+        ps.logger.addHandler(handler)
+        try:
+            ps.logger.setLevel(logging.DEBUG)
+            ps.enableTracing()
+            ps.debug('value', Loud())
+            ps.warn('careful', 1)
+        finally:
+            ps.logger.removeHandler(handler)
+        self.assertEqual(['value loud', 'careful 1'],
+                         out.getvalue().splitlines())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import pysonar as ps
+from tasty import PysonarTest, find_in_history
+
+
+def loop_over(values):
+    return '''
+l = [%s]
+for v in l:
+    r = v
+''' % ', '.join(values)
+
+
+def objects(a, b):
+    return '''
+class A:
+    def __init__(self, v):
+        self.v = v
+
+class B:
+    pass
+
+l = [%s]
+for o in l:
+    r = o
+''' % ', '.join(['A(%d)' % i for i in xrange(a)] + ['B()'] * b)
+
+
+def numbers(ts):
+    values = set()
+    for t in ts:
+        values.update(getattr(t, 'values', [getattr(t, 'n', None)]))
+    return sorted(values)
+
+
+class TestWidening(PysonarTest):
+
+    def tearDown(self):
+        ps.setWidenLimit(256)
+
+    def test_constants_collapse_into_a_set(self):
+        ps.setWidenLimit(10)
+        ps.checkString(loop_over(["'s%d'" % (i % 20) for i in xrange(40)]
+                                 + ['1', '2']))
+        r = find_in_history('r', ps)
+        self.assertEqual(2, len(r))
+        self.assertEqual(ps.ConstSetType('str', ['s%d' % i
+                                                 for i in xrange(20)]), r[0])
+        self.assertEqual(ps.ConstSetType('num', [1, 2]), r[1])
+        self.assertTrue(ps.nWidened > 0)
+
+    def test_small_unions_are_kept(self):
+        ps.setWidenLimit(10)
+        ps.checkString(loop_over(["'a'", "'b'"]))
+        r = find_in_history('r', ps)
+        self.assertEqual(['a', 'b'], [s.s for s in r])
+        self.assertEqual(0, ps.nWidened)
+
+    def test_widening_can_be_turned_off(self):
+        ps.setWidenLimit(None)
+        ps.checkString(loop_over(["'s%d'" % i for i in xrange(300)]))
+        self.assertEqual(300, len(find_in_history('r', ps)))
+
+    def test_objects_collapse_per_class(self):
+        ps.setWidenLimit(10)
+        ps.checkString(objects(20, 20))
+        r = find_in_history('r', ps)
+        self.assertEqual(['A', 'B'], [o.classtype.name for o in r])
+        self.assertTrue(ps.IS(r[0], ps.SiteObjType))
+        # the attributes and ctorargs of all of them
+        self.assertEqual(range(20), numbers(r[0].attrs['v']))
+        self.assertEqual(range(20), numbers(r[0].ctorargs[0]))
+
+    def test_many_objects(self):
+        ps.checkString(objects(300, 0))
+        # a widened union has room for more members, before each new
+        # object past the limit widened it again: 179 times, 49175 merges
+        self.assertTrue(ps.nWidened < 20, ps.nWidened)
+        self.assertTrue(ps.getWorkCounters()['union'] < 20 * 300)
+
+    def test_other_types_past_the_limit(self):
+        u = ps.widen(ps.TypeSet([ps.PrimType(i) for i in xrange(5)]))
+        self.assertEqual(5, len(u))
+        ps.setWidenLimit(3)
+        u = ps.widen(ps.TypeSet([ps.PrimType(i) for i in xrange(5)]))
+        # cut to half the limit, the next member doesn't widen again
+        self.assertEqual([ps.PrimType(0), ps.PrimType('PrimType')], u)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import pysonar as ps
+from tasty import find_in_history
+
+
+def analyze(s, engine):
+    ps.setEngine(engine)
+    try:
+        ret = ps.checkString(s)
+    finally:
+        ps.setEngine('recursive')
+    history = sorted('%r %r' % (k, v) for k, v in ps.history.items())
+    return (repr(ret), history)
+
+
+class TestWorklistEngine(unittest.TestCase):
+
+    def assertSameResults(self, s):
+        self.assertEqual(analyze(s, 'recursive'), analyze(s, 'worklist'))
+
+    def test_branches(self):
+        self.assertSameResults('''
+def f(x):
+    if x:
+        x = 1
+    else:
+        x = 'zero'
+    y = x
+    return y
+
+f(1)
+''')
+
+    def test_return_in_branch_and_dead_code(self):
+        self.assertSameResults('''
+def f(x):
+    for e in [1, 2]:
+        if e:
+            return e
+            unreachable = 1
+        x = e
+    while x:
+        return 'w'
+    return x
+
+r = f(3)
+''')
+
+    def test_try_and_with(self):
+        self.assertSameResults('''
+def f(x):
+    try:
+        y = x
+    except ValueError:
+        return 1
+    else:
+        return y
+    with x:
+        z = 2
+    return z
+
+r = f(3)
+''')
+
+    def test_long_module_does_not_recurse(self):
+        s = '\n'.join('x%d = %d' % (i, i) for i in xrange(5000))
+        ps.setEngine('worklist')
+        try:
+            ps.checkString(s + '\nlast = x4999')
+        finally:
+            ps.setEngine('recursive')
+        self.assertEqual(4999, find_in_history('last', ps)[0].n)
+
+
+if __name__ == "__main__":
+    unittest.main()